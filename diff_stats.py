@@ -0,0 +1,143 @@
+"""
+Diff line statistics for the SCM-Manager cell of git.py: (added, removed, files) of a
+git/hg/svn diff. count_diff_stats() is the reference rule over decoded text;
+DiffStatsCounter gives the same result on raw bytes streamed in chunks.
+Kept out of the notebook export so it can be imported and tested (tests/test_diff_stats.py).
+"""
+import re
+
+def _count_diff_lines(lines, files):
+    """+/- lines of a run of diff lines; file header lines are added to files."""
+    added = removed = 0
+
+    # file boundary heuristics for git/hg/svn-ish diffs
+    # - git: "diff --git a/... b/..."
+    # - svn: "Index: path"
+    # - hg: "diff -r ..." often followed by "diff --git" too in some modes
+    for line in lines:
+        if line.startswith("diff --git "):
+            files.add(line.strip())
+            continue
+        if line.startswith("Index: "):
+            files.add(line.strip())
+            continue
+
+        # line counts: ignore headers
+        if line.startswith("+++ ") or line.startswith("--- "):
+            continue
+        if line.startswith("+"):
+            added += 1
+        elif line.startswith("-"):
+            removed += 1
+
+    return added, removed
+
+def count_diff_stats(diff_text):
+    files = set()
+    added, removed = _count_diff_lines(diff_text.splitlines(), files)
+    return added, removed, len(files)
+
+DIFF_MARKERS = (b"diff --git", b"@@", b"Index:", b"---")
+# line breaks str.splitlines() knows besides \n and \r\n (a lone \r is checked apart), UTF-8 encoded
+OTHER_LINE_BREAKS = b"\x0b\x0c\x1c\x1d\x1e"
+OTHER_LINE_BREAKS_UTF8 = (b"\xc2\x85", b"\xe2\x80\xa8", b"\xe2\x80\xa9")
+ANY_LINE_BREAK = re.compile(rb"\r\n?|\n|[\x0b\x0c\x1c\x1d\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]")
+# after a \n: file header lines (group 1) and the +++/--- lines that are not counted
+HEADER_LINE = re.compile(rb"\n(?:(diff --git |Index: )[^\n]*|\+\+\+ |--- )")
+
+def _plain_newlines(data):
+    """True when \n (or \r\n) is the only kind of line break in data."""
+    # single bytes are found with memchr; the UTF-8 breaks only need a look when their last byte occurs
+    if any(b in data for b in OTHER_LINE_BREAKS):
+        return False
+    if any(br[-1] in data for br in OTHER_LINE_BREAKS_UTF8) and any(br in data for br in OTHER_LINE_BREAKS_UTF8):
+        return False
+    return b"\r" not in data or data.count(b"\r") == data.count(b"\r\n")
+
+class DiffStatsCounter:
+    """
+    count_diff_stats() over raw bytes that arrive in chunks. feed() counts the complete
+    lines of each chunk and keeps only the unterminated last one, so memory does not grow
+    with the diff. Lines are counted without decoding or a per-line loop: "\n+" and "\n-"
+    occurrences, minus the "+++ "/"--- " lines that one HEADER_LINE scan finds together
+    with the file headers; only text with other line breaks (lone \r, \x0c, U+2028, ...)
+    goes through the decoded count_diff_stats() rules.
+    A body starting with "{" (JSON diff) is kept whole instead and looked at in close().
+    Past max_bytes feed() returns False and the counts cover the part read (truncated).
+    A run without \n longer than long_line_bytes is cut at its last line break of any kind.
+    """
+    def __init__(self, max_bytes=None, long_line_bytes=64 * 1024):
+        self.max_bytes = max_bytes
+        self.long_line_bytes = long_line_bytes
+        self.nbytes = 0
+        self.truncated = False
+        self.added = self.removed = 0
+        self.files = set()
+        self.is_diff = False      # saw one of DIFF_MARKERS
+        self.json_text = None     # whole body, when it is JSON
+        self._json_parts = None
+        self._partial = b""       # unterminated last line of the previous chunk
+        self._started = False
+
+    def feed(self, chunk):
+        if self.max_bytes is not None and self.nbytes + len(chunk) > self.max_bytes:
+            chunk = chunk[:self.max_bytes - self.nbytes]
+            self.truncated = True
+        self.nbytes += len(chunk)
+        if not chunk:
+            return not self.truncated
+        if not self._started:
+            self._started = True
+            if chunk.startswith(b"{"):
+                self._json_parts = []
+        if self._json_parts is not None:
+            self._json_parts.append(chunk)
+            return not self.truncated
+
+        data = self._partial + chunk
+        if not self.is_diff:
+            self.is_diff = any(m in data for m in DIFF_MARKERS)
+        cut = data.rfind(b"\n") + 1
+        if len(data) - cut > self.long_line_bytes:
+            # a long run without \n: diff with old-Mac \r (or other) line breaks
+            for m in ANY_LINE_BREAK.finditer(data, cut):
+                cut = m.end()
+        self._partial = data[cut:]
+        self._count(data[:cut])
+        return not self.truncated
+
+    def close(self):
+        if self._json_parts is not None:
+            body = b"".join(self._json_parts)
+            if any(m in body for m in DIFF_MARKERS):
+                # diff markers win over JSON, as for a buffered body
+                self.is_diff = True
+                self._count(body)
+            else:
+                self.json_text = body.decode("utf-8", errors="replace")
+        else:
+            self._count(self._partial)
+            self._partial = b""
+        return self
+
+    def result(self):
+        return self.added, self.removed, len(self.files)
+
+    def _count(self, data):
+        if not data:
+            return
+        if not _plain_newlines(data):
+            added, removed = _count_diff_lines(data.decode("utf-8", errors="replace").splitlines(), self.files)
+        else:
+            data = b"\n" + data
+            added = data.count(b"\n+")
+            removed = data.count(b"\n-")
+            for m in HEADER_LINE.finditer(data):
+                if m.group(1):
+                    self.files.add(m.group()[1:].decode("utf-8", errors="replace").strip())
+                elif m.group()[1] == 0x2B:   # "+++ "
+                    added -= 1
+                else:
+                    removed -= 1
+        self.added += added
+        self.removed += removed
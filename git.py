@@ -5,13 +5,15 @@
 
 
 # Bitbucket Server / Data Center developer KPI (weekly) from commits + lines added/removed
-# Run this as ONE Jupyter cell. No pip installs. Uses stdlib (+ pandas/matplotlib if available).
+# Run this as ONE Jupyter cell. No pip installs. Uses stdlib (+ pandas/matplotlib/pyarrow if available).
 
-import base64, json, math, os, re, sys, time
+import asyncio, base64, gzip, http.client, io, json, math, os, queue, random, re, shutil, sqlite3, ssl, sys, threading, time
 from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager, contextmanager
 from getpass import getpass
-from urllib.parse import urlencode, urljoin
-from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from urllib.parse import quote, urlencode, urljoin, urlsplit
+from array import array
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # -----------------------------
@@ -22,10 +24,44 @@ DAYS_BACK = 90                           # how far back to look
 TOP_N_DEVS = 10                          # show top N developers in charts
 MAX_REPOS = None                         # e.g. 50 to limit; None = all discovered repos
 MAX_COMMITS_PER_REPO = None              # e.g. 2000; None = no hard cap (will still stop at cutoff date)
+ENGINE = "threads"                       # "threads" or "asyncio" (one thread, ASYNC_CONCURRENCY requests in flight)
 MAX_WORKERS = 12                         # threads for fetching per-commit change stats
+ASYNC_CONCURRENCY = 100                  # ENGINE="asyncio": max concurrent requests (global semaphore)
+LIST_WORKERS = 6                         # threads for listing commits across repos (runs alongside MAX_WORKERS)
+TASK_QUEUE_SIZE = 2000                   # bounded hand-off listing -> change-stat threads (caps memory in flight)
 REQUEST_TIMEOUT_SEC = 60
-SLEEP_BETWEEN_REQUESTS_SEC = 0.0         # set e.g. 0.05 if your server throttles
+PAGE_LIMIT_MIN = 25                      # paged listings adapt their limit per endpoint between MIN and MAX:
+PAGE_LIMIT_MAX = 1000                    #   doubled while full pages arrive within PAGE_FAST_SEC, halved on
+PAGE_FAST_SEC = 1.0                      #   pages slower than PAGE_SLOW_SEC or timeouts; the next page is
+PAGE_SLOW_SEC = 10.0                     #   fetched in the background while the current one is consumed
+RATE_LIMIT_RPS = 50.0                    # starting request rate across ALL threads; adapts between MIN and MAX
+RATE_LIMIT_MIN_RPS = 2.0                 #   backs off on HTTP 429/503, timeouts or rising latency,
+RATE_LIMIT_MAX_RPS = 400.0               #   ramps back up while responses are healthy
+RETRY_MAX_ATTEMPTS = 5                   # per request; timeouts, resets, 429 and 5xx are retried with jittered backoff
+RETRY_BASE_SEC = 0.5                     # backoff: random(0, min(RETRY_MAX_SEC, RETRY_BASE_SEC * 2**attempt))
+RETRY_MAX_SEC = 30.0
+BREAKER_FAILURES = 20                    # consecutive transient failures that open an endpoint's circuit breaker
+BREAKER_COOLDOWN_SEC = 30.0              # an open breaker fails fast this long, then lets a probe request through
 VERIFY_SSL = True                        # only relevant if you change to https in an environment that validates certs
+STATE_DIR = ".bb_kpi_state"              # local state (commit stats cache, ...); delete the folder to start from scratch
+USE_STATS_CACHE = True                   # reuse per-commit change stats from earlier runs (commit ids are immutable)
+INCREMENTAL = True                       # list only commits newer than the last run's high-water mark per repo;
+                                         # older commits in the window come from STATE_DIR; repos whose default
+                                         # branch still points at the mark are not listed at all
+REPO_CACHE_TTL_SEC = 24 * 3600           # reuse the discovered repo list from STATE_DIR this long; 0 = rediscover every run
+CHECKPOINT_EVERY_SEC = 30                # collected state goes to STATE_DIR in one transaction at most this far apart
+RESUME = True                            # continue commit listings an interrupted run left half-way (below the last
+                                         # commit it got to); False = start them over
+EXPORT_FORMAT = "parquet"                # columnar copy of the CSV exports when pyarrow is installed: "parquet" (commit
+                                         # detail partitioned by project), "feather" (Arrow IPC) or None = CSV only
+DASHBOARD_DB = None                      # path of the dashboard's SQLite database (e.g. "data/devmetrics.sqlite") to
+                                         # upsert the collected commits into (server/database.ts schema, created if
+                                         # missing); None = don't. The repo's copy is tracked: point it there on purpose
+DEVELOPER_IDS = {                        # author name -> developer id in DASHBOARD_DB (as DEVELOPER_ID_MAP in server/sync.ts)
+    "=Ilia Lomsadze": "Ilia",
+    "vumpy": "gchutlashvili",
+    "GChutlashvili": "gchutlashvili",
+}
 
 # -----------------------------
 # Auth (avoid hardcoding password)
@@ -48,6 +84,11 @@ try:
 except Exception:
     plt = None
 
+try:
+    import pyarrow
+except Exception:
+    pyarrow = None
+
 # -----------------------------
 # HTTP helpers (stdlib only)
 # -----------------------------
@@ -57,49 +98,592 @@ def _basic_auth_header(user, pw):
 
 AUTH_HEADER = _basic_auth_header(USER, PASSWORD)
 
+# Persistent HTTP/1.1 connections: one per (thread, host), reused across calls
+_http_local = threading.local()
+
+def _pooled_connection(scheme, netloc):
+    conns = getattr(_http_local, "conns", None)
+    if conns is None:
+        conns = _http_local.conns = {}
+    conn = conns.get((scheme, netloc))
+    if conn is None:
+        if scheme == "https":
+            ctx = ssl.create_default_context() if VERIFY_SSL else ssl._create_unverified_context()
+            conn = http.client.HTTPSConnection(netloc, timeout=REQUEST_TIMEOUT_SEC, context=ctx)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=REQUEST_TIMEOUT_SEC)
+        conns[(scheme, netloc)] = conn
+    return conn
+
+def pooled_get(url, headers, max_redirects=5):
+    """
+    GET over this thread's keep-alive connection to the url's host; returns the body
+    bytes (gunzipped). Raises HTTPError on 4xx/5xx like urlopen does. A connection the
+    server dropped in between (reset / closed keep-alive) is reopened and the request resent once.
+    """
+    h = dict(headers)
+    h["Accept-Encoding"] = "gzip"
+    h["Connection"] = "keep-alive"
+    for _ in range(max_redirects + 1):
+        parts = urlsplit(url)
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        for attempt in (1, 2):
+            conn = _pooled_connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", target, headers=h)
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                conn.close()
+                if attempt == 2:
+                    raise
+            except Exception:
+                conn.close()   # e.g. timeout mid-response: the connection state is unknown
+                raise
+        if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+            body = gzip.decompress(body)
+        if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+            url = urljoin(url, resp.getheader("Location"))
+            continue
+        if resp.status >= 400:
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+        return body
+    raise HTTPError(url, resp.status, "too many redirects", resp.headers, io.BytesIO(body))
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every thread/coroutine, so the aggregate request rate is
+    what gets controlled. The rate adapts AIMD-style: it is halved on 429/503,
+    timeouts and resets, cut by 20% when latency climbs to 2x its baseline, and
+    grows ~10%/s while responses are healthy. Latency is tracked per endpoint class
+    (listings vs. /changes), so slow-but-normal calls of one kind do not
+    read as congestion against the baseline of another.
+    """
+    def __init__(self, rps, min_rps, max_rps):
+        self.rate = float(rps)
+        self.min_rps, self.max_rps = float(min_rps), float(max_rps)
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        self.latency = {}          # endpoint class -> fast EWMA of healthy latency
+        self.baseline = {}         # endpoint class -> slow EWMA of healthy latency
+        self.hold_until = 0.0      # one back-off per second at most
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Takes one token; returns how long the caller has to wait before sending."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1.0
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def _back_off(self, now, factor):
+        if now >= self.hold_until:
+            self.rate = max(self.min_rps, self.rate * factor)
+            self.hold_until = now + 1.0
+
+    def observe(self, latency_sec, exc=None, kind="list"):
+        """kind: endpoint class; latency is only held against the baseline of its own class."""
+        with self.lock:
+            now = time.monotonic()
+            if exc is not None:
+                if not isinstance(exc, HTTPError) or exc.code in (429, 503):
+                    self._back_off(now, 0.5)
+                return
+            latency = self.latency[kind] = 0.7 * self.latency.get(kind, latency_sec) + 0.3 * latency_sec
+            baseline = self.baseline[kind] = 0.98 * self.baseline.get(kind, latency_sec) + 0.02 * latency_sec
+            if latency > 2 * baseline and latency > 0.05:
+                self._back_off(now, 0.8)
+            elif now >= self.hold_until:
+                self.rate = min(self.max_rps, self.rate + 0.1)
+
+    @contextmanager
+    def request(self, kind="list"):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        t0 = time.monotonic()
+        try:
+            yield
+        except (OSError, http.client.HTTPException) as e:   # HTTPError, timeouts, resets
+            self.observe(time.monotonic() - t0, e)
+            raise
+        self.observe(time.monotonic() - t0, kind=kind)
+
+    @asynccontextmanager
+    async def arequest(self, kind="list"):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        t0 = time.monotonic()
+        try:
+            yield
+        except (OSError, http.client.HTTPException, asyncio.IncompleteReadError) as e:
+            self.observe(time.monotonic() - t0, e)
+            raise
+        self.observe(time.monotonic() - t0, kind=kind)
+
+rate_limiter = AdaptiveRateLimiter(RATE_LIMIT_RPS, RATE_LIMIT_MIN_RPS, RATE_LIMIT_MAX_RPS)
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class CircuitBreaker:
+    """
+    Per endpoint (path with ids stripped): after BREAKER_FAILURES consecutive transient
+    failures, requests fail fast with CircuitOpenError for BREAKER_COOLDOWN_SEC. After
+    that one request is let through again; a failure re-opens the breaker right away.
+    """
+    def __init__(self, failures, cooldown_sec):
+        self.failures, self.cooldown_sec = failures, cooldown_sec
+        self.state = {}    # endpoint -> [consecutive failures, open until (monotonic)]
+        self.lock = threading.Lock()
+
+    def check(self, endpoint):
+        with self.lock:
+            fails, open_until = self.state.get(endpoint, (0, 0.0))
+            if fails >= self.failures and time.monotonic() < open_until:
+                raise CircuitOpenError(f"circuit open for {endpoint} ({fails} consecutive failures)")
+
+    def success(self, endpoint):
+        with self.lock:
+            self.state.pop(endpoint, None)
+
+    def failure(self, endpoint):
+        with self.lock:
+            st = self.state.setdefault(endpoint, [0, 0.0])
+            st[0] += 1
+            if st[0] >= self.failures:
+                st[1] = time.monotonic() + self.cooldown_sec
+
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN_SEC)
+
+def _endpoint_key(path):
+    return re.sub(r"/(projects|repos|commits)/[^/]+", r"/\1/*", path)
+
+def _endpoint_class(endpoint):
+    """Latency class of an _endpoint_key() for the rate limiter: changes or list."""
+    return "changes" if endpoint.endswith("/changes") else "list"
+
+def is_transient(exc):
+    """Worth retrying: timeouts, resets/dropped connections, 429 and 5xx."""
+    if isinstance(exc, HTTPError):
+        return exc.code == 429 or exc.code >= 500
+    return isinstance(exc, (OSError, http.client.HTTPException, asyncio.IncompleteReadError))
+
+def retry_delay(attempt, exc):
+    """Full-jitter exponential backoff; honours Retry-After on 429/503."""
+    delay = random.uniform(0, min(RETRY_MAX_SEC, RETRY_BASE_SEC * 2 ** attempt))
+    retry_after = exc.headers.get("Retry-After") if isinstance(exc, HTTPError) and exc.headers else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(RETRY_MAX_SEC, float(retry_after)))
+    return delay
+
+def retry_pause(errors):
+    """
+    Wait before a second pass over failed requests: none when every failure was permanent
+    (4xx, bad data), else the backoff of one more retry - the breaker cooldown if one was open.
+    """
+    waits = [retry_delay(RETRY_MAX_ATTEMPTS, e) for e in errors if is_transient(e)]
+    if any(isinstance(e, CircuitOpenError) for e in errors):
+        waits.append(BREAKER_COOLDOWN_SEC)
+    return max(waits, default=0.0)
+
 def bb_get_json(path, params=None):
     """
     GET JSON from Bitbucket.
     path: '/rest/api/1.0/...'
     params: dict
     """
+    return _bb_get_json_timed(path, params)[0]
+
+def _bb_get_json_timed(path, params=None, retry_timeouts=True):
+    """
+    bb_get_json() plus the seconds the answered attempt took (no retries or backoff in it).
+    retry_timeouts=False raises a timeout right away, without a breaker failure: paged
+    requests shrink the page instead of asking for the same size again.
+    """
     if not path.startswith("/"):
         path = "/" + path
     url = BASE_URL.rstrip("/") + path
     if params:
         url += ("?" + urlencode(params, doseq=True))
-    req = Request(url, headers={"Authorization": AUTH_HEADER, "Accept": "application/json"})
-    if SLEEP_BETWEEN_REQUESTS_SEC:
-        time.sleep(SLEEP_BETWEEN_REQUESTS_SEC)
-    with urlopen(req, timeout=REQUEST_TIMEOUT_SEC) as resp:
-        raw = resp.read().decode("utf-8", errors="replace")
-    return json.loads(raw)
+    endpoint = _endpoint_key(path)
+    for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
+        breaker.check(endpoint)
+        try:
+            with rate_limiter.request(_endpoint_class(endpoint)):
+                t0 = time.monotonic()
+                raw = pooled_get(url, {"Authorization": AUTH_HEADER, "Accept": "application/json"})
+                elapsed = time.monotonic() - t0
+        except Exception as e:
+            if not is_transient(e) or not retry_timeouts and isinstance(e, TimeoutError):
+                raise
+            breaker.failure(endpoint)
+            if attempt == RETRY_MAX_ATTEMPTS:
+                raise
+            time.sleep(retry_delay(attempt, e))
+            continue
+        breaker.success(endpoint)
+        return json.loads(raw.decode("utf-8", errors="replace")), elapsed
 
-def bb_paginate(path, params=None, limit=100):
+class PageSizer:
+    """
+    Page size per endpoint: doubles while full pages come back within PAGE_FAST_SEC (up to
+    what the server accepts), halves on pages slower than PAGE_SLOW_SEC and on timeouts.
+    The size an endpoint settles at is remembered in the capabilities table and is where
+    the next listing (and run) starts.
+    """
+    def __init__(self, min_size, max_size):
+        self.min_size, self.max_size = min_size, max_size
+        self.sizes = {}         # endpoint -> current size
+        self.server_max = {}    # endpoint -> largest size the server answered with
+        self.lock = threading.Lock()
+
+    def size(self, endpoint, default):
+        with self.lock:
+            if endpoint not in self.sizes:
+                known = capability(SERVER_SCOPE, "page_size:" + endpoint)
+                known_max = capability(SERVER_SCOPE, "page_max:" + endpoint)
+                self.sizes[endpoint] = int(known) if known else default
+                if known_max:
+                    self.server_max[endpoint] = int(known_max)
+            return self.sizes[endpoint]
+
+    def observe(self, endpoint, size, elapsed, count, server_limit=None):
+        """Feedback for one page of count items asked for with size; returns the next size."""
+        with self.lock:
+            if server_limit and server_limit < size and server_limit < self.server_max.get(endpoint, size + 1):
+                self.server_max[endpoint] = server_limit
+                set_capability(SERVER_SCOPE, "page_max:" + endpoint, str(server_limit))
+            top = min(self.max_size, self.server_max.get(endpoint, self.max_size))
+            if elapsed > PAGE_SLOW_SEC:
+                new = max(self.min_size, size // 2)
+            elif count >= size and elapsed < PAGE_FAST_SEC:
+                new = min(top, size * 2)
+            else:
+                new = min(top, self.sizes.get(endpoint, size))
+            return self._set(endpoint, new)
+
+    def timed_out(self, endpoint, size):
+        """Smaller size to retry a page that timed out with, or None at the minimum."""
+        if size <= self.min_size:
+            return None
+        with self.lock:
+            return self._set(endpoint, max(self.min_size, size // 2))
+
+    def _set(self, endpoint, new):
+        if self.sizes.get(endpoint) != new:
+            self.sizes[endpoint] = new
+            set_capability(SERVER_SCOPE, "page_size:" + endpoint, str(new))
+        return new
+
+page_sizer = PageSizer(PAGE_LIMIT_MIN, PAGE_LIMIT_MAX)
+# look-ahead pages only (the page a caller waits for is fetched on its own thread): one per
+# listing thread and per stats thread paging through /changes
+_prefetch_pool = ThreadPoolExecutor(max_workers=LIST_WORKERS + MAX_WORKERS)
+
+def _timed_get_json(path, params):
+    # a page that times out is asked for again smaller (see bb_paginate), not at the same
+    # size; only at the smallest size is the timeout retried like any other request
+    return _bb_get_json_timed(path, params, retry_timeouts=params["limit"] <= page_sizer.min_size)
+
+def bb_paginate(path, params=None, limit=100, more=None):
     """
     Bitbucket Server pagination: values + isLastPage + nextPageStart.
     Yields items from 'values'.
+    The limit (params' or limit) is only the starting size, see PageSizer. The next page
+    is requested in the background as soon as a page arrives, unless more(values) says
+    the caller will stop within this page anyway (e.g. past its cutoff).
     """
     start = 0
     params = dict(params or {})
-    params.setdefault("limit", limit)
-    while True:
-        params["start"] = start
-        data = bb_get_json(path, params=params)
-        for v in data.get("values", []):
-            yield v
-        if data.get("isLastPage", True):
-            break
-        start = data.get("nextPageStart")
-        if start is None:
-            break
+    endpoint = _endpoint_key(path)
+    size = page_sizer.size(endpoint, params.get("limit", limit))
+    pending = None   # look-ahead request for the page at start
+    try:
+        while True:
+            try:
+                if pending is not None:
+                    data, elapsed = pending.result()
+                else:
+                    data, elapsed = _timed_get_json(path, dict(params, start=start, limit=size))
+            except TimeoutError:
+                pending = None
+                size = page_sizer.timed_out(endpoint, size)
+                if size is None:
+                    raise
+                continue
+            pending = None
+            values = data.get("values", [])
+            size = page_sizer.observe(endpoint, size, elapsed, len(values), data.get("limit"))
+            has_next = not data.get("isLastPage", True) and data.get("nextPageStart") is not None
+            if has_next:
+                start = data["nextPageStart"]
+                if more is None or more(values):
+                    pending = _prefetch_pool.submit(_timed_get_json, path, dict(params, start=start, limit=size))
+            for v in values:
+                yield v
+            if not has_next:
+                return
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+# -----------------------------
+# Local state (stdlib sqlite3)
+# -----------------------------
+_state_lock = threading.Lock()
+_state_conn = None
+
+def state_db():
+    """
+    Shared SQLite connection to STATE_DIR/state.sqlite (created on first use).
+    Used from worker threads: callers must hold _state_lock.
+    """
+    global _state_conn
+    if _state_conn is None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(STATE_DIR, "state.sqlite"), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS commit_stats (
+                project       TEXT NOT NULL,
+                repo          TEXT NOT NULL,
+                commit_id     TEXT NOT NULL,
+                lines_added   INTEGER NOT NULL,
+                lines_removed INTEGER NOT NULL,
+                files_changed INTEGER NOT NULL,
+                PRIMARY KEY (project, repo, commit_id)
+            );
+            CREATE TABLE IF NOT EXISTS commits (
+                project   TEXT NOT NULL,
+                repo      TEXT NOT NULL,
+                commit_id TEXT NOT NULL,
+                author    TEXT NOT NULL,
+                email     TEXT NOT NULL,
+                ts_ms     INTEGER NOT NULL,
+                PRIMARY KEY (project, repo, commit_id)
+            );
+            -- commits whose change stats could not be fetched; retried instead of counted as 0 lines
+            CREATE TABLE IF NOT EXISTS failed_commits (
+                project   TEXT NOT NULL,
+                repo      TEXT NOT NULL,
+                commit_id TEXT NOT NULL,
+                error     TEXT NOT NULL,
+                failed_at TEXT NOT NULL,
+                PRIMARY KEY (project, repo, commit_id)
+            );
+            -- what the server supports (probed once, see capability()); scope = server or server|repo
+            CREATE TABLE IF NOT EXISTS capabilities (
+                scope TEXT NOT NULL,
+                name  TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (scope, name)
+            );
+            -- repo list of the last discovery, reused for REPO_CACHE_TTL_SEC (position keeps its order)
+            CREATE TABLE IF NOT EXISTS repos (
+                position  INTEGER NOT NULL,
+                project   TEXT NOT NULL,
+                repo      TEXT NOT NULL,
+                name      TEXT NOT NULL,
+                listed_at REAL NOT NULL,
+                PRIMARY KEY (project, repo)
+            );
+            -- commits of a listing still in progress, newest first; an interrupted run resumes below the last one
+            CREATE TABLE IF NOT EXISTS listing_progress (
+                project   TEXT NOT NULL,
+                repo      TEXT NOT NULL,
+                position  INTEGER NOT NULL,
+                commit_id TEXT NOT NULL,
+                ts_ms     INTEGER NOT NULL,
+                author    TEXT NOT NULL,
+                email     TEXT NOT NULL,
+                PRIMARY KEY (project, repo, position)
+            );
+            -- newest commit seen per repo + oldest timestamp the stored commits are complete from
+            CREATE TABLE IF NOT EXISTS repo_hwm (
+                project         TEXT NOT NULL,
+                repo            TEXT NOT NULL,
+                commit_id       TEXT NOT NULL,
+                ts_ms           INTEGER NOT NULL,
+                covered_from_ms INTEGER NOT NULL,
+                PRIMARY KEY (project, repo)
+            );
+        """)
+        _state_conn = conn
+    return _state_conn
+
+_last_checkpoint = time.monotonic()
+
+def _maybe_commit(db):
+    """
+    Commits the open transaction once CHECKPOINT_EVERY_SEC have passed since the last
+    checkpoint (callers hold _state_lock). Writes in between are only lost all together.
+    """
+    global _last_checkpoint
+    if time.monotonic() - _last_checkpoint >= CHECKPOINT_EVERY_SEC:
+        db.commit()
+        _last_checkpoint = time.monotonic()
+
+def checkpoint():
+    """Commits whatever collected state is still pending."""
+    global _last_checkpoint
+    with _state_lock:
+        state_db().commit()
+        _last_checkpoint = time.monotonic()
+
+def cache_get_stats(projectKey, repoSlug, commit_id):
+    """Cached (added, removed, files) for a commit, or None if never fetched."""
+    with _state_lock:
+        return state_db().execute(
+            "SELECT lines_added, lines_removed, files_changed FROM commit_stats "
+            "WHERE project = ? AND repo = ? AND commit_id = ?",
+            (projectKey, repoSlug, commit_id)).fetchone()
+
+def cache_put_stats(projectKey, repoSlug, commit_id, added, removed, files):
+    with _state_lock:
+        db = state_db()
+        db.execute("INSERT OR REPLACE INTO commit_stats VALUES (?, ?, ?, ?, ?, ?)",
+                   (projectKey, repoSlug, commit_id, added, removed, files))
+        _maybe_commit(db)
+
+def load_hwm(projectKey, repoSlug):
+    """(commit_id, ts_ms, covered_from_ms) of the previous run for this repo, or None."""
+    with _state_lock:
+        return state_db().execute(
+            "SELECT commit_id, ts_ms, covered_from_ms FROM repo_hwm WHERE project = ? AND repo = ?",
+            (projectKey, repoSlug)).fetchone()
+
+def store_commits(projectKey, repoSlug, records, covered_from_ms=None):
+    """
+    Merge newly listed commit records (cid, ts_ms, author, email), newest first,
+    into the stored dataset and move the repo's high-water mark forward.
+    covered_from_ms: set when this listing went all the way down to that timestamp.
+    Ends the repo's listing progress in the same transaction.
+    """
+    with _state_lock:
+        db = state_db()
+        db.executemany("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?, ?)",
+                       [(projectKey, repoSlug, cid, author, email, ts) for cid, ts, author, email in records])
+        prev = db.execute("SELECT commit_id, ts_ms, covered_from_ms FROM repo_hwm WHERE project = ? AND repo = ?",
+                          (projectKey, repoSlug)).fetchone()
+        cid, ts = (records[0][0], records[0][1]) if records else (prev[0], prev[1]) if prev else (None, None)
+        covered = covered_from_ms if covered_from_ms is not None else (prev[2] if prev else None)
+        if cid is not None and covered is not None:
+            db.execute("INSERT OR REPLACE INTO repo_hwm VALUES (?, ?, ?, ?, ?)",
+                       (projectKey, repoSlug, cid, ts, covered))
+        db.execute("DELETE FROM listing_progress WHERE project = ? AND repo = ?", (projectKey, repoSlug))
+        _maybe_commit(db)
+
+def load_progress(projectKey, repoSlug, cutoff_ts_ms):
+    """Commit records (cid, ts_ms, author, email) an interrupted listing got to, newest first."""
+    with _state_lock:
+        return state_db().execute(
+            "SELECT commit_id, ts_ms, author, email FROM listing_progress "
+            "WHERE project = ? AND repo = ? AND ts_ms >= ? ORDER BY position",
+            (projectKey, repoSlug, cutoff_ts_ms)).fetchall()
+
+def save_progress(projectKey, repoSlug, position, record):
+    with _state_lock:
+        db = state_db()
+        db.execute("INSERT OR REPLACE INTO listing_progress VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (projectKey, repoSlug, position, record[0], record[1], record[2], record[3]))
+        _maybe_commit(db)
+
+def clear_progress(projectKey=None, repoSlug=None):
+    """Drops a repo's listing progress (all repos' without arguments)."""
+    with _state_lock:
+        db = state_db()
+        if projectKey is None:
+            db.execute("DELETE FROM listing_progress")
+        else:
+            db.execute("DELETE FROM listing_progress WHERE project = ? AND repo = ?", (projectKey, repoSlug))
+        db.commit()
+
+def progress_summary():
+    """(repos, commits) of listings an interrupted run left half-way."""
+    with _state_lock:
+        return state_db().execute(
+            "SELECT COUNT(DISTINCT project || '/' || repo), COUNT(*) FROM listing_progress").fetchone()
+
+def load_commits(projectKey, repoSlug, cutoff_ts_ms):
+    """Stored commit records (cid, ts_ms, author, email) newer than cutoff, newest first."""
+    with _state_lock:
+        return state_db().execute(
+            "SELECT commit_id, ts_ms, author, email FROM commits "
+            "WHERE project = ? AND repo = ? AND ts_ms >= ? ORDER BY ts_ms DESC",
+            (projectKey, repoSlug, cutoff_ts_ms)).fetchall()
+
+_caps = None   # in-memory copy of the capabilities table
+
+def _load_caps():
+    global _caps
+    if _caps is None:
+        _caps = {(sc, n): v for sc, n, v in state_db().execute("SELECT scope, name, value FROM capabilities")}
+    return _caps
+
+def capability(scope, name):
+    """Remembered probe result (from this or an earlier run), or None if never probed."""
+    with _state_lock:
+        return _load_caps().get((scope, name))
+
+def set_capability(scope, name, value):
+    """Remembers a probe result; it is written with the next checkpoint like other state (page sizes change often)."""
+    with _state_lock:
+        caps = _load_caps()
+        if caps.get((scope, name)) == value:
+            return
+        caps[(scope, name)] = value
+        db = state_db()
+        db.execute("INSERT OR REPLACE INTO capabilities VALUES (?, ?, ?)", (scope, name, value))
+        _maybe_commit(db)
+
+def load_inventory(max_age_sec):
+    """Repo list of a discovery at most max_age_sec ago, in discovery order, or None."""
+    with _state_lock:
+        found = state_db().execute(
+            "SELECT project, repo, name, listed_at FROM repos ORDER BY position").fetchall()
+    if not found or min(r[3] for r in found) < time.time() - max_age_sec:
+        return None
+    return [{"projectKey": pk, "repoSlug": slug, "repoName": name} for pk, slug, name, _ in found]
+
+def store_inventory(repos):
+    with _state_lock:
+        db = state_db()
+        now = time.time()
+        db.execute("DELETE FROM repos")
+        db.executemany("INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?, ?)",
+                       [(i, r["projectKey"], r["repoSlug"], r["repoName"], now) for i, r in enumerate(repos)])
+        db.commit()
+
+def ledger_load():
+    """(project, repo, commit_id) of every commit whose stats failed in an earlier run."""
+    with _state_lock:
+        return {tuple(r) for r in state_db().execute("SELECT project, repo, commit_id FROM failed_commits")}
+
+def ledger_add(task, err):
+    with _state_lock:
+        db = state_db()
+        db.execute("INSERT OR REPLACE INTO failed_commits VALUES (?, ?, ?, ?, ?)",
+                   (*task, f"{type(err).__name__}: {err}", datetime.now(timezone.utc).isoformat()))
+        _maybe_commit(db)
+
+def ledger_clear(task):
+    with _state_lock:
+        db = state_db()
+        db.execute("DELETE FROM failed_commits WHERE project = ? AND repo = ? AND commit_id = ?", task)
+        _maybe_commit(db)
 
 # -----------------------------
 # Repo discovery
 # -----------------------------
 def discover_repos():
     """
-    Returns list of dicts: {projectKey, repoSlug, repoName}
+    Returns list of dicts: {projectKey, repoSlug, repoName, scmId}
     Tries global /repos then falls back to /projects -> /repos.
     """
     repos = []
@@ -110,22 +694,25 @@ def discover_repos():
             slug = r.get("slug")
             name = r.get("name") or slug
             if project and slug:
-                repos.append({"projectKey": project, "repoSlug": slug, "repoName": name})
+                repos.append({"projectKey": project, "repoSlug": slug, "repoName": name, "scmId": r.get("scmId")})
         if repos:
             return repos
     except Exception:
         pass
 
-    # Fallback: enumerate projects then repos
-    for p in bb_paginate("/rest/api/1.0/projects", params={"limit": 100}, limit=100):
-        key = p.get("key")
-        if not key:
-            continue
-        for r in bb_paginate(f"/rest/api/1.0/projects/{key}/repos", params={"limit": 100}, limit=100):
-            slug = r.get("slug")
-            name = r.get("name") or slug
-            if key and slug:
-                repos.append({"projectKey": key, "repoSlug": slug, "repoName": name})
+    # Fallback: enumerate projects, then list their repos concurrently
+    keys = [p.get("key") for p in bb_paginate("/rest/api/1.0/projects", params={"limit": 100}, limit=100)
+            if p.get("key")]
+
+    def project_repos(key):
+        return list(bb_paginate(f"/rest/api/1.0/projects/{key}/repos", params={"limit": 100}, limit=100))
+    with ThreadPoolExecutor(max_workers=LIST_WORKERS) as ex:
+        for key, found in zip(keys, ex.map(project_repos, keys)):
+            for r in found:
+                slug = r.get("slug")
+                name = r.get("name") or slug
+                if slug:
+                    repos.append({"projectKey": key, "repoSlug": slug, "repoName": name, "scmId": r.get("scmId")})
     return repos
 
 # -----------------------------
@@ -151,56 +738,715 @@ def extract_author(c):
     user = user or "unknown"
     return user, (email or "")
 
-def iter_recent_commits(projectKey, repoSlug, cutoff_ts_ms):
+def _listing_goes_on(page, cutoff_ts_ms, stop_at_id):
+    """Whether a commit listing continues past this page (for prefetching the next one)."""
+    if not page:
+        return False
+    last_ts = page[-1].get("authorTimestamp") or page[-1].get("committerTimestamp") or 0
+    return last_ts >= cutoff_ts_ms and not (stop_at_id and any(c.get("id") == stop_at_id for c in page))
+
+def _commit_list_params(until):
+    return {"limit": 100, "until": until} if until else {"limit": 100}
+
+def iter_recent_commits(projectKey, repoSlug, cutoff_ts_ms, stop_at_id=None, until=None):
     """
     Yields commit dicts (Bitbucket format) newer than cutoff.
-    Stops early once older commits encountered.
+    Stops early once older commits encountered, or at stop_at_id (the
+    high-water mark of a previous run; that commit itself is not yielded).
+    until: list below this commit instead of from the branch head (it is not yielded either).
     """
     seen = 0
     for c in bb_paginate(f"/rest/api/1.0/projects/{projectKey}/repos/{repoSlug}/commits",
-                         params={"limit": 100}, limit=100):
+                         params=_commit_list_params(until), limit=100,
+                         more=lambda page: _listing_goes_on(page, cutoff_ts_ms, stop_at_id)):
+        if until and c.get("id") == until:
+            continue
         seen += 1
         ts = c.get("authorTimestamp") or c.get("committerTimestamp") or 0
         if ts < cutoff_ts_ms:
             break
+        if stop_at_id and c.get("id") == stop_at_id:
+            break
         yield c
         if MAX_COMMITS_PER_REPO and seen >= MAX_COMMITS_PER_REPO:
             break
 
+def default_branch_head(projectKey, repoSlug):
+    """Latest commit id on the repo's default branch (one small request), or None if unknown."""
+    try:
+        branch = bb_get_json(f"/rest/api/1.0/projects/{projectKey}/repos/{repoSlug}/branches/default")
+    except Exception:
+        return None
+    return branch.get("latestCommit")
+
+def _change_line_counts(ch):
+    # common keys when withCounts is enabled:
+    # linesAdded / linesRemoved (sometimes linesDeleted)
+    a = ch.get("linesAdded")
+    r = ch.get("linesRemoved")
+    if a is None and "linesInserted" in ch:  # some variants
+        a = ch.get("linesInserted")
+    if r is None and "linesDeleted" in ch:
+        r = ch.get("linesDeleted")
+    return int(a or 0), int(r or 0)
+
+# /changes variants; which one a server (or a single repo) accepts is probed once and remembered
+CHANGES_VARIANTS = {
+    "withCounts": {"limit": 1000, "withCounts": "true"},
+    "plain": {"limit": 1000},
+}
+SERVER_SCOPE = BASE_URL.rstrip("/")
+
+def _changes_variants(projectKey, repoSlug):
+    """Variant names to try, in order: the remembered one first (only it, if it is 'plain')."""
+    known = (capability(f"{SERVER_SCOPE}|{projectKey}/{repoSlug}", "changes_variant")
+             or capability(SERVER_SCOPE, "changes_variant"))
+    if known == "plain":
+        return ["plain"]
+    return ["withCounts", "plain"]
+
+def _changes_variant_worked(projectKey, repoSlug, variant):
+    server_variant = capability(SERVER_SCOPE, "changes_variant")
+    if server_variant is None:
+        set_capability(SERVER_SCOPE, "changes_variant", variant)
+    elif server_variant != variant:
+        # this repo differs from the rest of the server
+        set_capability(f"{SERVER_SCOPE}|{projectKey}/{repoSlug}", "changes_variant", variant)
+
 def get_commit_change_totals(projectKey, repoSlug, commit_id):
     """
     Sum linesAdded/linesRemoved across changed files for the commit.
-    Works best if server supports 'withCounts=true'. If not, returns 0/0.
-    """
-    added = removed = files = 0
-    # Try withCounts=true first
-    paths_to_try = [
-        (f"/rest/api/1.0/projects/{projectKey}/repos/{repoSlug}/commits/{commit_id}/changes",
-         {"limit": 1000, "withCounts": "true"}),
-        (f"/rest/api/1.0/projects/{projectKey}/repos/{repoSlug}/commits/{commit_id}/changes",
-         {"limit": 1000}),
-    ]
+    Every /changes variant (see CHANGES_VARIANTS) is tried until one answers; when none
+    does, the last error is raised. Transient failures (already retried by bb_get_json) are
+    raised right away. Either way the commit goes to the failure ledger, never to 0/0.
+    """
+    path = f"/rest/api/1.0/projects/{projectKey}/repos/{repoSlug}/commits/{commit_id}/changes"
+    last_err = None
+    for variant in _changes_variants(projectKey, repoSlug):
+        added = removed = files = 0
+        try:
+            for ch in bb_paginate(path, params=CHANGES_VARIANTS[variant], limit=500):
+                files += 1
+                a, r = _change_line_counts(ch)
+                added += a
+                removed += r
+        except Exception as e:
+            if is_transient(e) or isinstance(e, CircuitOpenError):
+                raise
+            last_err = e
+            continue
+        _changes_variant_worked(projectKey, repoSlug, variant)
+        return added, removed, files
+    raise last_err
+
+# -----------------------------
+# asyncio engine (ENGINE = "asyncio"): same API calls as coroutines
+# -----------------------------
+class AsyncHTTP:
+    """
+    Minimal keep-alive HTTP/1.1 GET client on asyncio streams (stdlib only).
+    One semaphore caps the requests in flight; idle connections are reused per host.
+    """
+    def __init__(self, concurrency):
+        self.sem = asyncio.Semaphore(concurrency)
+        self.idle = {}   # (scheme, host, port) -> [(reader, writer)]
+
+    async def _open(self, key, fresh=False):
+        """An idle connection to key if there is one (unless fresh), else a new one."""
+        pool = self.idle.get(key)
+        if pool and not fresh:
+            return pool.pop()
+        scheme, host, port = key
+        ctx = None
+        if scheme == "https":
+            ctx = ssl.create_default_context() if VERIFY_SSL else ssl._create_unverified_context()
+        return await asyncio.open_connection(host, port, ssl=ctx)
+
+    @staticmethod
+    async def _roundtrip(conn, parts, headers):
+        reader, writer = conn
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        head = [f"GET {target} HTTP/1.1", f"Host: {parts.netloc}"] + [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("server closed the connection")
+        status = int(status_line.split()[1])
+        raw_headers = b""
+        while True:
+            line = await reader.readline()
+            raw_headers += line
+            if line in (b"\r\n", b"\n", b""):
+                break
+        msg = http.client.parse_headers(io.BytesIO(raw_headers))
+        keep = status_line.startswith(b"HTTP/1.1") and (msg.get("Connection") or "").lower() != "close"
+        if (msg.get("Transfer-Encoding") or "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                try:
+                    size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                except ValueError:   # b"" or garbage: the connection dropped mid-body
+                    raise ConnectionResetError("chunked body cut short") from None
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass   # trailers
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+            body = bytes(body)
+        elif msg.get("Content-Length") is not None:
+            body = await reader.readexactly(int(msg["Content-Length"]))
+        else:
+            body = await reader.read()
+            keep = False
+        return status, msg, body, keep
+
+    async def get(self, url, headers, max_redirects=5):
+        """Same contract as pooled_get: gunzipped body bytes, HTTPError on 4xx/5xx."""
+        h = dict(headers)
+        h["Accept-Encoding"] = "gzip"
+        h["Connection"] = "keep-alive"
+        async with self.sem:
+            for _ in range(max_redirects + 1):
+                parts = urlsplit(url)
+                key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+                for attempt in (1, 2):
+                    # the resend after a dropped keep-alive goes out on a new connection: the
+                    # other idle ones are as old as the one that just failed
+                    conn = await self._open(key, fresh=attempt == 2)
+                    try:
+                        status, msg, body, keep = await asyncio.wait_for(
+                            self._roundtrip(conn, parts, h), REQUEST_TIMEOUT_SEC)
+                        break
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        conn[1].close()
+                        if attempt == 2:
+                            raise
+                    except BaseException:
+                        conn[1].close()
+                        raise
+                if keep:
+                    self.idle.setdefault(key, []).append(conn)
+                else:
+                    conn[1].close()
+                if (msg.get("Content-Encoding") or "").lower() == "gzip":
+                    body = gzip.decompress(body)
+                if status in (301, 302, 303, 307, 308) and msg.get("Location"):
+                    url = urljoin(url, msg["Location"])
+                    continue
+                if status >= 400:
+                    raise HTTPError(url, status, http.client.responses.get(status, ""), msg, io.BytesIO(body))
+                return body
+        raise HTTPError(url, status, "too many redirects", msg, io.BytesIO(body))
+
+    async def close(self):
+        for pool in self.idle.values():
+            for _, writer in pool:
+                writer.close()
+        self.idle.clear()
+
+async def abb_get_json(client, path, params=None):
+    return (await _abb_get_json_timed(client, path, params))[0]
+
+async def _abb_get_json_timed(client, path, params=None, retry_timeouts=True):
+    """_bb_get_json_timed() for the asyncio engine."""
+    if not path.startswith("/"):
+        path = "/" + path
+    url = BASE_URL.rstrip("/") + path
+    if params:
+        url += ("?" + urlencode(params, doseq=True))
+    endpoint = _endpoint_key(path)
+    for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
+        breaker.check(endpoint)
+        try:
+            async with rate_limiter.arequest(_endpoint_class(endpoint)):
+                t0 = time.monotonic()
+                raw = await client.get(url, {"Authorization": AUTH_HEADER, "Accept": "application/json"})
+                elapsed = time.monotonic() - t0
+        except Exception as e:
+            if not is_transient(e) or not retry_timeouts and isinstance(e, TimeoutError):
+                raise
+            breaker.failure(endpoint)
+            if attempt == RETRY_MAX_ATTEMPTS:
+                raise
+            await asyncio.sleep(retry_delay(attempt, e))
+            continue
+        breaker.success(endpoint)
+        return json.loads(raw.decode("utf-8", errors="replace")), elapsed
+
+async def _atimed_get_json(client, path, params):
+    return await _abb_get_json_timed(client, path, params, retry_timeouts=params["limit"] <= page_sizer.min_size)
+
+async def abb_paginate(client, path, params=None, limit=100, more=None):
+    """bb_paginate() for the asyncio engine; the next page is prefetched as a task."""
+    start = 0
+    params = dict(params or {})
+    endpoint = _endpoint_key(path)
+    size = page_sizer.size(endpoint, params.get("limit", limit))
+    fetch = lambda: asyncio.ensure_future(_atimed_get_json(client, path, dict(params, start=start, limit=size)))
+    pending = fetch()
+    try:
+        while pending is not None:
+            try:
+                data, elapsed = await pending
+            except TimeoutError:
+                size = page_sizer.timed_out(endpoint, size)
+                if size is None:
+                    raise
+                pending = fetch()
+                continue
+            values = data.get("values", [])
+            size = page_sizer.observe(endpoint, size, elapsed, len(values), data.get("limit"))
+            pending = None
+            has_next = not data.get("isLastPage", True) and data.get("nextPageStart") is not None
+            if has_next:
+                start = data["nextPageStart"]
+                if more is None or more(values):
+                    pending = fetch()
+            for v in values:
+                yield v
+            if pending is None and has_next:
+                # the caller went on after all
+                pending = fetch()
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+async def adiscover_repos(client):
+    repos = []
+    try:
+        async for r in abb_paginate(client, "/rest/api/1.0/repos", params={"limit": 100}, limit=100):
+            project = (r.get("project") or {}).get("key")
+            slug = r.get("slug")
+            name = r.get("name") or slug
+            if project and slug:
+                repos.append({"projectKey": project, "repoSlug": slug, "repoName": name, "scmId": r.get("scmId")})
+        if repos:
+            return repos
+    except Exception:
+        pass
+
+    # Fallback: enumerate projects, then list their repos concurrently
+    keys = [p.get("key") async for p in abb_paginate(client, "/rest/api/1.0/projects",
+                                                      params={"limit": 100}, limit=100) if p.get("key")]
+
+    async def project_repos(key):
+        return [r async for r in abb_paginate(client, f"/rest/api/1.0/projects/{key}/repos",
+                                              params={"limit": 100}, limit=100)]
+    for key, found in zip(keys, await asyncio.gather(*(project_repos(k) for k in keys))):
+        for r in found:
+            slug = r.get("slug")
+            if slug:
+                repos.append({"projectKey": key, "repoSlug": slug, "repoName": r.get("name") or slug,
+                              "scmId": r.get("scmId")})
+    return repos
+
+async def aiter_recent_commits(client, projectKey, repoSlug, cutoff_ts_ms, stop_at_id=None, until=None):
+    seen = 0
+    async for c in abb_paginate(client, f"/rest/api/1.0/projects/{projectKey}/repos/{repoSlug}/commits",
+                                params=_commit_list_params(until), limit=100,
+                                more=lambda page: _listing_goes_on(page, cutoff_ts_ms, stop_at_id)):
+        if until and c.get("id") == until:
+            continue
+        seen += 1
+        ts = c.get("authorTimestamp") or c.get("committerTimestamp") or 0
+        if ts < cutoff_ts_ms:
+            break
+        if stop_at_id and c.get("id") == stop_at_id:
+            break
+        yield c
+        if MAX_COMMITS_PER_REPO and seen >= MAX_COMMITS_PER_REPO:
+            break
+
+async def adefault_branch_head(client, projectKey, repoSlug):
+    try:
+        branch = await abb_get_json(client, f"/rest/api/1.0/projects/{projectKey}/repos/{repoSlug}/branches/default")
+    except Exception:
+        return None
+    return branch.get("latestCommit")
+
+async def aget_commit_change_totals(client, projectKey, repoSlug, commit_id):
+    path = f"/rest/api/1.0/projects/{projectKey}/repos/{repoSlug}/commits/{commit_id}/changes"
     last_err = None
-    for path, params in paths_to_try:
+    for variant in _changes_variants(projectKey, repoSlug):
+        added = removed = files = 0
         try:
-            for ch in bb_paginate(path, params=params, limit=500):
+            async for ch in abb_paginate(client, path, params=CHANGES_VARIANTS[variant], limit=500):
                 files += 1
-                # common keys when withCounts is enabled:
-                # linesAdded / linesRemoved (sometimes linesDeleted)
-                a = ch.get("linesAdded")
-                r = ch.get("linesRemoved")
-                if a is None and "linesInserted" in ch:  # some variants
-                    a = ch.get("linesInserted")
-                if r is None and "linesDeleted" in ch:
-                    r = ch.get("linesDeleted")
-                added += int(a or 0)
-                removed += int(r or 0)
-            return added, removed, files
+                a, r = _change_line_counts(ch)
+                added += a
+                removed += r
         except Exception as e:
+            if is_transient(e) or isinstance(e, CircuitOpenError):
+                raise
             last_err = e
             continue
-    # If both attempts fail, degrade gracefully
-    return 0, 0, 0
+        _changes_variant_worked(projectKey, repoSlug, variant)
+        return added, removed, files
+    raise last_err
+
+async def _with_client(fn, *args):
+    client = AsyncHTTP(ASYNC_CONCURRENCY)
+    try:
+        return await fn(client, *args)
+    finally:
+        await client.close()
+
+def run_coro(coro):
+    """asyncio.run() that also works from Jupyter, whose event loop is already running."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # inside a running loop: drive a fresh loop on a helper thread and wait for it
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, coro).result()
+
+# -----------------------------
+# Columnar row storage
+# -----------------------------
+class ColumnarRows:
+    """
+    Append-only typed columns for the collected rows, instead of a list of dicts.
+    Schema: [(name, kind)] with kind
+      "dim"   - repeated strings, interned into int32 codes
+      "ms"    - int64 epoch milliseconds (UTC)
+      "int"   - int32 counter, None/missing stored as -1
+      "flag"  - boolean, stored as int8
+      "text"  - high-cardinality strings (ids), kept as a plain list
+    Not thread-safe: callers serialize append()/set().
+    """
+    MISSING = -1
+
+    def __init__(self, schema):
+        self.schema = list(schema)
+        self._cols = {}
+        self._interned = {}   # dim name -> (value -> code, values)
+        for name, kind in self.schema:
+            if kind == "dim":
+                self._cols[name] = array("i")
+                self._interned[name] = ({}, [])
+            elif kind == "ms":
+                self._cols[name] = array("q")
+            elif kind == "int":
+                self._cols[name] = array("i")
+            elif kind == "flag":
+                self._cols[name] = array("b")
+            else:
+                self._cols[name] = []
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def append(self, **row):
+        """Appends one row (missing keys -> None); returns its index."""
+        for name, kind in self.schema:
+            v = row.get(name)
+            if kind == "dim":
+                index, values = self._interned[name]
+                code = index.get(v)
+                if code is None:
+                    code = index[v] = len(values)
+                    values.append(v)
+                v = code
+            elif kind == "int" and v is None:
+                v = self.MISSING
+            elif kind == "flag":
+                v = bool(v)
+            self._cols[name].append(v)
+        self._n += 1
+        return self._n - 1
+
+    def get(self, i, name):
+        v = self._cols[name][i]
+        kind = dict(self.schema)[name]
+        if kind == "dim":
+            return self._interned[name][1][v]
+        if kind == "int" and v == self.MISSING:
+            return None
+        if kind == "flag":
+            return bool(v)
+        return v
+
+    def set(self, i, **values):
+        """Overwrites counters and flags ("int"/"flag" columns) of row i."""
+        for name, v in values.items():
+            self._cols[name][i] = self.MISSING if v is None else v
+
+    def column(self, name):
+        """Raw column ("text" columns: the list of values itself)."""
+        return self._cols[name]
+
+    def values(self, name):
+        """Column as a list of row values: "dim" decoded, missing "int" as None, "ms" left as epoch ms."""
+        col = self._cols[name]
+        kind = dict(self.schema)[name]
+        if kind == "dim":
+            decoded = self._interned[name][1]
+            return [decoded[code] for code in col]
+        if kind == "int":
+            return [None if v == self.MISSING else v for v in col]
+        if kind == "flag":
+            return [bool(v) for v in col]
+        return list(col)
+
+    def iter_rows(self):
+        """Row dicts ("ms" as tz-aware datetimes); only for the pandas-less fallback."""
+        for i in range(self._n):
+            row = {name: self.get(i, name) for name, _ in self.schema}
+            for name, kind in self.schema:
+                if kind == "ms":
+                    row[name] = datetime.fromtimestamp(row[name] / 1000, tz=timezone.utc)
+            yield row
+
+    def to_frame(self):
+        """
+        DataFrame built straight from the typed buffers: sorted categoricals for "dim",
+        datetime64[ns, UTC] for "ms", the narrowest nullable Int8/Int16/Int32 that holds each
+        "int" column, bool for "flag". Sums widen to Int64; widen by hand before adding two
+        counters row-wise (Int8 + Int8 wraps).
+        """
+        import numpy as np
+        data = {}
+        for name, kind in self.schema:
+            col = self._cols[name]
+            if kind == "dim":
+                values = self._interned[name][1]
+                cats = sorted(v for v in values if v is not None)
+                pos = {v: k for k, v in enumerate(cats)}
+                remap = np.array([pos.get(v, -1) for v in values] + [-1], dtype=np.int32)
+                codes = remap[np.frombuffer(col, dtype=np.int32)] if self._n else np.empty(0, np.int32)
+                data[name] = pd.Categorical.from_codes(codes, categories=cats)
+            elif kind == "ms":
+                data[name] = pd.to_datetime(np.frombuffer(col, dtype=np.int64), unit="ms", utc=True).as_unit("ns")
+            elif kind == "int":
+                vals = np.frombuffer(col, dtype=np.int32)
+                missing = vals == self.MISSING
+                present = vals[~missing]
+                lo, hi = (int(present.min()), int(present.max())) if len(present) else (0, 0)
+                dtype = next(t for t in (np.int8, np.int16, np.int32)
+                             if np.iinfo(t).min <= lo and hi <= np.iinfo(t).max)
+                data[name] = pd.arrays.IntegerArray(vals.astype(dtype), missing)
+            elif kind == "flag":
+                data[name] = np.frombuffer(col, dtype=np.int8).astype(bool)
+            else:
+                data[name] = col
+        return pd.DataFrame(data)
+
+def memory_report(df, label):
+    """
+    Prints df's deep memory use next to what pd.DataFrame(row dicts) takes for the same
+    data: Python strings instead of categoricals, int64/float64 instead of narrow counters.
+    """
+    import numpy as np
+    typed = untyped = 0
+    for name in df.columns:
+        col = df[name]
+        size = int(col.memory_usage(index=False, deep=True))
+        typed += size
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # code -1 (missing) picks the trailing None
+            sizes = np.array([sys.getsizeof(v) for v in col.cat.categories] + [sys.getsizeof(None)], dtype=np.int64)
+            untyped += 8 * len(col) + int(sizes[col.cat.codes.to_numpy()].sum())
+        elif pd.api.types.is_integer_dtype(col.dtype):
+            untyped += 8 * len(col)
+        else:
+            untyped += size
+    print(f"[INFO] {label}: {typed / 2**20:.1f} MiB typed, {untyped / 2**20:.1f} MiB as untyped columns")
+
+def write_columnar(df, name, partitioned=False):
+    """
+    Columnar copy of an exported table in EXPORT_FORMAT, read back with its dtypes by
+    pd.read_parquet(path) / pd.read_feather(path). partitioned: adds a "month" (YYYY-MM)
+    column and writes Parquet as one directory per project (name/project=.../), so
+    filters=[("project", "==", ...)] only opens that project's files. Returns the path,
+    or None (no pyarrow / CSV only).
+    """
+    import numpy as np
+    if pyarrow is None or not EXPORT_FORMAT:
+        return None
+    # counters go out as Int32 whatever width this run's data fitted in, so the schema stays stable
+    narrow = [c for c, t in df.dtypes.items() if isinstance(t, (pd.Int8Dtype, pd.Int16Dtype))]
+    df = df.reset_index(drop=True).astype({c: "Int32" for c in narrow})
+    if partitioned:
+        months = df["datetime_utc"].dt.tz_convert(None).to_numpy().astype("datetime64[M]")
+        labels, codes = np.unique(months, return_inverse=True)
+        df = df.assign(month=pd.Categorical.from_codes(codes, [str(m) for m in labels]))
+    if EXPORT_FORMAT == "feather":
+        df.to_feather(f"{name}.feather")
+        return f"{name}.feather"
+    if not partitioned:
+        df.to_parquet(f"{name}.parquet", index=False)
+        return f"{name}.parquet"
+    # files of an earlier run would be read back as part of the dataset. Months stay a column:
+    # project x month directories make hundreds of small files a year that take seconds to open.
+    # Rows grouped by project first, or each file is written as many tiny row groups
+    shutil.rmtree(name, ignore_errors=True)
+    df.sort_values("project", kind="stable").to_parquet(name, partition_cols=["project"], index=False)
+    return name
+
+# -----------------------------
+# Dashboard database (DASHBOARD_DB)
+# -----------------------------
+# tables as server/database.ts creates them; their secondary indexes are in DASHBOARD_INDEXES
+DASHBOARD_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS repositories (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        namespace TEXT,
+        description TEXT,
+        primaryLanguage TEXT,
+        lastActivity TEXT,
+        healthScore INTEGER DEFAULT 70
+    );
+    CREATE TABLE IF NOT EXISTS developers (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        email TEXT,
+        avatar TEXT,
+        role TEXT,
+        joinedDate TEXT
+    );
+    CREATE TABLE IF NOT EXISTS commits (
+        hash TEXT PRIMARY KEY,
+        message TEXT,
+        timestamp TEXT,
+        additions INTEGER DEFAULT 0,
+        deletions INTEGER DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS repo_commits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        repo_id TEXT NOT NULL,
+        developer_id TEXT NOT NULL,
+        commit_hash TEXT NOT NULL,
+        FOREIGN KEY (repo_id) REFERENCES repositories(id),
+        FOREIGN KEY (developer_id) REFERENCES developers(id),
+        FOREIGN KEY (commit_hash) REFERENCES commits(hash),
+        UNIQUE(repo_id, commit_hash)
+    );
+    CREATE TABLE IF NOT EXISTS branches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        repo_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        is_default INTEGER DEFAULT 0,
+        last_commit_date TEXT,
+        commit_count INTEGER DEFAULT 0,
+        FOREIGN KEY (repo_id) REFERENCES repositories(id),
+        UNIQUE(repo_id, name)
+    );
+    CREATE TABLE IF NOT EXISTS metadata (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TABLE IF NOT EXISTS developer_aliases (
+        developer_id TEXT PRIMARY KEY,
+        custom_name TEXT NOT NULL,
+        FOREIGN KEY (developer_id) REFERENCES developers(id)
+    );
+"""
+DASHBOARD_INDEXES = {
+    "idx_repo_commits_repo": "repo_commits(repo_id)",
+    "idx_repo_commits_dev": "repo_commits(developer_id)",
+    "idx_commits_timestamp": "commits(timestamp)",
+    "idx_branches_repo": "branches(repo_id)",
+}
+DASHBOARD_REINDEX_SHARE = 0.5   # batch >= this share of the stored commits: drop the indexes and rebuild them once
+
+_iso_days = {}   # epoch day -> "YYYY-MM-DDT"
+
+def iso_ms(ts_ms):
+    """Epoch ms in the dashboard's timestamp format (JavaScript toISOString, 2026-01-12T21:29:30.000Z)."""
+    day, ms = divmod(ts_ms, 86400000)
+    prefix = _iso_days.get(day)
+    if prefix is None:
+        prefix = _iso_days[day] = time.strftime("%Y-%m-%dT", time.gmtime(day * 86400))
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    return f"{prefix}{h:02d}:{m:02d}:{ms // 1000:02d}.{ms % 1000:03d}Z"
+
+def health_score(commits, contributors, last_ms, now_ms):
+    """Repository health the way server/sync.ts scores it: volume (0-40) + contributors (0-30) + recency (5-30)."""
+    days = (now_ms - last_ms) / 86400000
+    recency = next((score for limit, score in ((7, 30), (30, 25), (90, 20), (180, 15), (365, 10)) if days <= limit), 5)
+    return int(min(commits / 10, 40) + min(contributors * 5, 30) + recency + 0.5)
+
+SAFE_URI_CHARS = "-_.!~*'()"   # what JavaScript's encodeURIComponent leaves alone
+
+def dashboard_developer(author, email=None):
+    """developers upsert parameters for an author: (id, name, email, fallback email, avatar, joinedDate)."""
+    return (DEVELOPER_IDS.get(author, author), author, email or None,
+            re.sub(r"\s+", ".", author.lower()) + "@scm.local",
+            f"https://ui-avatars.com/api/?name={quote(author, safe=SAFE_URI_CHARS)}&background=random&size=128",
+            iso_ms(int(time.time() * 1000)))
+
+def write_dashboard_db(repositories, developers, commits, repo_commits, branches, stats):
+    """
+    Upserts collected rows into DASHBOARD_DB in one transaction: one executemany per table.
+    A backfill (stats["commits"] at least DASHBOARD_REINDEX_SHARE of the stored commits)
+    drops the secondary indexes for the load and rebuilds them once at the end; a regular
+    sync keeps them and updates them in place, which is cheaper for small batches. Arguments
+    are iterables of parameter tuples for the statements below (see the callers); stats
+    goes to metadata.last_sync_stats like a dashboard sync. What git.py doesn't collect
+    keeps its stored value: repo descriptions, commit messages, custom names from
+    developer_aliases, and (passed as None) e-mails, stats and default-branch flags.
+    """
+    os.makedirs(os.path.dirname(DASHBOARD_DB) or ".", exist_ok=True)
+    db = sqlite3.connect(DASHBOARD_DB, isolation_level=None)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA cache_size=-131072")   # 128 MiB: keeps the primary key b-trees in memory
+        db.executescript(DASHBOARD_SCHEMA)
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            stored = db.execute("SELECT count(*) FROM commits").fetchone()[0]
+            reindex = stats["commits"] >= DASHBOARD_REINDEX_SHARE * stored
+            if reindex:
+                for index in DASHBOARD_INDEXES:
+                    db.execute(f"DROP INDEX IF EXISTS {index}")
+            db.executemany("""
+                INSERT INTO repositories (id, name, namespace, primaryLanguage, lastActivity, healthScore)
+                VALUES (?1, ?2, ?3, COALESCE(?4, 'Unknown'), ?5, ?6)
+                ON CONFLICT(id) DO UPDATE SET name = excluded.name, namespace = excluded.namespace,
+                    primaryLanguage = COALESCE(?4, repositories.primaryLanguage), lastActivity = excluded.lastActivity,
+                    healthScore = excluded.healthScore""", repositories)
+            db.executemany("""
+                INSERT INTO developers (id, name, email, avatar, role, joinedDate)
+                VALUES (?1, ?2, COALESCE(?3, ?4), ?5, 'Developer', ?6)
+                ON CONFLICT(id) DO UPDATE SET
+                    name = COALESCE((SELECT custom_name FROM developer_aliases WHERE developer_id = excluded.id),
+                                    excluded.name),
+                    email = COALESCE(?3, developers.email), avatar = excluded.avatar""", developers)
+            db.executemany("""
+                INSERT INTO commits (hash, message, timestamp, additions, deletions)
+                VALUES (?1, '', ?2, COALESCE(?3, 0), COALESCE(?4, 0))
+                ON CONFLICT(hash) DO UPDATE SET timestamp = excluded.timestamp,
+                    additions = COALESCE(?3, commits.additions), deletions = COALESCE(?4, commits.deletions)""",
+                commits)
+            db.executemany("""
+                INSERT INTO repo_commits (repo_id, developer_id, commit_hash) VALUES (?1, ?2, ?3)
+                ON CONFLICT(repo_id, commit_hash) DO UPDATE SET developer_id = excluded.developer_id""",
+                repo_commits)
+            db.executemany("""
+                INSERT INTO branches (repo_id, name, is_default, last_commit_date, commit_count)
+                VALUES (?1, ?2, COALESCE(?3, 0), ?4, ?5)
+                ON CONFLICT(repo_id, name) DO UPDATE SET is_default = COALESCE(?3, branches.is_default),
+                    last_commit_date = excluded.last_commit_date, commit_count = excluded.commit_count""",
+                branches)
+            db.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                           [("last_sync_time", iso_ms(int(time.time() * 1000))), ("last_sync_stats", json.dumps(stats))])
+            for index, columns in DASHBOARD_INDEXES.items():
+                db.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {columns}")   # no-op where they were kept
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        # the dashboard server (sql.js) reads the bare file: fold the WAL back into it
+        db.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        db.close()
 
 # -----------------------------
 # Main: collect rows
@@ -208,78 +1454,371 @@ def get_commit_change_totals(projectKey, repoSlug, commit_id):
 cutoff_dt = datetime.now(timezone.utc) - timedelta(days=DAYS_BACK)
 cutoff_ts_ms = int(cutoff_dt.timestamp() * 1000)
 
-repos = discover_repos()
+repos = load_inventory(REPO_CACHE_TTL_SEC) if REPO_CACHE_TTL_SEC else None
+if repos is not None:
+    print(f"Using the repo list discovered less than {REPO_CACHE_TTL_SEC / 3600:g}h ago ({STATE_DIR})")
+else:
+    if ENGINE == "asyncio":
+        repos = run_coro(_with_client(adiscover_repos))
+    else:
+        repos = discover_repos()
+    if repos:
+        store_inventory(repos)
 if MAX_REPOS:
     repos = repos[:MAX_REPOS]
 
 print(f"Discovered {len(repos)} repos. Collecting commits since {cutoff_dt.date()} (UTC)…")
+if not RESUME:
+    clear_progress()
+elif INCREMENTAL:
+    resumed_repos, resumed_commits = progress_summary()
+    if resumed_repos:
+        print(f"  resuming {resumed_repos} commit listings an interrupted run left half-way "
+              f"({resumed_commits} commits already listed)")
 
-rows = []
-change_tasks = []
+# Streaming pipeline (both engines):
+#   listers page through repos (1) and push (pk, slug, cid) tasks into a bounded queue
+#   as each page arrives; stats workers (2) consume them right away and write straight
+#   into change_map. A full queue blocks the listers (backpressure).
+rows = ColumnarRows([
+    ("project", "dim"),
+    ("repo", "dim"),
+    ("repo_name", "dim"),
+    ("commit", "text"),
+    ("author", "dim"),
+    ("email", "dim"),
+    ("datetime_utc", "ms"),
+    ("lines_added", "int"),
+    ("lines_removed", "int"),
+    ("files_changed", "int"),
+])
+change_map = {}             # commit id -> (added, removed, files)
+_sink_lock = threading.Lock()
+new_commits = 0
+dormant_repos = 0           # repos with no commit since the last run (not listed)
+tasks_queued = 0
+stats_done = 0
+cache_hits = 0
+failed_tasks = []           # this run's failure ledger: (task, error); retried after the main pass
+ledger = ledger_load()      # failures left over from earlier runs
 
-# 1) Pull commits (cheap), build pending tasks for change stats (expensive)
-for i, repo in enumerate(repos, 1):
-    pk, slug, rname = repo["projectKey"], repo["repoSlug"], repo["repoName"]
-    try:
-        commits = list(iter_recent_commits(pk, slug, cutoff_ts_ms))
-    except Exception as e:
-        print(f"[WARN] Failed listing commits for {pk}/{slug}: {e}")
-        continue
+def _commit_record(c):
+    ts = c.get("authorTimestamp") or c.get("committerTimestamp") or 0
+    author, email = extract_author(c)
+    return c.get("id"), ts, author, email
 
-    for c in commits:
-        cid = c.get("id")
-        ts = c.get("authorTimestamp") or c.get("committerTimestamp") or 0
-        dt = datetime.fromtimestamp(ts / 1000, tz=timezone.utc)
-        wk = week_start_date(dt)
-        author, email = extract_author(c)
-        rows.append({
-            "project": pk,
-            "repo": slug,
-            "repo_name": rname,
-            "commit": cid,
-            "author": author,
-            "email": email,
-            "datetime_utc": dt,
-            "week_start_utc": wk,
-            "lines_added": None,
-            "lines_removed": None,
-            "files_changed": None,
-        })
+def _add_row(repo, cid, ts, author, email):
+    """Appends the row; returns the change-stat task for it (or None without a commit id)."""
+    global tasks_queued
+    with _sink_lock:
+        rows.append(project=repo["projectKey"], repo=repo["repoSlug"], repo_name=repo["repoName"],
+                    commit=cid, author=author, email=email, datetime_utc=ts)
         if cid:
-            change_tasks.append((pk, slug, cid))
+            tasks_queued += 1
+    return (repo["projectKey"], repo["repoSlug"], cid) if cid else None
 
-    if i % 10 == 0:
-        print(f"  scanned {i}/{len(repos)} repos…")
+def _listing_stop_at(pk, slug):
+    # Incremental: page only down to last run's newest commit, as long as the
+    # stored commits already reach back to this run's cutoff
+    hwm = load_hwm(pk, slug) if INCREMENTAL else None
+    return hwm[0] if hwm and hwm[2] <= cutoff_ts_ms else None
 
-print(f"Found {len(rows)} commits in range; fetching per-commit change stats (lines/files)…")
+def _resumed_listing(pk, slug):
+    """Commit records an interrupted run had listed for this repo (continued below the last one)."""
+    return load_progress(pk, slug, cutoff_ts_ms) if INCREMENTAL and RESUME else []
 
-# 2) Fetch change stats in parallel
-# Map commit id -> (added, removed, files)
-change_map = {}
+def _listing_plan(stop_at, resumed, head):
+    """
+    (stop_at_id, until) commit listings a repo still needs, newest first: from the branch
+    head down to the high-water mark, or - resuming an interrupted listing - down to the
+    head that listing started at, then on below the last commit it got to. None of them
+    when the default branch still points at the mark (nothing committed since the last run).
+    """
+    global dormant_repos
+    if not resumed:
+        if stop_at and head == stop_at:
+            with _sink_lock:
+                dormant_repos += 1
+            return []
+        return [(stop_at, None)]
+    newer = [] if head == resumed[0][0] else [(resumed[0][0], None)]
+    return newer + [(stop_at, resumed[-1][0])]
 
-def _fetch_one(task):
-    pk, slug, cid = task
-    a, r, f = get_commit_change_totals(pk, slug, cid)
-    return cid, a, r, f
-
-with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-    futures = [ex.submit(_fetch_one, t) for t in change_tasks]
-    done = 0
-    for fut in as_completed(futures):
-        cid, a, r, f = fut.result()
+def _track_listing(repo, resumed, newer, older, until, rec):
+    """
+    Files a freshly listed record under the commits newer than the resumed listing or the
+    ones continuing it; the continuing chain is checkpointed as listing progress.
+    """
+    if resumed and not until:
+        newer.append(rec)
+        return
+    older.append(rec)
+    if INCREMENTAL and rec[0]:
+        save_progress(repo["projectKey"], repo["repoSlug"], len(older) - 1, rec)
+
+def _finish_listing(repo, listed, stop_at):
+    """
+    Incremental bookkeeping once a repo is fully listed. Returns the stored
+    (older) records in the window that still have to be emitted.
+    """
+    global new_commits
+    pk, slug = repo["projectKey"], repo["repoSlug"]
+    with _sink_lock:
+        new_commits += len(listed)
+    if not INCREMENTAL:
+        return []
+    capped = MAX_COMMITS_PER_REPO and len(listed) >= MAX_COMMITS_PER_REPO
+    full_listing = not stop_at and not capped
+    store_commits(pk, slug, [r for r in listed if r[0]],
+                  covered_from_ms=cutoff_ts_ms if full_listing else None)
+    if not stop_at:
+        return []
+    fresh = {r[0] for r in listed}
+    return [rec for rec in load_commits(pk, slug, cutoff_ts_ms) if rec[0] not in fresh]
+
+def _cached_stats(task):
+    global cache_hits
+    if not USE_STATS_CACHE:
+        return None
+    cached = cache_get_stats(*task)
+    if cached is not None:
+        with _state_lock:
+            cache_hits += 1
+    return cached
+
+def _remember_stats(task, a, r, f):
+    if USE_STATS_CACHE:
+        cache_put_stats(*task, a, r, f)
+    if task in ledger:
+        ledger_clear(task)
+
+def _stats_failed(task, err):
+    with _sink_lock:
+        failed_tasks.append((task, err))
+
+def _record_stats(cid, a, r, f):
+    global stats_done
+    with _sink_lock:
         change_map[cid] = (a, r, f)
-        done += 1
-        if done % 250 == 0:
-            print(f"  change stats: {done}/{len(futures)} commits…")
-
-# 3) Merge change stats into rows
-for row in rows:
-    cid = row["commit"]
-    a, r, f = change_map.get(cid, (0, 0, 0))
-    row["lines_added"] = a
-    row["lines_removed"] = r
-    row["files_changed"] = f
-    row["lines_net"] = a - r
+        stats_done += 1
+        if stats_done % 250 == 0:
+            print(f"  change stats: {stats_done}/{tasks_queued} commits (listed so far)…")
+
+def _fetch_one(task):
+    cached = _cached_stats(task)
+    if cached is not None:
+        return (task[2],) + tuple(cached)
+    a, r, f = get_commit_change_totals(*task)
+    _remember_stats(task, a, r, f)
+    return task[2], a, r, f
+
+def collect_threaded(repos):
+    """ENGINE = "threads": LIST_WORKERS listing threads feed MAX_WORKERS stats threads."""
+    task_q = queue.Queue(maxsize=TASK_QUEUE_SIZE)
+
+    def list_repo(repo):
+        pk, slug = repo["projectKey"], repo["repoSlug"]
+        stop_at = _listing_stop_at(pk, slug)
+        resumed = _resumed_listing(pk, slug)
+        newer, older = [], list(resumed)
+        for rec in resumed:
+            task = _add_row(repo, *rec)
+            if task:
+                task_q.put(task)
+        head = default_branch_head(pk, slug) if stop_at or resumed else None
+        try:
+            for stop, until in _listing_plan(stop_at, resumed, head):
+                for c in iter_recent_commits(pk, slug, cutoff_ts_ms, stop_at_id=stop, until=until):
+                    rec = _commit_record(c)
+                    _track_listing(repo, resumed, newer, older, until, rec)
+                    task = _add_row(repo, *rec)
+                    if task:
+                        task_q.put(task)   # blocks while the queue is full
+        except HTTPError as e:
+            if resumed and e.code in (400, 404):
+                clear_progress(pk, slug)   # resume point gone (history rewritten): start over next run
+            raise
+        listed = newer + older
+        for rec in _finish_listing(repo, listed, stop_at):
+            task = _add_row(repo, *rec)
+            if task:
+                task_q.put(task)
+
+    def stats_worker():
+        while True:
+            task = task_q.get()
+            if task is None:
+                break
+            try:
+                _record_stats(*_fetch_one(task))
+            except Exception as e:
+                _stats_failed(task, e)
+
+    stats_threads = [threading.Thread(target=stats_worker, daemon=True) for _ in range(MAX_WORKERS)]
+    for t in stats_threads:
+        t.start()
+    try:
+        with ThreadPoolExecutor(max_workers=LIST_WORKERS) as list_ex:
+            list_futures = {list_ex.submit(list_repo, repo): repo for repo in repos}
+            for i, lfut in enumerate(as_completed(list_futures), 1):
+                repo = list_futures[lfut]
+                try:
+                    lfut.result()
+                except Exception as e:
+                    print(f"[WARN] Failed listing commits for {repo['projectKey']}/{repo['repoSlug']}: {e}")
+                if i % 10 == 0:
+                    print(f"  scanned {i}/{len(repos)} repos…")
+    finally:
+        for _ in stats_threads:
+            task_q.put(None)
+    print(f"Found {len(rows)} commits in range; finishing per-commit change stats (lines/files)…")
+    for t in stats_threads:
+        t.join()
+
+async def acollect(client, repos):
+    """
+    ENGINE = "asyncio": same pipeline as collect_threaded, as coroutines on one thread.
+    LIST_WORKERS repos are listed at a time, as in the threaded engine; state DB reads and
+    writes (sqlite, blocking) go through asyncio.to_thread so they never stall the loop.
+    """
+    task_q = asyncio.Queue(maxsize=TASK_QUEUE_SIZE)
+    listing_slots = asyncio.Semaphore(LIST_WORKERS)
+    scanned = 0
+
+    async def list_repo(repo):
+        async with listing_slots:
+            await list_one_repo(repo)
+
+    async def list_one_repo(repo):
+        nonlocal scanned
+        pk, slug = repo["projectKey"], repo["repoSlug"]
+        stop_at = await asyncio.to_thread(_listing_stop_at, pk, slug)
+        resumed = await asyncio.to_thread(_resumed_listing, pk, slug)
+        newer, older = [], list(resumed)
+        for rec in resumed:
+            task = _add_row(repo, *rec)
+            if task:
+                await task_q.put(task)
+        head = await adefault_branch_head(client, pk, slug) if stop_at or resumed else None
+        try:
+            for stop, until in _listing_plan(stop_at, resumed, head):
+                async for c in aiter_recent_commits(client, pk, slug, cutoff_ts_ms, stop_at_id=stop, until=until):
+                    rec = _commit_record(c)
+                    await asyncio.to_thread(_track_listing, repo, resumed, newer, older, until, rec)
+                    task = _add_row(repo, *rec)
+                    if task:
+                        await task_q.put(task)
+        except HTTPError as e:
+            if resumed and e.code in (400, 404):
+                await asyncio.to_thread(clear_progress, pk, slug)   # resume point gone: start over next run
+            raise
+        listed = newer + older
+        for rec in await asyncio.to_thread(_finish_listing, repo, listed, stop_at):
+            task = _add_row(repo, *rec)
+            if task:
+                await task_q.put(task)
+        scanned += 1
+        if scanned % 10 == 0:
+            print(f"  scanned {scanned}/{len(repos)} repos…")
+
+    async def stats_worker():
+        while True:
+            task = await task_q.get()
+            if task is None:
+                return
+            try:
+                cached = await asyncio.to_thread(_cached_stats, task)
+                if cached is None:
+                    a, r, f = await aget_commit_change_totals(client, *task)
+                    await asyncio.to_thread(_remember_stats, task, a, r, f)
+                else:
+                    a, r, f = cached
+                _record_stats(task[2], a, r, f)
+            except Exception as e:
+                _stats_failed(task, e)
+
+    workers = [asyncio.create_task(stats_worker()) for _ in range(ASYNC_CONCURRENCY)]
+    try:
+        results = await asyncio.gather(*(list_repo(repo) for repo in repos), return_exceptions=True)
+        for repo, res in zip(repos, results):
+            if isinstance(res, Exception):
+                print(f"[WARN] Failed listing commits for {repo['projectKey']}/{repo['repoSlug']}: {res}")
+    finally:
+        for _ in workers:
+            await task_q.put(None)
+    print(f"Found {len(rows)} commits in range; finishing per-commit change stats (lines/files)…")
+    await asyncio.gather(*workers)
+
+try:
+    if ENGINE == "asyncio":
+        run_coro(_with_client(acollect, repos))
+    else:
+        collect_threaded(repos)
+finally:
+    checkpoint()   # an interrupted run keeps everything collected so far
+
+# Second chance for the failure ledger, once the main pass no longer loads the server
+if failed_tasks:
+    retry_tasks = [t for t, _ in failed_tasks]
+    print(f"Retrying change stats for {len(retry_tasks)} commits that failed…")
+    time.sleep(retry_pause([err for _, err in failed_tasks]))
+    failed_tasks.clear()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        futures = {ex.submit(_fetch_one, t): t for t in retry_tasks}
+        for fut in as_completed(futures):
+            try:
+                _record_stats(*fut.result())
+            except Exception as e:
+                _stats_failed(futures[fut], e)
+    for task, err in failed_tasks:
+        ledger_add(task, err)
+    if failed_tasks:
+        print(f"[WARN] change stats still missing for {len(failed_tasks)} commits (kept in the failure "
+              f"ledger in {STATE_DIR}, retried next run; their lines are left empty, not counted as 0). "
+              f"First error: {failed_tasks[0][1]}")
+checkpoint()
+if INCREMENTAL:
+    print(f"  {new_commits} new commits listed; the rest of the window comes from {STATE_DIR}")
+    if dormant_repos:
+        print(f"  {dormant_repos} repos without new commits since the last run were not listed")
+if USE_STATS_CACHE:
+    print(f"  {cache_hits}/{tasks_queued} commits served from the local stats cache ({STATE_DIR})")
+print(f"  request rate settled at {rate_limiter.rate:.1f} req/s")
+
+# 3) Merge change stats into rows (commits whose stats failed stay missing)
+for i, cid in enumerate(rows.column("commit")):
+    a, r, f = change_map.get(cid, (None, None, None) if cid else (0, 0, 0))
+    rows.set(i, lines_added=a, lines_removed=r, files_changed=f)
+
+# 4) Upsert into the dashboard database; only the default branch is listed, so no branch rows
+if DASHBOARD_DB and rows:
+    started = time.monotonic()
+    now_ms = int(time.time() * 1000)
+    hashes, ts = rows.column("commit"), rows.column("datetime_utc")
+    authors = rows.values("author")
+    repo_ids = [f"{pk}/{slug}" for pk, slug in zip(rows.values("project"), rows.values("repo"))]
+    repo_stats = {}   # repo id -> [name, project, commits, authors, newest ms]
+    # primaryLanguage holds the SCM type, as server/sync.ts fills it (unknown for a cached repo list)
+    scm_types = {f"{r['projectKey']}/{r['repoSlug']}": r.get("scmId") for r in repos}
+    for rid, repo_name, pk, author, t in zip(repo_ids, rows.values("repo_name"), rows.values("project"), authors, ts):
+        st = repo_stats.get(rid)
+        if st is None:
+            st = repo_stats[rid] = [repo_name, pk, 0, set(), t]
+        st[2] += 1
+        st[3].add(author)
+        st[4] = max(st[4], t)
+    emails = dict(zip(authors, rows.values("email")))
+    n_commits = sum(1 for h in hashes if h)
+    write_dashboard_db(
+        [(rid, repo_name, pk, scm_types.get(rid), iso_ms(newest), health_score(n, len(devs), newest, now_ms))
+         for rid, (repo_name, pk, n, devs, newest) in repo_stats.items()],
+        [dashboard_developer(author, emails[author]) for author in sorted(emails)],
+        ((h, iso_ms(t), a, r) for h, t, a, r in zip(hashes, ts, rows.values("lines_added"), rows.values("lines_removed")) if h),
+        ((rid, DEVELOPER_IDS.get(author, author), h) for rid, author, h in zip(repo_ids, authors, hashes) if h),
+        [],
+        {"repos": len(repo_stats), "developers": len({DEVELOPER_IDS.get(a, a) for a in emails}), "commits": n_commits})
+    print(f"Upserted {n_commits} commits of {len(repo_stats)} repos into {DASHBOARD_DB} "
+          f"in {time.monotonic() - started:.1f}s")
 
 # -----------------------------
 # Analyze + visualize
@@ -293,14 +1832,14 @@ if pd is None:
     print("\nPandas not available; showing a simple text summary (installing not allowed).\n")
     # Aggregate (week, author)
     agg = {}
-    for r in rows:
-        key = (r["week_start_utc"].date().isoformat(), r["author"])
+    for r in rows.iter_rows():
+        key = (week_start_date(r["datetime_utc"]).date().isoformat(), r["author"])
         a = agg.setdefault(key, {"commits": 0, "added": 0, "removed": 0, "net": 0, "files": 0})
         a["commits"] += 1
-        a["added"] += r["lines_added"]
-        a["removed"] += r["lines_removed"]
-        a["net"] += r["lines_net"]
-        a["files"] += r["files_changed"]
+        a["added"] += r["lines_added"] or 0
+        a["removed"] += r["lines_removed"] or 0
+        a["net"] += (r["lines_added"] or 0) - (r["lines_removed"] or 0)
+        a["files"] += r["files_changed"] or 0
     # Print top authors by commits
     by_author = {}
     for (_, author), v in agg.items():
@@ -311,14 +1850,16 @@ if pd is None:
     for a, c in top:
         print(f"  {a}: {c}")
 else:
-    df = pd.DataFrame(rows)
-    # Clean
-    df["author"] = df["author"].fillna("unknown")
-    df["week_start_utc"] = pd.to_datetime(df["week_start_utc"], utc=True)
+    df = rows.to_frame()
+    memory_report(df, "Commit frame")
+    # Derived columns (week starts Monday 00:00 UTC)
+    day = df["datetime_utc"].dt.floor("D")
+    df["week_start_utc"] = day - pd.to_timedelta(day.dt.weekday, unit="D")
+    df["lines_net"] = df["lines_added"] - df["lines_removed"]
 
     # Weekly per-author KPIs
     weekly = (
-        df.groupby(["week_start_utc", "author"], as_index=False)
+        df.groupby(["week_start_utc", "author"], as_index=False, observed=True)
           .agg(
               commits=("commit", "count"),
               lines_added=("lines_added", "sum"),
@@ -329,10 +1870,13 @@ else:
           )
           .sort_values(["week_start_utc", "commits"], ascending=[True, False])
     )
+    # commits whose stats are missing are NaN and skipped by the sums; keep the sums integral
+    line_cols = ["lines_added", "lines_removed", "lines_net", "files_changed"]
+    weekly[line_cols] = weekly[line_cols].astype("int64")
 
     # Pick top devs by commits (you can change to lines_added if you prefer)
     top_devs = (
-        weekly.groupby("author")["commits"].sum()
+        weekly.groupby("author", observed=True)["commits"].sum()
               .sort_values(ascending=False)
               .head(TOP_N_DEVS)
               .index.tolist()
@@ -347,6 +1891,16 @@ else:
     out_csv = "dev_kpi_weekly.csv"
     weekly.to_csv(out_csv, index=False)
     print(f"\nSaved full weekly table to: {out_csv}")
+    detail = df[["project", "repo", "repo_name", "commit", "author", "email", "datetime_utc",
+                 "lines_added", "lines_removed", "lines_net", "files_changed"]]
+    detail.to_csv("dev_kpi_commits.csv", index=False)
+    print("Saved commit-level detail to: dev_kpi_commits.csv")
+    for table, name, partitioned in ((weekly, "dev_kpi_weekly", False), (detail, "dev_kpi_commits", True)):
+        path = write_columnar(table, name, partitioned)
+        if path:
+            print(f"Saved {name} as {EXPORT_FORMAT}: {path}")
+    if pyarrow is None and EXPORT_FORMAT:
+        print("pyarrow not installed: CSV exports only")
 
     # Plot if matplotlib available
     if plt is None:
@@ -392,7 +1946,7 @@ else:
 
     # Leaderboard summary
     leaderboard = (
-        weekly.groupby("author", as_index=False)
+        weekly.groupby("author", as_index=False, observed=True)
               .agg(
                   commits=("commits", "sum"),
                   lines_added=("lines_added", "sum"),
@@ -414,25 +1968,68 @@ print("\nDone.")
 
 
 # SCM-Manager (Cloudogu) weekly developer KPI from changesets/commits + diff line counting
-# ONE CELL. No pip installs. Uses stdlib (+ pandas/matplotlib if available).
+# ONE CELL. No pip installs. Uses stdlib (+ pandas/matplotlib/pyarrow if available) and diff_stats.py
+# from this repo (run it from the repo root).
 
-import json, os, time, re
+import gzip, http.client, io, json, os, random, shutil, sqlite3, sys, threading, time, re, zlib
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
 from datetime import datetime, timedelta, timezone
-from urllib.request import Request, urlopen
 from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode, urljoin
+from urllib.parse import quote, urlencode, urljoin, urlsplit
+
+from diff_stats import DiffStatsCounter
 
 # -----------------------------
 # CONFIG
 # -----------------------------
 HOST = "http://172.31.200.215:8080"   # host only
 DAYS_BACK = 720
-PAGE_SIZE = 50                        # SCM-Manager uses page/pageSize
+PAGE_SIZE = 50                        # SCM-Manager uses page/pageSize; starting size, adapts per endpoint between MIN and MAX:
+PAGE_SIZE_MIN = 10                    #   doubled while full pages arrive within PAGE_FAST_SEC, halved on pages
+PAGE_SIZE_MAX = 500                   #   slower than PAGE_SLOW_SEC or timeouts; the next page is fetched in the
+PAGE_FAST_SEC = 1.0                   #   background while the current one is consumed
+PAGE_SLOW_SEC = 10.0
 TOP_N_DEVS = 10
 MAX_REPOS = None                      # None = all
 MAX_CHANGESETS_PER_REPO = None        # optional cap per repo
-SLEEP_SEC = 0.0
 TIMEOUT_SEC = 60
+REPO_WORKERS = 4                      # repos whose detail and branch list are fetched concurrently
+BRANCH_WORKERS = 8                    # branches whose changesets are paged concurrently
+DIFF_WORKERS = 16                     # concurrent diff downloads (all share the rate limiter below)
+DIFF_QUEUE_SIZE = 2000                # diffs queued ahead of the download threads (caps memory in flight)
+MAX_DIFF_BYTES = None                 # stop reading a diff after this many bytes (row flagged diff_truncated); None = no cap
+DIFF_MODE = "raw"                     # "raw": count the raw patch (the smaller download: parsed diffs carry every hunk
+                                      #   line too and came out ~15% larger gzipped); "auto": the changeset's parsed
+                                      #   diff (diffParsed link) unless the server turned out not to serve it, else the
+                                      #   raw patch; "parsed": always try it first
+STATE_DIR = ".scm_kpi_state"          # local state (server capabilities, ...); delete the folder to start from scratch
+INCREMENTAL = True                    # repos whose lastModified has not moved since the last run reuse their stored
+                                      #   changesets from STATE_DIR (no branch, changeset or diff requests)
+REPO_CACHE_TTL_SEC = 24 * 3600        # reuse the repository list from STATE_DIR this long; 0 = list it every run
+USE_STATS_CACHE = True                # reuse diff stats fetched by earlier (or interrupted) runs; changeset ids are immutable
+CHECKPOINT_EVERY_SEC = 30             # collected state goes to STATE_DIR in one transaction at most this far apart;
+                                      #   an interrupted run resumes from there (repos done, diffs fetched)
+EXPORT_FORMAT = "parquet"             # columnar copy of the CSV exports when pyarrow is installed: "parquet" (changeset
+                                      #   detail partitioned by project), "feather" (Arrow IPC) or None = CSV only
+DASHBOARD_DB = None                   # path of the dashboard's SQLite database (e.g. "data/devmetrics.sqlite") to upsert
+                                      #   the collected changesets into (server/database.ts schema, created if missing);
+                                      #   None = don't. The repo's copy is tracked: point it there on purpose
+DEVELOPER_IDS = {                     # author name -> developer id in DASHBOARD_DB (as DEVELOPER_ID_MAP in server/sync.ts)
+    "=Ilia Lomsadze": "Ilia",
+    "vumpy": "gchutlashvili",
+    "GChutlashvili": "gchutlashvili",
+}
+RATE_LIMIT_RPS = 20.0                 # starting request rate; adapts between MIN and MAX
+RATE_LIMIT_MIN_RPS = 1.0              #   (backs off on 429/503, timeouts, rising latency;
+RATE_LIMIT_MAX_RPS = 200.0            #    ramps back up while responses are healthy)
+RETRY_MAX_ATTEMPTS = 5                # timeouts, resets, 429 and 5xx are retried with jittered exponential backoff
+RETRY_BASE_SEC = 0.5
+RETRY_MAX_SEC = 30.0
+BREAKER_FAILURES = 20                 # consecutive transient failures that open an endpoint's circuit breaker
+BREAKER_COOLDOWN_SEC = 30.0           # an open breaker fails fast this long, then lets a probe request through
 
 # Use env var if you don't want to paste token in notebook:
 #   set BB_TOKEN=... (or in notebook: os.environ["BB_TOKEN"]="...")
@@ -456,6 +2053,11 @@ except Exception:
     go = None
     px = None
 
+try:
+    import pyarrow
+except Exception:
+    pyarrow = None
+
 # -----------------------------
 # HTTP helpers
 # -----------------------------
@@ -468,36 +2070,442 @@ def _headers():
         "Authorization": f"Bearer {TOKEN}",   # some installs accept this; harmless if ignored
     }
 
-def http_get(url, accept=None):
+# Persistent HTTP/1.1 connections: one per (thread, host), reused across calls
+_http_local = threading.local()
+
+def _pooled_connection(scheme, netloc):
+    conns = getattr(_http_local, "conns", None)
+    if conns is None:
+        conns = _http_local.conns = {}
+    conn = conns.get((scheme, netloc))
+    if conn is None:
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        conn = conns[(scheme, netloc)] = cls(netloc, timeout=TIMEOUT_SEC)
+    return conn
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def _iter_body(resp):
+    """Body of a response in chunks of at most STREAM_CHUNK_BYTES, gunzipped on the fly."""
+    gz = zlib.decompressobj(wbits=31) if (resp.getheader("Content-Encoding") or "").lower() == "gzip" else None
+    while True:
+        chunk = resp.read(STREAM_CHUNK_BYTES)
+        if not chunk:
+            break
+        if gz is None:
+            yield chunk
+            continue
+        while chunk:
+            out = gz.decompress(chunk, STREAM_CHUNK_BYTES)
+            if out:
+                yield out
+            chunk = gz.unconsumed_tail
+    if gz is not None:
+        out = gz.flush()
+        if out:
+            yield out
+
+def pooled_get(url, headers, max_redirects=5, consume=None):
+    """
+    GET over this thread's keep-alive connection to the url's host; returns the body
+    bytes (gunzipped). Raises HTTPError on 4xx/5xx like urlopen does. A connection the
+    server dropped in between (reset / closed keep-alive) is reopened and the request resent once.
+    With consume, a successful body is not buffered: consume(chunks) reads it as it arrives
+    and its result is returned; if it stops early the connection is dropped with the rest.
+    """
+    h = dict(headers)
+    h["Accept-Encoding"] = "gzip"
+    h["Connection"] = "keep-alive"
+    for _ in range(max_redirects + 1):
+        parts = urlsplit(url)
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        for attempt in (1, 2):
+            conn = _pooled_connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", target, headers=h)
+                resp = conn.getresponse()
+                if consume is not None and resp.status < 300:
+                    result = consume(_iter_body(resp))
+                    if not resp.isclosed():
+                        conn.close()
+                    return result
+                body = resp.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                conn.close()
+                if attempt == 2:
+                    raise
+            except Exception:
+                conn.close()   # e.g. timeout mid-response: the connection state is unknown
+                raise
+        if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+            body = gzip.decompress(body)
+        if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+            url = urljoin(url, resp.getheader("Location"))
+            continue
+        if resp.status >= 400:
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+        return body
+    raise HTTPError(url, resp.status, "too many redirects", resp.headers, io.BytesIO(body))
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every caller, with AIMD rate adaptation: halved on
+    429/503, timeouts and resets, cut by 20% when latency climbs to 2x its
+    baseline (tracked per endpoint class: listings vs. diffs), grows ~10%/s
+    while responses are healthy.
+    """
+    def __init__(self, rps, min_rps, max_rps):
+        self.rate = float(rps)
+        self.min_rps, self.max_rps = float(min_rps), float(max_rps)
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        self.latency = {}          # endpoint class -> fast EWMA of healthy latency
+        self.baseline = {}         # endpoint class -> slow EWMA of healthy latency
+        self.hold_until = 0.0      # one back-off per second at most
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1.0
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def _back_off(self, now, factor):
+        if now >= self.hold_until:
+            self.rate = max(self.min_rps, self.rate * factor)
+            self.hold_until = now + 1.0
+
+    def observe(self, latency_sec, exc=None, kind="list"):
+        """kind: endpoint class; latency is only held against the baseline of its own class."""
+        with self.lock:
+            now = time.monotonic()
+            if exc is not None:
+                if not isinstance(exc, HTTPError) or exc.code in (429, 503):
+                    self._back_off(now, 0.5)
+                return
+            latency = self.latency[kind] = 0.7 * self.latency.get(kind, latency_sec) + 0.3 * latency_sec
+            baseline = self.baseline[kind] = 0.98 * self.baseline.get(kind, latency_sec) + 0.02 * latency_sec
+            if latency > 2 * baseline and latency > 0.05:
+                self._back_off(now, 0.8)
+            elif now >= self.hold_until:
+                self.rate = min(self.max_rps, self.rate + 0.1)
+
+    @contextmanager
+    def request(self, kind="list"):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        t0 = time.monotonic()
+        try:
+            yield
+        except (OSError, http.client.HTTPException) as e:   # HTTPError, timeouts, resets
+            self.observe(time.monotonic() - t0, e)
+            raise
+        self.observe(time.monotonic() - t0, kind=kind)
+
+rate_limiter = AdaptiveRateLimiter(RATE_LIMIT_RPS, RATE_LIMIT_MIN_RPS, RATE_LIMIT_MAX_RPS)
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class CircuitBreaker:
+    """
+    Per endpoint: after BREAKER_FAILURES consecutive transient failures, requests fail
+    fast for BREAKER_COOLDOWN_SEC, then one is let through; a failure re-opens it.
+    """
+    def __init__(self, failures, cooldown_sec):
+        self.failures, self.cooldown_sec = failures, cooldown_sec
+        self.state = {}    # endpoint -> [consecutive failures, open until (monotonic)]
+        self.lock = threading.Lock()
+
+    def check(self, endpoint):
+        with self.lock:
+            fails, open_until = self.state.get(endpoint, (0, 0.0))
+            if fails >= self.failures and time.monotonic() < open_until:
+                raise CircuitOpenError(f"circuit open for {endpoint} ({fails} consecutive failures)")
+
+    def success(self, endpoint):
+        with self.lock:
+            self.state.pop(endpoint, None)
+
+    def failure(self, endpoint):
+        with self.lock:
+            st = self.state.setdefault(endpoint, [0, 0.0])
+            st[0] += 1
+            if st[0] >= self.failures:
+                st[1] = time.monotonic() + self.cooldown_sec
+
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN_SEC)
+
+def _endpoint_key(url):
+    path = urlsplit(url).path
+    path = re.sub(r"/repositories/[^/]+/[^/]+", "/repositories/*/*", path)
+    return re.sub(r"/(branches|changesets|diff)/[^/]+", r"/\1/*", path)
+
+def _endpoint_class(endpoint):
+    """Latency class of an _endpoint_key() for the rate limiter: diff (raw or parsed) or list."""
+    return "diff" if "/diff" in endpoint else "list"
+
+def is_transient(exc):
+    """Worth retrying: timeouts, resets/dropped connections, 429 and 5xx."""
+    if isinstance(exc, HTTPError):
+        return exc.code == 429 or exc.code >= 500
+    return isinstance(exc, (OSError, http.client.HTTPException))
+
+def retry_delay(attempt, exc):
+    """Full-jitter exponential backoff; honours Retry-After on 429/503."""
+    delay = random.uniform(0, min(RETRY_MAX_SEC, RETRY_BASE_SEC * 2 ** attempt))
+    retry_after = exc.headers.get("Retry-After") if isinstance(exc, HTTPError) and exc.headers else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(RETRY_MAX_SEC, float(retry_after)))
+    return delay
+
+def retry_pause(errors):
+    """
+    Wait before a second pass over failed requests: none when every failure was permanent
+    (4xx, bad data), else the backoff of one more retry - the breaker cooldown if one was open.
+    """
+    waits = [retry_delay(RETRY_MAX_ATTEMPTS, e) for e in errors if is_transient(e)]
+    if any(isinstance(e, CircuitOpenError) for e in errors):
+        waits.append(BREAKER_COOLDOWN_SEC)
+    return max(waits, default=0.0)
+
+def http_get(url, accept=None, consume=None):
+    """Body bytes of url (or consume(chunks), see pooled_get) with rate limiting, retries and breakers."""
+    return _http_get_timed(url, accept, consume)[0]
+
+def _http_get_timed(url, accept=None, consume=None, retry_timeouts=True):
+    """
+    http_get() plus the seconds the answered attempt took (no retries or backoff in it).
+    retry_timeouts=False raises a timeout right away, without a breaker failure: paged
+    requests shrink the page instead of asking for the same size again.
+    """
     h = _headers()
     if accept:
         h["Accept"] = accept
-    req = Request(url, headers=h)
-    if SLEEP_SEC:
-        time.sleep(SLEEP_SEC)
-    with urlopen(req, timeout=TIMEOUT_SEC) as resp:
-        return resp.read()
+    endpoint = _endpoint_key(url)
+    for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
+        breaker.check(endpoint)
+        try:
+            with rate_limiter.request(_endpoint_class(endpoint)):
+                t0 = time.monotonic()
+                body = pooled_get(url, h, consume=consume)
+                elapsed = time.monotonic() - t0
+        except Exception as e:
+            if not is_transient(e) or not retry_timeouts and isinstance(e, TimeoutError):
+                raise
+            breaker.failure(endpoint)
+            if attempt == RETRY_MAX_ATTEMPTS:
+                raise
+            time.sleep(retry_delay(attempt, e))
+            continue
+        breaker.success(endpoint)
+        return body, elapsed
 
 def http_get_json(url):
     return json.loads(http_get(url).decode("utf-8", errors="replace"))
 
+# -----------------------------
+# Local state (stdlib sqlite3)
+# -----------------------------
+_state_lock = threading.Lock()
+_state_conn = None
+_caps = None   # in-memory copy of the capabilities table
+
+def state_db():
+    """Shared SQLite connection to STATE_DIR/state.sqlite; callers must hold _state_lock."""
+    global _state_conn
+    if _state_conn is None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(STATE_DIR, "state.sqlite"), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # stored changesets gained their id column later, and their branch lists went from ";"-joined
+        # (branch names may contain ";") to JSON: repos stored the old way are collected once more
+        stored_cols = [c[1] for c in conn.execute("PRAGMA table_info(changesets)")]
+        if stored_cols and not {"changeset", "branches_json"} <= set(stored_cols):
+            conn.executescript("DROP TABLE changesets; DELETE FROM repo_sync;")
+        conn.executescript("""
+            -- what the server supports (probed once, see capability()); scope = server or server|repo
+            CREATE TABLE IF NOT EXISTS capabilities (
+                scope TEXT NOT NULL,
+                name  TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (scope, name)
+            );
+            -- diff stats per changeset (untruncated diffs only); repo = server|namespace/name
+            CREATE TABLE IF NOT EXISTS diff_stats (
+                repo          TEXT NOT NULL,
+                changeset     TEXT NOT NULL,
+                added         INTEGER NOT NULL,
+                removed       INTEGER NOT NULL,
+                files_changed INTEGER NOT NULL,
+                PRIMARY KEY (repo, changeset)
+            );
+            -- repository list of the last listing, reused for REPO_CACHE_TTL_SEC (position keeps its order)
+            CREATE TABLE IF NOT EXISTS repos (
+                position      INTEGER NOT NULL,
+                namespace     TEXT NOT NULL,
+                name          TEXT NOT NULL,
+                type          TEXT,
+                last_modified TEXT,
+                listed_at     REAL NOT NULL,
+                PRIMARY KEY (namespace, name)
+            );
+            -- lastModified a repo was fully collected at + oldest timestamp its stored changesets reach
+            CREATE TABLE IF NOT EXISTS repo_sync (
+                namespace       TEXT NOT NULL,
+                name            TEXT NOT NULL,
+                last_modified   TEXT NOT NULL,
+                covered_from_ms INTEGER NOT NULL,
+                PRIMARY KEY (namespace, name)
+            );
+            -- changeset rows of that collection (branches joined with ';'), in row order
+            CREATE TABLE IF NOT EXISTS changesets (
+                namespace      TEXT NOT NULL,
+                name           TEXT NOT NULL,
+                position       INTEGER NOT NULL,
+                branch         TEXT NOT NULL,
+                branches_json  TEXT NOT NULL,   -- JSON array of every branch listing the changeset
+                author         TEXT NOT NULL,
+                ts_ms          INTEGER NOT NULL,
+                added          INTEGER,
+                removed        INTEGER,
+                files_changed  INTEGER,
+                diff_truncated INTEGER NOT NULL,
+                changeset      TEXT,
+                PRIMARY KEY (namespace, name, position)
+            );
+        """)
+        _state_conn = conn
+    return _state_conn
+
+def _load_caps():
+    global _caps
+    if _caps is None:
+        _caps = {(sc, n): v for sc, n, v in state_db().execute("SELECT scope, name, value FROM capabilities")}
+    return _caps
+
+def capability(scope, name):
+    """Remembered probe result (from this or an earlier run), or None if never probed."""
+    with _state_lock:
+        return _load_caps().get((scope, name))
+
+def set_capability(scope, name, value):
+    """Remembers a probe result; it is written with the next checkpoint like other state (page sizes change often)."""
+    with _state_lock:
+        caps = _load_caps()
+        if caps.get((scope, name)) == value:
+            return
+        caps[(scope, name)] = value
+        db = state_db()
+        db.execute("INSERT OR REPLACE INTO capabilities VALUES (?, ?, ?)", (scope, name, value))
+        _maybe_commit(db)
+
+_last_checkpoint = time.monotonic()
+
+def _maybe_commit(db):
+    """
+    Commits the open transaction once CHECKPOINT_EVERY_SEC have passed since the last
+    checkpoint (callers hold _state_lock). Writes in between are only lost all together.
+    """
+    global _last_checkpoint
+    if time.monotonic() - _last_checkpoint >= CHECKPOINT_EVERY_SEC:
+        db.commit()
+        _last_checkpoint = time.monotonic()
+
+def checkpoint():
+    """Commits whatever collected state is still pending."""
+    global _last_checkpoint
+    with _state_lock:
+        state_db().commit()
+        _last_checkpoint = time.monotonic()
+
+def cache_get_diff(repo_scope, changeset):
+    """Cached (added, removed, files) of a changeset's diff, or None if never fetched."""
+    with _state_lock:
+        return state_db().execute(
+            "SELECT added, removed, files_changed FROM diff_stats WHERE repo = ? AND changeset = ?",
+            (repo_scope, changeset)).fetchone()
+
+def cache_put_diff(repo_scope, changeset, added, removed, files):
+    with _state_lock:
+        db = state_db()
+        db.execute("INSERT OR REPLACE INTO diff_stats VALUES (?, ?, ?, ?, ?)",
+                   (repo_scope, changeset, added, removed, files))
+        _maybe_commit(db)
+
+def load_inventory(max_age_sec):
+    """Repositories (namespace, name, type, lastModified) listed at most max_age_sec ago, or None."""
+    with _state_lock:
+        found = state_db().execute(
+            "SELECT namespace, name, type, last_modified, listed_at FROM repos ORDER BY position").fetchall()
+    if not found or min(r[4] for r in found) < time.time() - max_age_sec:
+        return None
+    return [{"namespace": ns, "name": name, "type": rtype, "lastModified": modified}
+            for ns, name, rtype, modified, _ in found]
+
+def store_inventory(repos):
+    with _state_lock:
+        db = state_db()
+        now = time.time()
+        db.execute("DELETE FROM repos")
+        db.executemany("INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?, ?, ?)",
+                       [(i, r.get("namespace"), r.get("name"), r.get("type"), r.get("lastModified"), now)
+                        for i, r in enumerate(repos) if r.get("namespace") and r.get("name")])
+        db.commit()
+
+def load_synced(ns, name, last_modified, cutoff_ms):
+    """
+    Stored changeset rows (branch, branches as JSON, author, ts_ms, added, removed, files_changed,
+    diff_truncated, changeset id) of a repo not modified since it was collected, newer than cutoff_ms;
+    None if the repo changed or was never collected that far back.
+    """
+    with _state_lock:
+        db = state_db()
+        sync = db.execute("SELECT last_modified, covered_from_ms FROM repo_sync WHERE namespace = ? AND name = ?",
+                          (ns, name)).fetchone()
+        if not sync or sync[0] != last_modified or sync[1] > cutoff_ms:
+            return None
+        return db.execute(
+            "SELECT branch, branches_json, author, ts_ms, added, removed, files_changed, diff_truncated, changeset "
+            "FROM changesets WHERE namespace = ? AND name = ? AND ts_ms >= ? ORDER BY position",
+            (ns, name, cutoff_ms)).fetchall()
+
+def store_synced(ns, name, last_modified, records, covered_from_ms):
+    """Replaces a repo's stored changeset rows (same fields as load_synced) and its sync mark."""
+    with _state_lock:
+        db = state_db()
+        db.execute("DELETE FROM changesets WHERE namespace = ? AND name = ?", (ns, name))
+        db.executemany("INSERT INTO changesets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       [(ns, name, i, *rec) for i, rec in enumerate(records)])
+        db.execute("INSERT OR REPLACE INTO repo_sync VALUES (?, ?, ?, ?)", (ns, name, last_modified, covered_from_ms))
+        db.commit()
+
+SERVER_SCOPE = HOST.rstrip("/")
+
 def detect_api_root():
     # Most common for your UI (/scm/...): /scm/api/v2
     candidates = [HOST.rstrip("/") + "/scm/api/v2", HOST.rstrip("/") + "/api/v2"]
+    known = capability(SERVER_SCOPE, "api_root")
+    if known in candidates:
+        candidates.remove(known)
+        candidates.insert(0, known)
     errs = []
     for root in candidates:
         try:
             # repositories endpoint exists per SCM-Manager test cases
             # Try with different Accept headers as some servers are picky
             url = root.rstrip("/") + "/repositories?pageSize=1&page=0"
-            req = Request(url, headers=_headers())
-            # Override Accept header - try with wildcard
-            req.add_header("Accept", "*/*")
-            with urlopen(req, timeout=TIMEOUT_SEC) as resp:
-                content = resp.read()
-                # Try to parse as JSON
-                json.loads(content.decode("utf-8", errors="replace"))
+            # Accept: wildcard
+            content = http_get(url, accept="*/*")
+            # Try to parse as JSON
+            json.loads(content.decode("utf-8", errors="replace"))
             print("Using API root:", root)
+            set_capability(SERVER_SCOPE, "api_root", root)
             return root
         except HTTPError as e:
             errs.append((root, f"HTTP {e.code}"))
@@ -522,30 +2530,166 @@ def resolve_link(link_value):
     # href may already include /scm/api/v2/..., so join with HOST
     return urljoin(HOST.rstrip("/") + "/", href.lstrip("/"))
 
-def paginate_embedded(url, embedded_key):
+def detect_embedded_key(embedded, candidates):
+    """
+    Which _embedded list holds the items: the one remembered for this server, else the
+    first candidate present, else the first embedded key (remembered for next time).
+    """
+    cap = "embedded_key:" + candidates[0]
+    known = capability(SERVER_SCOPE, cap)
+    if known in embedded:
+        return known
+    key = next((k for k in candidates if k in embedded), None) or next(iter(embedded), None)
+    if key:
+        set_capability(SERVER_SCOPE, cap, key)
+    return key
+
+class PageSizer:
+    """
+    Page size per endpoint: doubles while full pages come back within PAGE_FAST_SEC (up to
+    what the server accepts), halves on pages slower than PAGE_SLOW_SEC and on timeouts.
+    The size an endpoint settles at is remembered in the capabilities table and is where
+    the next listing (and run) starts.
+    """
+    def __init__(self, min_size, max_size):
+        self.min_size, self.max_size = min_size, max_size
+        self.sizes = {}         # endpoint -> current size
+        self.server_max = {}    # endpoint -> largest size the server answered with
+        self.lock = threading.Lock()
+
+    def size(self, endpoint, default):
+        with self.lock:
+            if endpoint not in self.sizes:
+                known = capability(SERVER_SCOPE, "page_size:" + endpoint)
+                known_max = capability(SERVER_SCOPE, "page_max:" + endpoint)
+                self.sizes[endpoint] = int(known) if known else default
+                if known_max:
+                    self.server_max[endpoint] = int(known_max)
+            return self.sizes[endpoint]
+
+    def observe(self, endpoint, size, elapsed, count, server_limit=None):
+        """Feedback for one page of count items asked for with size; returns the next size."""
+        with self.lock:
+            if server_limit and server_limit < size and server_limit < self.server_max.get(endpoint, size + 1):
+                self.server_max[endpoint] = server_limit
+                set_capability(SERVER_SCOPE, "page_max:" + endpoint, str(server_limit))
+            top = min(self.max_size, self.server_max.get(endpoint, self.max_size))
+            if elapsed > PAGE_SLOW_SEC:
+                new = max(self.min_size, size // 2)
+            elif count >= size and elapsed < PAGE_FAST_SEC:
+                new = min(top, size * 2)
+            else:
+                new = min(top, self.sizes.get(endpoint, size))
+            return self._set(endpoint, new)
+
+    def timed_out(self, endpoint, size):
+        """Smaller size to retry a page that timed out with, or None at the minimum."""
+        if size <= self.min_size:
+            return None
+        with self.lock:
+            return self._set(endpoint, max(self.min_size, size // 2))
+
+    def _set(self, endpoint, new):
+        if self.sizes.get(endpoint) != new:
+            self.sizes[endpoint] = new
+            set_capability(SERVER_SCOPE, "page_size:" + endpoint, str(new))
+        return new
+
+page_sizer = PageSizer(PAGE_SIZE_MIN, PAGE_SIZE_MAX)
+# look-ahead pages only (the page a caller waits for is fetched on its own thread): one per
+# branch listing and repo detail thread, plus the main thread's repository listing
+_prefetch_pool = ThreadPoolExecutor(max_workers=BRANCH_WORKERS + REPO_WORKERS + 1)
+
+def page_url(url, page, size=PAGE_SIZE):
+    return url + ("&" if "?" in url else "?") + urlencode({"page": page, "pageSize": size})
+
+def has_next_page(data, page):
+    # If there's a "next" link, continue; otherwise stop.
+    if "next" in (data.get("_links") or {}):
+        return True
+    # Some responses include page/pageTotal; use it if present
+    page_total = data.get("pageTotal")
+    return isinstance(page_total, int) and page + 1 < page_total
+
+def aligned_page_size(offset, target):
+    # page/pageSize can only address offsets that are a multiple of the page size, so a
+    # size change mid-listing takes the largest size <= target that lands on offset
+    size = max(1, target)
+    while offset % size:
+        size -= 1
+    return size
+
+def _timed_get_json(url, size):
+    # a page that times out is asked for again smaller (see iter_pages), not at the same
+    # size; only at the smallest size is the timeout retried like any other request
+    body, elapsed = _http_get_timed(url, retry_timeouts=size <= page_sizer.min_size)
+    return json.loads(body.decode("utf-8", errors="replace")), elapsed
+
+def iter_pages(url, embedded_key, more=None):
+    """
+    Pages of a page/pageSize listing as (response, items, page, page size).
+    The size starts where PageSizer left this endpoint and adapts as pages arrive; the
+    next page is requested in the background unless more(items) says the caller will
+    stop within this page anyway. A server that caps pageSize answers short pages that
+    still have a next one: the cap is remembered and the page re-read at a size it serves.
+    embedded_key may be a tuple of candidates, see detect_embedded_key().
+    """
+    endpoint = _endpoint_key(url)
+    size = page_sizer.size(endpoint, PAGE_SIZE)
+    offset = 0
+    pending = None   # look-ahead request for the page at offset
+    try:
+        while True:
+            try:
+                if pending is not None:
+                    data, elapsed = pending.result()
+                else:
+                    data, elapsed = _timed_get_json(page_url(url, offset // size, size), size)
+            except TimeoutError:
+                pending = None
+                smaller = page_sizer.timed_out(endpoint, size)
+                if smaller is None:
+                    raise
+                size = aligned_page_size(offset, smaller)
+                continue
+            pending = None
+            embedded = (data.get("_embedded") or {})
+            if isinstance(embedded_key, tuple):
+                embedded_key = detect_embedded_key(embedded, embedded_key)
+            items = embedded.get(embedded_key) or []
+            page = offset // size
+            has_next = has_next_page(data, page)
+            served = size
+            if has_next and 0 < len(items) < size:
+                # capped by the server: page 0 is the same either way, later pages are not
+                next_size = page_sizer.observe(endpoint, size, elapsed, len(items), len(items))
+                if page:
+                    size = aligned_page_size(offset, next_size)
+                    continue
+                served = len(items)
+            else:
+                next_size = page_sizer.observe(endpoint, size, elapsed, len(items))
+            offset += served
+            if has_next:
+                size = aligned_page_size(offset, next_size)
+                if more is None or more(items):
+                    pending = _prefetch_pool.submit(_timed_get_json, page_url(url, offset // size, size), size)
+            yield data, items, page, served
+            if not has_next:
+                return
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+def paginate_embedded(url, embedded_key, more=None):
     """
     SCM-Manager pagination is page/pageSize (see test cases) :contentReference[oaicite:6]{index=6}
-    We iterate pages until no next/last hint.
+    We iterate pages until no next/last hint; page sizes adapt, see iter_pages().
+    embedded_key may be a tuple of candidates (e.g. changesets vs commits, which differs
+    between servers): the first page decides, no separate probe request needed.
     """
-    page = 0
-    while True:
-        u = url + ("&" if "?" in url else "?") + urlencode({"page": page, "pageSize": PAGE_SIZE})
-        data = http_get_json(u)
-        embedded = (data.get("_embedded") or {})
-        items = embedded.get(embedded_key) or []
-        for it in items:
-            yield it
-        links = data.get("_links") or {}
-        # If there's a "next" link, continue; otherwise stop.
-        if "next" in links:
-            page += 1
-            continue
-        # Some responses include page/pageTotal; use it if present
-        page_total = data.get("pageTotal")
-        if isinstance(page_total, int) and page + 1 < page_total:
-            page += 1
-            continue
-        break
+    for data, items, page, size in iter_pages(url, embedded_key, more):
+        yield from items
 
 # -----------------------------
 # Domain logic
@@ -571,250 +2715,1047 @@ def parse_any_datetime(val):
             return None
     return None
 
+def changeset_datetime(cs):
+    # date fields vary; try common names
+    return (parse_any_datetime(cs.get("date")) or
+            parse_any_datetime(cs.get("timestamp")) or
+            parse_any_datetime(cs.get("creationDate")))
+
+def page_order(items):
+    """"newest_first" / "oldest_first" from the dates on one page, None if it cannot tell."""
+    dates = [dt for dt in map(changeset_datetime, items) if dt]
+    if len(dates) < 2 or dates[0] == dates[-1]:
+        return None
+    return "newest_first" if dates[0] > dates[-1] else "oldest_first"
+
+def iter_changesets_newest_first(url, cutoff):
+    """
+    A branch's changesets newest-first, so callers can stop at the first one older than
+    cutoff. SCM-Manager has no date filter on changesets, so the window cannot be pushed
+    to the server; instead the order is read off the first page (remembered per server):
+    newest-first pages are walked forward, oldest-first ones backwards from the last page
+    (pageTotal). Without pageTotal an oldest-first history has to be read forward; only
+    its part inside the window is kept.
+    """
+    candidates = ("changesets", "commits")
+
+    def order_of(items):
+        return page_order(items) or capability(SERVER_SCOPE, "changeset_order") or "newest_first"
+
+    def goes_on(items):
+        # prefetch only what a newest-first walk will read; oldest-first jumps to the end
+        last = changeset_datetime(items[-1]) if items else None
+        return order_of(items) == "newest_first" and (last is None or last >= cutoff)
+
+    pages = iter_pages(url, candidates, more=goes_on)
+    pending = None
+    try:
+        data, items, page, size = next(pages)
+        order = page_order(items)
+        if order:
+            set_capability(SERVER_SCOPE, "changeset_order", order)
+        else:
+            order = order_of(items)
+
+        if order == "newest_first":
+            yield from items
+            for data, items, page, size in pages:
+                yield from items
+            return
+
+        page_total = data.get("pageTotal")
+        if isinstance(page_total, int):
+            pages.close()
+            key = detect_embedded_key(data.get("_embedded") or {}, candidates)
+
+            def fetch(page):
+                data = http_get_json(page_url(url, page, size))   # pages counted from the end: fixed size
+                return (data.get("_embedded") or {}).get(key) or []
+
+            for page in range(page_total - 1, 0, -1):
+                current = pending.result() if pending is not None else fetch(page)
+                pending = _prefetch_pool.submit(fetch, page - 1) if page > 1 else None
+                yield from reversed(current)
+            yield from reversed(items)
+            return
+
+        in_window = []
+        while True:
+            in_window.extend(cs for cs in items if (changeset_datetime(cs) or cutoff) >= cutoff)
+            nxt = next(pages, None)
+            if nxt is None:
+                break
+            data, items, page, size = nxt
+        yield from reversed(in_window)
+    finally:
+        pages.close()
+        if pending is not None:
+            pending.cancel()
+
 def week_start_utc(dt):
     d = dt.date()
     monday = d - timedelta(days=d.weekday())
     return datetime(monday.year, monday.month, monday.day, tzinfo=timezone.utc)
 
-def count_diff_stats(diff_text):
-    added = removed = 0
-    files = set()
-
-    # file boundary heuristics for git/hg/svn-ish diffs
-    # - git: "diff --git a/... b/..."
-    # - svn: "Index: path"
-    # - hg: "diff -r ..." often followed by "diff --git" too in some modes
-    for line in diff_text.splitlines():
-        if line.startswith("diff --git "):
-            files.add(line.strip())
-            continue
-        if line.startswith("Index: "):
-            files.add(line.strip())
-            continue
+def merge_sources(mainline, others, window=timedelta(days=3)):
+    """
+    Likely source branch of each mainline commit (a pandas Series aligned with mainline):
+    the branch its developer committed to most in `others` within window before it, ties
+    going to the branch seen first in `others` (sorted by time); None without such activity.
+    Per developer, the window bounds are binary searches over that developer's commit times
+    on each branch, instead of filtering all of `others` once per mainline commit.
+    """
+    import numpy as np
+    epoch = pd.Timestamp(0, tz="UTC")
 
-        # line counts: ignore headers
-        if line.startswith("+++ ") or line.startswith("--- "):
-            continue
-        if line.startswith("+"):
-            added += 1
-        elif line.startswith("-"):
-            removed += 1
+    def ms(col):
+        return ((pd.to_datetime(col, utc=True) - epoch) // pd.Timedelta(milliseconds=1)).to_numpy(np.int64)
+
+    result = np.full(len(mainline), None, dtype=object)
+    main_dev, main_t = mainline["developer"].astype(str).to_numpy(), ms(mainline["datetime_utc"])
+    other_dev, other_t = others["developer"].astype(str).to_numpy(), ms(others["datetime_utc"])
+    other_branch = others["branch"].astype(str).to_numpy()
+    span = int(window.total_seconds() * 1000)
+    for dev in np.intersect1d(main_dev, other_dev):
+        sel = np.flatnonzero(other_dev == dev)          # in others' order, so times ascend
+        names, codes = np.unique(other_branch[sel], return_inverse=True)
+        at = np.flatnonzero(main_dev == dev)
+        lo = np.searchsorted(other_t[sel], main_t[at] - span, side="left")
+        hi = np.searchsorted(other_t[sel], main_t[at], side="right")
+        counts = np.empty((len(names), len(at)), dtype=np.int64)
+        first = np.empty((len(names), len(at)), dtype=np.int64)   # first position in the window
+        for k in range(len(names)):
+            pos = np.flatnonzero(codes == k)
+            start = np.searchsorted(pos, lo, side="left")
+            counts[k] = np.searchsorted(pos, hi, side="left") - start
+            first[k] = np.append(pos, len(sel))[start]
+        top = counts.max(axis=0)
+        best = np.where(counts == top, first, len(sel)).argmin(axis=0)
+        found = top > 0
+        result[at[found]] = names[best[found]]
+    return pd.Series(result, index=mainline.index, dtype=object)
+
+CUBE_MEASURES = {"changesets": "sum", "added": "sum", "removed": "sum", "net": "sum", "files_changed": "sum",
+                 "first": "min", "last": "max"}
+
+def build_cube(df):
+    """
+    The one pass over the changeset frame every report rollup is taken from: measures per
+    (week, project, branch, developer) cell. A changeset counts on each of its branches;
+    `primary` marks the cells of its primary branch, where it is counted once for project
+    and developer totals.
+    """
+    cells = pd.DataFrame({
+        "week": df["week_start_utc"], "project": df["repo"], "developer": df["author"],
+        "branch": df["branches"], "primary_branch": df["branch"].astype(str),
+        "changesets": 1, "added": df["added"], "removed": df["removed"], "net": df["net"],
+        "files_changed": df["files_changed"], "first": df["datetime_utc"], "last": df["datetime_utc"],
+    }).explode("branch")
+    cells["primary"] = cells["branch"] == cells["primary_branch"]
+    cells["branch"] = cells["branch"].astype("category")
+    return (cells.groupby(["week", "project", "branch", "developer", "primary"], as_index=False, observed=True)
+                 .agg(**{m: (m, how) for m, how in CUBE_MEASURES.items()}))
+
+def rollup(cube, keys, per_branch=False, touched=None):
+    """
+    Cube cells summed up to keys (sorted like a groupby). per_branch: a changeset counts
+    on every branch it is on (branch views) instead of once. touched: {column: cube
+    dimension} distinct counts, e.g. {"branches_touched": "branch"}.
+    """
+    cells = cube if per_branch else cube[cube["primary"]]
+    out = cells.groupby(keys, as_index=False, observed=True).agg(**{m: (m, how) for m, how in CUBE_MEASURES.items()})
+    for col, dim in (touched or {}).items():
+        out[col] = cube.groupby(keys, observed=True)[dim].nunique().to_numpy()
+    return out
+
+# cube measure -> column name in the project/branch/developer reports
+REPORT_COLUMNS = {"changesets": "commits", "added": "added_rows", "removed": "deleted_rows", "net": "net_rows",
+                  "first": "first_datetime", "last": "last_datetime"}
+
+class ColumnarRows:
+    """
+    Append-only typed columns for the collected rows, instead of a list of dicts.
+    Schema: [(name, kind)] with kind
+      "dim"   - repeated strings, interned into int32 codes
+      "ms"    - int64 epoch milliseconds (UTC)
+      "int"   - int32 counter, None/missing stored as -1
+      "flag"  - boolean, stored as int8
+      "text"  - high-cardinality strings (ids), kept as a plain list
+    Not thread-safe: callers serialize append()/set().
+    """
+    MISSING = -1
+
+    def __init__(self, schema):
+        self.schema = list(schema)
+        self._cols = {}
+        self._interned = {}   # dim name -> (value -> code, values)
+        for name, kind in self.schema:
+            if kind == "dim":
+                self._cols[name] = array("i")
+                self._interned[name] = ({}, [])
+            elif kind == "ms":
+                self._cols[name] = array("q")
+            elif kind == "int":
+                self._cols[name] = array("i")
+            elif kind == "flag":
+                self._cols[name] = array("b")
+            else:
+                self._cols[name] = []
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def append(self, **row):
+        """Appends one row (missing keys -> None); returns its index."""
+        for name, kind in self.schema:
+            v = row.get(name)
+            if kind == "dim":
+                index, values = self._interned[name]
+                code = index.get(v)
+                if code is None:
+                    code = index[v] = len(values)
+                    values.append(v)
+                v = code
+            elif kind == "int" and v is None:
+                v = self.MISSING
+            elif kind == "flag":
+                v = bool(v)
+            self._cols[name].append(v)
+        self._n += 1
+        return self._n - 1
+
+    def get(self, i, name):
+        v = self._cols[name][i]
+        kind = dict(self.schema)[name]
+        if kind == "dim":
+            return self._interned[name][1][v]
+        if kind == "int" and v == self.MISSING:
+            return None
+        if kind == "flag":
+            return bool(v)
+        return v
+
+    def set(self, i, **values):
+        """Overwrites counters and flags ("int"/"flag" columns) of row i."""
+        for name, v in values.items():
+            self._cols[name][i] = self.MISSING if v is None else v
+
+    def column(self, name):
+        """Raw column ("text" columns: the list of values itself)."""
+        return self._cols[name]
+
+    def values(self, name):
+        """Column as a list of row values: "dim" decoded, missing "int" as None, "ms" left as epoch ms."""
+        col = self._cols[name]
+        kind = dict(self.schema)[name]
+        if kind == "dim":
+            decoded = self._interned[name][1]
+            return [decoded[code] for code in col]
+        if kind == "int":
+            return [None if v == self.MISSING else v for v in col]
+        if kind == "flag":
+            return [bool(v) for v in col]
+        return list(col)
+
+    def iter_rows(self):
+        """Row dicts ("ms" as tz-aware datetimes); only for the pandas-less fallback."""
+        for i in range(self._n):
+            row = {name: self.get(i, name) for name, _ in self.schema}
+            for name, kind in self.schema:
+                if kind == "ms":
+                    row[name] = datetime.fromtimestamp(row[name] / 1000, tz=timezone.utc)
+            yield row
+
+    def to_frame(self):
+        """
+        DataFrame built straight from the typed buffers: sorted categoricals for "dim",
+        datetime64[ns, UTC] for "ms", the narrowest nullable Int8/Int16/Int32 that holds each
+        "int" column, bool for "flag". Sums widen to Int64; widen by hand before adding two
+        counters row-wise (Int8 + Int8 wraps).
+        """
+        import numpy as np
+        data = {}
+        for name, kind in self.schema:
+            col = self._cols[name]
+            if kind == "dim":
+                values = self._interned[name][1]
+                cats = sorted(v for v in values if v is not None)
+                pos = {v: k for k, v in enumerate(cats)}
+                remap = np.array([pos.get(v, -1) for v in values] + [-1], dtype=np.int32)
+                codes = remap[np.frombuffer(col, dtype=np.int32)] if self._n else np.empty(0, np.int32)
+                data[name] = pd.Categorical.from_codes(codes, categories=cats)
+            elif kind == "ms":
+                data[name] = pd.to_datetime(np.frombuffer(col, dtype=np.int64), unit="ms", utc=True).as_unit("ns")
+            elif kind == "int":
+                vals = np.frombuffer(col, dtype=np.int32)
+                missing = vals == self.MISSING
+                present = vals[~missing]
+                lo, hi = (int(present.min()), int(present.max())) if len(present) else (0, 0)
+                dtype = next(t for t in (np.int8, np.int16, np.int32)
+                             if np.iinfo(t).min <= lo and hi <= np.iinfo(t).max)
+                data[name] = pd.arrays.IntegerArray(vals.astype(dtype), missing)
+            elif kind == "flag":
+                data[name] = np.frombuffer(col, dtype=np.int8).astype(bool)
+            else:
+                data[name] = col
+        return pd.DataFrame(data)
+
+def memory_report(df, label):
+    """
+    Prints df's deep memory use next to what pd.DataFrame(row dicts) takes for the same
+    data: Python strings instead of categoricals, int64/float64 instead of narrow counters.
+    """
+    import numpy as np
+    typed = untyped = 0
+    for name in df.columns:
+        col = df[name]
+        size = int(col.memory_usage(index=False, deep=True))
+        typed += size
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # code -1 (missing) picks the trailing None
+            sizes = np.array([sys.getsizeof(v) for v in col.cat.categories] + [sys.getsizeof(None)], dtype=np.int64)
+            untyped += 8 * len(col) + int(sizes[col.cat.codes.to_numpy()].sum())
+        elif pd.api.types.is_integer_dtype(col.dtype):
+            untyped += 8 * len(col)
+        else:
+            untyped += size
+    print(f"[INFO] {label}: {typed / 2**20:.1f} MiB typed, {untyped / 2**20:.1f} MiB as untyped columns")
+
+def write_columnar(df, name, partitioned=False):
+    """
+    Columnar copy of an exported table in EXPORT_FORMAT, read back with its dtypes by
+    pd.read_parquet(path) / pd.read_feather(path). partitioned: adds a "month" (YYYY-MM)
+    column and writes Parquet as one directory per project (name/project=.../), so
+    filters=[("project", "==", ...)] only opens that project's files. Returns the path,
+    or None (no pyarrow / CSV only).
+    """
+    import numpy as np
+    if pyarrow is None or not EXPORT_FORMAT:
+        return None
+    # counters go out as Int32 whatever width this run's data fitted in, so the schema stays stable
+    narrow = [c for c, t in df.dtypes.items() if isinstance(t, (pd.Int8Dtype, pd.Int16Dtype))]
+    df = df.reset_index(drop=True).astype({c: "Int32" for c in narrow})
+    if partitioned:
+        months = df["datetime_utc"].dt.tz_convert(None).to_numpy().astype("datetime64[M]")
+        labels, codes = np.unique(months, return_inverse=True)
+        df = df.assign(month=pd.Categorical.from_codes(codes, [str(m) for m in labels]))
+    if EXPORT_FORMAT == "feather":
+        df.to_feather(f"{name}.feather")
+        return f"{name}.feather"
+    if not partitioned:
+        df.to_parquet(f"{name}.parquet", index=False)
+        return f"{name}.parquet"
+    # files of an earlier run would be read back as part of the dataset. Months stay a column:
+    # project x month directories make hundreds of small files a year that take seconds to open.
+    # Rows grouped by project first, or each file is written as many tiny row groups
+    shutil.rmtree(name, ignore_errors=True)
+    df.sort_values("project", kind="stable").to_parquet(name, partition_cols=["project"], index=False)
+    return name
+
+# -----------------------------
+# Dashboard database (DASHBOARD_DB)
+# -----------------------------
+# tables as server/database.ts creates them; their secondary indexes are in DASHBOARD_INDEXES
+DASHBOARD_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS repositories (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        namespace TEXT,
+        description TEXT,
+        primaryLanguage TEXT,
+        lastActivity TEXT,
+        healthScore INTEGER DEFAULT 70
+    );
+    CREATE TABLE IF NOT EXISTS developers (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        email TEXT,
+        avatar TEXT,
+        role TEXT,
+        joinedDate TEXT
+    );
+    CREATE TABLE IF NOT EXISTS commits (
+        hash TEXT PRIMARY KEY,
+        message TEXT,
+        timestamp TEXT,
+        additions INTEGER DEFAULT 0,
+        deletions INTEGER DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS repo_commits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        repo_id TEXT NOT NULL,
+        developer_id TEXT NOT NULL,
+        commit_hash TEXT NOT NULL,
+        FOREIGN KEY (repo_id) REFERENCES repositories(id),
+        FOREIGN KEY (developer_id) REFERENCES developers(id),
+        FOREIGN KEY (commit_hash) REFERENCES commits(hash),
+        UNIQUE(repo_id, commit_hash)
+    );
+    CREATE TABLE IF NOT EXISTS branches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        repo_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        is_default INTEGER DEFAULT 0,
+        last_commit_date TEXT,
+        commit_count INTEGER DEFAULT 0,
+        FOREIGN KEY (repo_id) REFERENCES repositories(id),
+        UNIQUE(repo_id, name)
+    );
+    CREATE TABLE IF NOT EXISTS metadata (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TABLE IF NOT EXISTS developer_aliases (
+        developer_id TEXT PRIMARY KEY,
+        custom_name TEXT NOT NULL,
+        FOREIGN KEY (developer_id) REFERENCES developers(id)
+    );
+"""
+DASHBOARD_INDEXES = {
+    "idx_repo_commits_repo": "repo_commits(repo_id)",
+    "idx_repo_commits_dev": "repo_commits(developer_id)",
+    "idx_commits_timestamp": "commits(timestamp)",
+    "idx_branches_repo": "branches(repo_id)",
+}
+DASHBOARD_REINDEX_SHARE = 0.5   # batch >= this share of the stored commits: drop the indexes and rebuild them once
+
+_iso_days = {}   # epoch day -> "YYYY-MM-DDT"
+
+def iso_ms(ts_ms):
+    """Epoch ms in the dashboard's timestamp format (JavaScript toISOString, 2026-01-12T21:29:30.000Z)."""
+    day, ms = divmod(ts_ms, 86400000)
+    prefix = _iso_days.get(day)
+    if prefix is None:
+        prefix = _iso_days[day] = time.strftime("%Y-%m-%dT", time.gmtime(day * 86400))
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    return f"{prefix}{h:02d}:{m:02d}:{ms // 1000:02d}.{ms % 1000:03d}Z"
+
+def health_score(commits, contributors, last_ms, now_ms):
+    """Repository health the way server/sync.ts scores it: volume (0-40) + contributors (0-30) + recency (5-30)."""
+    days = (now_ms - last_ms) / 86400000
+    recency = next((score for limit, score in ((7, 30), (30, 25), (90, 20), (180, 15), (365, 10)) if days <= limit), 5)
+    return int(min(commits / 10, 40) + min(contributors * 5, 30) + recency + 0.5)
+
+SAFE_URI_CHARS = "-_.!~*'()"   # what JavaScript's encodeURIComponent leaves alone
+
+def dashboard_developer(author, email=None):
+    """developers upsert parameters for an author: (id, name, email, fallback email, avatar, joinedDate)."""
+    return (DEVELOPER_IDS.get(author, author), author, email or None,
+            re.sub(r"\s+", ".", author.lower()) + "@scm.local",
+            f"https://ui-avatars.com/api/?name={quote(author, safe=SAFE_URI_CHARS)}&background=random&size=128",
+            iso_ms(int(time.time() * 1000)))
+
+def write_dashboard_db(repositories, developers, commits, repo_commits, branches, stats):
+    """
+    Upserts collected rows into DASHBOARD_DB in one transaction: one executemany per table.
+    A backfill (stats["commits"] at least DASHBOARD_REINDEX_SHARE of the stored commits)
+    drops the secondary indexes for the load and rebuilds them once at the end; a regular
+    sync keeps them and updates them in place, which is cheaper for small batches. Arguments
+    are iterables of parameter tuples for the statements below (see the callers); stats
+    goes to metadata.last_sync_stats like a dashboard sync. What git.py doesn't collect
+    keeps its stored value: repo descriptions, commit messages, custom names from
+    developer_aliases, and (passed as None) e-mails, stats and default-branch flags.
+    """
+    os.makedirs(os.path.dirname(DASHBOARD_DB) or ".", exist_ok=True)
+    db = sqlite3.connect(DASHBOARD_DB, isolation_level=None)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA cache_size=-131072")   # 128 MiB: keeps the primary key b-trees in memory
+        db.executescript(DASHBOARD_SCHEMA)
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            stored = db.execute("SELECT count(*) FROM commits").fetchone()[0]
+            reindex = stats["commits"] >= DASHBOARD_REINDEX_SHARE * stored
+            if reindex:
+                for index in DASHBOARD_INDEXES:
+                    db.execute(f"DROP INDEX IF EXISTS {index}")
+            db.executemany("""
+                INSERT INTO repositories (id, name, namespace, primaryLanguage, lastActivity, healthScore)
+                VALUES (?1, ?2, ?3, COALESCE(?4, 'Unknown'), ?5, ?6)
+                ON CONFLICT(id) DO UPDATE SET name = excluded.name, namespace = excluded.namespace,
+                    primaryLanguage = COALESCE(?4, repositories.primaryLanguage), lastActivity = excluded.lastActivity,
+                    healthScore = excluded.healthScore""", repositories)
+            db.executemany("""
+                INSERT INTO developers (id, name, email, avatar, role, joinedDate)
+                VALUES (?1, ?2, COALESCE(?3, ?4), ?5, 'Developer', ?6)
+                ON CONFLICT(id) DO UPDATE SET
+                    name = COALESCE((SELECT custom_name FROM developer_aliases WHERE developer_id = excluded.id),
+                                    excluded.name),
+                    email = COALESCE(?3, developers.email), avatar = excluded.avatar""", developers)
+            db.executemany("""
+                INSERT INTO commits (hash, message, timestamp, additions, deletions)
+                VALUES (?1, '', ?2, COALESCE(?3, 0), COALESCE(?4, 0))
+                ON CONFLICT(hash) DO UPDATE SET timestamp = excluded.timestamp,
+                    additions = COALESCE(?3, commits.additions), deletions = COALESCE(?4, commits.deletions)""",
+                commits)
+            db.executemany("""
+                INSERT INTO repo_commits (repo_id, developer_id, commit_hash) VALUES (?1, ?2, ?3)
+                ON CONFLICT(repo_id, commit_hash) DO UPDATE SET developer_id = excluded.developer_id""",
+                repo_commits)
+            db.executemany("""
+                INSERT INTO branches (repo_id, name, is_default, last_commit_date, commit_count)
+                VALUES (?1, ?2, COALESCE(?3, 0), ?4, ?5)
+                ON CONFLICT(repo_id, name) DO UPDATE SET is_default = COALESCE(?3, branches.is_default),
+                    last_commit_date = excluded.last_commit_date, commit_count = excluded.commit_count""",
+                branches)
+            db.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                           [("last_sync_time", iso_ms(int(time.time() * 1000))), ("last_sync_stats", json.dumps(stats))])
+            for index, columns in DASHBOARD_INDEXES.items():
+                db.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {columns}")   # no-op where they were kept
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        # the dashboard server (sql.js) reads the bare file: fold the WAL back into it
+        db.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        db.close()
+
+def count_diff_stream(chunks):
+    """Streams a diff body through a DiffStatsCounter (stops reading at MAX_DIFF_BYTES)."""
+    counter = DiffStatsCounter(MAX_DIFF_BYTES, STREAM_CHUNK_BYTES)
+    for chunk in chunks:
+        if not counter.feed(chunk):
+            break
+    return counter.close()
+
+DIFF_ACCEPT_HEADERS = ("text/plain", "*/*")
+
+def _diff_accept_order(repo_scope):
+    """Accept headers to try: the one remembered for this repo/server first."""
+    known = capability(repo_scope, "diff_accept") or capability(SERVER_SCOPE, "diff_accept")
+    if known not in DIFF_ACCEPT_HEADERS:
+        return DIFF_ACCEPT_HEADERS
+    return (known,) + tuple(a for a in DIFF_ACCEPT_HEADERS if a != known)
+
+def _diff_accept_worked(repo_scope, accept_header):
+    server_accept = capability(SERVER_SCOPE, "diff_accept")
+    if server_accept is None:
+        set_capability(SERVER_SCOPE, "diff_accept", accept_header)
+    elif server_accept != accept_header:
+        set_capability(repo_scope, "diff_accept", accept_header)
+
+def count_parsed_diff(diff_json):
+    """(added, removed, files_changed) of SCM-Manager's structured diff: files -> hunks -> changes."""
+    added = removed = files_changed = 0
+    for file_info in diff_json.get("files", []):
+        files_changed += 1
+        # Check for hunks or changes
+        for hunk in file_info.get("hunks", []):
+            for change in hunk.get("changes", []):
+                change_type = change.get("type", "")
+                if change_type == "insert":
+                    added += 1
+                elif change_type == "delete":
+                    removed += 1
+    return added, removed, files_changed
 
-    return added, removed, len(files)
+def read_capped(chunks):
+    """Whole body, unless it grows past MAX_DIFF_BYTES (then None; the rest is not read)."""
+    parts, size = [], 0
+    for chunk in chunks:
+        size += len(chunk)
+        if MAX_DIFF_BYTES is not None and size > MAX_DIFF_BYTES:
+            return None
+        parts.append(chunk)
+    return b"".join(parts)
+
+def fetch_parsed_diff_stats(parsed_url):
+    """
+    (stats, unsupported): stats from the changeset's parsed diff, or None to count the raw
+    patch instead. unsupported is True only where the server cannot serve parsed diffs at
+    all (404/406, not JSON, not files -> hunks); a diff over MAX_DIFF_BYTES or a failure
+    that outlasted http_get's retries falls back for this changeset alone.
+    """
+    try:
+        body = http_get(parsed_url, accept="application/json", consume=read_capped)
+    except HTTPError as e:
+        return None, e.code in (404, 406)
+    except (OSError, http.client.HTTPException):
+        return None, False
+    if body is None:
+        return None, False   # too big to parse in memory: the raw patch is counted while it streams
+    try:
+        diff_json = json.loads(body.decode("utf-8", errors="replace"))
+    except ValueError:
+        return None, True
+    files = diff_json.get("files") if isinstance(diff_json, dict) else None
+    if not isinstance(files, list) or not all(
+            isinstance(f, dict) and isinstance(f.get("hunks", []), list) for f in files):
+        return None, True
+    return count_parsed_diff(diff_json) + (False, True), False
+
+def fetch_diff_stats(diff_url, repo_scope=SERVER_SCOPE, parsed_url=None):
+    """
+    (added, removed, files_changed, truncated, counted) of one changeset diff; counted is
+    False for the 0/0 reported when no Accept variant gave a diff we could read.
+    With a parsed_url (and DIFF_MODE allowing it) the structured diff is counted; a server
+    that does not serve it is remembered, and the raw patch is used instead (for one
+    changeset only when its parsed diff was too big or kept failing). The raw patch
+    is counted while it streams in (see DiffStatsCounter); truncated = cut at MAX_DIFF_BYTES.
+    text/plain often fails with 406 and */* is the fallback; whichever works is
+    remembered per server (or per repo, where it differs) so later diffs go
+    straight to it. Transient failures (already retried by http_get) are raised
+    instead of being reported as zero lines.
+    """
+    if parsed_url and (DIFF_MODE == "parsed" or
+                       DIFF_MODE == "auto" and capability(SERVER_SCOPE, "diff_parsed") != "no"):
+        stats, unsupported = fetch_parsed_diff_stats(parsed_url)
+        if stats is not None:
+            set_capability(SERVER_SCOPE, "diff_parsed", "yes")
+            return stats
+        if unsupported and capability(SERVER_SCOPE, "diff_parsed") is None:
+            set_capability(SERVER_SCOPE, "diff_parsed", "no")
+
+    for accept_header in _diff_accept_order(repo_scope):
+        try:
+            counter = http_get(diff_url, accept=accept_header, consume=count_diff_stream)
+        except HTTPError as e:
+            if is_transient(e):
+                raise
+            continue   # e.g. 406 for this Accept -> try the next one
+
+        # Check if we got actual diff content
+        if counter.is_diff:
+            _diff_accept_worked(repo_scope, accept_header)
+            return counter.result() + (counter.truncated, True)
+        elif counter.json_text is not None:
+            # Got JSON response, try to parse it
+            try:
+                diff_json = json.loads(counter.json_text)
+            except ValueError:
+                if counter.truncated:
+                    return 0, 0, 0, True, False   # JSON cut at MAX_DIFF_BYTES cannot be parsed
+                continue
+            if not isinstance(diff_json, dict):
+                continue
+            # SCM-Manager may return diff in JSON format
+            _diff_accept_worked(repo_scope, accept_header)
+            return count_parsed_diff(diff_json) + (counter.truncated, True)
+    return 0, 0, 0, False, False
 
 # -----------------------------
 # 1) list repos
 # -----------------------------
 repos_url = API + "/repositories"
-repos = list(paginate_embedded(repos_url, "repositories"))
+repos = load_inventory(REPO_CACHE_TTL_SEC) if REPO_CACHE_TTL_SEC else None
+inventory_cached = repos is not None
+if inventory_cached:
+    print(f"Using the repository list from less than {REPO_CACHE_TTL_SEC / 3600:g}h ago ({STATE_DIR})")
+else:
+    repos = list(paginate_embedded(repos_url, "repositories"))
+    if repos:
+        store_inventory(repos)
 if MAX_REPOS:
     repos = repos[:MAX_REPOS]
 print(f"Repositories found: {len(repos)}")
 
 cutoff = datetime.now(timezone.utc) - timedelta(days=DAYS_BACK)
+cutoff_ms = round(cutoff.timestamp() * 1000)
 print(f"Window: last {DAYS_BACK} days (since {cutoff.date()} UTC)")
 
-rows = []
+rows = ColumnarRows([
+    ("namespace", "dim"),
+    ("repo", "dim"),
+    ("type", "dim"),
+    ("changeset", "text"),   # changeset id (None if the server gave none)
+    ("branch", "dim"),       # primary branch: the default branch if the changeset is on it
+    ("branches", "text"),    # every branch the changeset was listed on
+    ("author", "dim"),
+    ("datetime_utc", "ms"),
+    ("added", "int"),
+    ("removed", "int"),
+    ("files_changed", "int"),
+    ("diff_truncated", "flag"),   # diff cut at MAX_DIFF_BYTES: lines counted up to there
+])
+failed_diffs = []   # failure ledger of this run: (row index, changeset key, (diff url, parsed diff url), error)
 
 # -----------------------------
 # 2) per repo: fetch branches, then changesets from all branches
+#    Repo detail and branch lists are fetched on repo_pool, branch changeset paging runs
+#    on branch_pool and every diff download on diff_pool;
+#    results are consumed in repo -> branch -> changeset order, so rows, cutoffs and the
+#    failure ledger look exactly like a serial walk. A changeset reachable from several
+#    branches of a repo is downloaded once and becomes one row listing all its branches.
 # -----------------------------
-for idx, repo in enumerate(repos, 1):
+repo_pool = ThreadPoolExecutor(max_workers=REPO_WORKERS)
+branch_pool = ThreadPoolExecutor(max_workers=BRANCH_WORKERS)
+diff_pool = ThreadPoolExecutor(max_workers=DIFF_WORKERS)
+_diff_slots = threading.BoundedSemaphore(DIFF_QUEUE_SIZE)
+
+def fetch_and_keep(cs_key, diff_url, repo_scope, parsed_url):
+    """
+    fetch_diff_stats() without the counted flag, filing the result in the stats cache: only
+    diffs actually counted and untruncated, of keyed changesets. A 0/0 fallback is not kept,
+    so a later run asks the server again.
+    """
+    *stats, counted = fetch_diff_stats(diff_url, repo_scope, parsed_url)
+    if USE_STATS_CACHE and isinstance(cs_key, str) and counted and not stats[3]:
+        cache_put_diff(repo_scope, cs_key, *stats[:3])
+    return tuple(stats)
+
+def submit_diff(cs_key, diff_url, repo_scope, parsed_url):
+    """Queues one diff download; blocks while DIFF_QUEUE_SIZE diffs are already waiting."""
+    _diff_slots.acquire()
+    fut = diff_pool.submit(fetch_and_keep, cs_key, diff_url, repo_scope, parsed_url)
+    fut.add_done_callback(lambda _: _diff_slots.release())
+    return fut
+
+_claims_lock = threading.Lock()
+diff_cache_hits = 0
+
+def _copy_outcome(source, target):
+    """Done-callback: resolves target with source's result or exception."""
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+def claim_diff(claims, cs_key, diff_url, repo_scope, parsed_url):
+    """
+    One diff download per changeset of a repo, queued by whichever branch lists it first;
+    stats an earlier (or interrupted) run fetched come from the cache instead. The lock
+    only guards claims: the cache read and the wait for a queue slot happen outside it,
+    behind the claim's own future.
+    """
+    global diff_cache_hits
+    with _claims_lock:
+        fut = claims.get(cs_key)
+        if fut is not None:
+            return fut
+        fut = claims[cs_key] = Future()
+    try:
+        cached = cache_get_diff(repo_scope, cs_key) if USE_STATS_CACHE and isinstance(cs_key, str) else None
+        if cached is not None:
+            with _claims_lock:
+                diff_cache_hits += 1
+            fut.set_result((*cached, False))
+        else:
+            submit_diff(cs_key, diff_url, repo_scope, parsed_url).add_done_callback(
+                lambda done: _copy_outcome(done, fut))
+    except BaseException as e:
+        if not fut.done():
+            fut.set_exception(e)   # branches sharing this claim must not wait forever
+        raise
+    return fut
+
+def list_branch_changesets(ns, name, links, branch_name, claims):
+    """
+    Pages one branch's changesets down to the cutoff (runs on branch_pool) and queues the
+    diffs not claimed yet by another branch of the repo.
+    Returns (warning or None, [(changeset key, author, datetime, (diff url, parsed diff url), diff future or None)]).
+    """
+    # try common link keys
+    changesets_link = None
+    for key in ["changesets", "commits", "log", "history"]:
+        if key in links:
+            changesets_link = resolve_link(links[key])
+            break
+
+    if not changesets_link:
+        changesets_link = f"{API}/repositories/{ns}/{name}/changesets"
+
+    # Add branch parameter if we have a specific branch
+    if branch_name:
+        changesets_link = changesets_link + ("&" if "?" in changesets_link else "?") + urlencode({"branch": branch_name})
+
+    # iterate changesets newest-first (order and embedded key are detected from the first page)
+    listed = []
+    seen = 0
+    changesets = iter_changesets_newest_first(changesets_link, cutoff)
+    try:
+        first = next(changesets, None)
+    except Exception as e:
+        return f"[WARN] cannot list changesets for {ns}/{name} branch={branch_name}: {e}", []
+    if first is None:
+        return None, []
+    for cs in chain([first], changesets):
+        seen += 1
+        if MAX_CHANGESETS_PER_REPO and seen > MAX_CHANGESETS_PER_REPO:
+            break
+
+        dt = changeset_datetime(cs)
+        if not dt:
+            continue
+        if dt < cutoff:
+            # newest-first: everything after this is older too
+            break
+
+        author = cs.get("author") or {}
+        author_name = author.get("name") or author.get("displayName") or cs.get("authorName") or "unknown"
+
+        cs_links = cs.get("_links") or {}
+        diff_url = None
+        for dk in ["diff", "patch"]:
+            if dk in cs_links:
+                diff_url = resolve_link(cs_links[dk])
+                break
+        cs_id = cs.get("id") or cs.get("revision") or cs.get("changesetId")
+        if not diff_url:
+            # conventional diff endpoint guess
+            # (won't always exist, but gives a shot)
+            if cs_id:
+                diff_url = f"{API}/repositories/{ns}/{name}/changesets/{cs_id}/diff"
+
+        # changesets without id or diff cannot be matched across branches
+        parsed_url = resolve_link(cs_links.get("diffParsed"))
+
+        cs_key = cs_id or diff_url or (branch_name, seen)
+        fut = claim_diff(claims, cs_key, diff_url, f"{SERVER_SCOPE}|{ns}/{name}", parsed_url) if diff_url else None
+        listed.append((cs_key, cs_id, author_name, dt, (diff_url, parsed_url), fut))
+    return None, listed
+
+def stored_rows(ns, name, last_modified):
+    """A dormant repo's stored rows (see INCREMENTAL), or None if it has to be collected."""
+    if not INCREMENTAL or not last_modified:
+        return None
+    return load_synced(ns, name, last_modified, cutoff_ms)
+
+def open_repo(idx, repo):
+    """
+    Repo detail and branch list of one repo (runs on repo_pool); queues its branch listings
+    on branch_pool. Returns (messages to print, job), job = (idx, ns, name, type, lastModified,
+    default branch, [(branch name, listing future)], stored rows) or None for a skipped repo.
+    The messages are printed by the main thread, in repo order.
+    """
     ns = repo.get("namespace")
     name = repo.get("name")
     rtype = repo.get("type")
-    if not ns or not name:
-        continue
+
+    # a freshly listed lastModified settles dormant repos without any request
+    stored = None if inventory_cached else stored_rows(ns, name, repo.get("lastModified"))
+    if stored is not None:
+        return [], (idx, ns, name, rtype, repo.get("lastModified"), None, [], stored)
 
     # fetch repo detail to discover links
     try:
         detail = http_get_json(f"{API}/repositories/{ns}/{name}")
     except Exception as e:
-        print(f"[WARN] repo detail failed {ns}/{name}: {e}")
-        continue
+        return [f"[WARN] repo detail failed {ns}/{name}: {e}"], None
+    last_modified = detail.get("lastModified") or repo.get("lastModified")
+    stored = stored_rows(ns, name, last_modified) if inventory_cached else None
+    if stored is not None:
+        return [], (idx, ns, name, rtype, last_modified, None, [], stored)
 
     # Get all branches for this repository
     branches_to_process = []
+    default_branch = None
     links = detail.get("_links") or {}
-    
+
     # Try to get branches
     branches_link = None
     for key in ["branches", "refs"]:
         if key in links:
             branches_link = resolve_link(links[key])
             break
-    
+
     if not branches_link:
         branches_link = f"{API}/repositories/{ns}/{name}/branches"
-    
+
     try:
         # Fetch all branches
         for branch in paginate_embedded(branches_link, "branches"):
             branch_name = branch.get("name")
             if branch_name:
                 branches_to_process.append(branch_name)
+                if branch.get("defaultBranch"):
+                    default_branch = branch_name
         if not branches_to_process:
             # If no branches found, try without branch specification (default)
             branches_to_process = [None]
-        print(f"  [{ns}/{name}] Found {len(branches_to_process)} branch(es)")
+        message = f"  [{ns}/{name}] Found {len(branches_to_process)} branch(es)"
     except Exception as e:
-        print(f"[WARN] cannot list branches for {ns}/{name}: {e}, trying default branch")
+        message = f"[WARN] cannot list branches for {ns}/{name}: {e}, trying default branch"
         branches_to_process = [None]
 
-    # Process changesets from each branch
-    for branch_name in branches_to_process:
-        # try common link keys
-        changesets_link = None
-        for key in ["changesets", "commits", "log", "history"]:
-            if key in links:
-                changesets_link = resolve_link(links[key])
-                break
-
-        if not changesets_link:
-            changesets_link = f"{API}/repositories/{ns}/{name}/changesets"
-        
-        # Add branch parameter if we have a specific branch
-        if branch_name:
-            changesets_link = changesets_link + ("&" if "?" in changesets_link else "?") + urlencode({"branch": branch_name})
+    # Page changesets from each branch in the background
+    claims = {}   # changeset key -> diff future, shared by the repo's branches
+    return [message], (idx, ns, name, rtype, last_modified, default_branch, [
+        (branch_name, branch_pool.submit(list_branch_changesets, ns, name, links, branch_name, claims))
+        for branch_name in branches_to_process
+    ], None)
 
-        # determine embedded key by probing once
-        try:
-            probe = http_get_json(changesets_link + ("&page=0&pageSize=1" if "?" in changesets_link else "?page=0&pageSize=1"))
-        except Exception as e:
-            print(f"[WARN] cannot list changesets for {ns}/{name} branch={branch_name}: {e}")
-            continue
+openings = [repo_pool.submit(open_repo, idx, repo) for idx, repo in enumerate(repos, 1)
+            if repo.get("namespace") and repo.get("name")]
+repo_jobs = []   # open_repo() jobs of the repos collected, in repo order
+shared_changesets = 0
 
-        embedded = (probe.get("_embedded") or {})
-        if "changesets" in embedded:
-            emb_key = "changesets"
-        elif "commits" in embedded:
-            emb_key = "commits"
-        else:
-            # fallback: pick first embedded list key
-            emb_key = next(iter(embedded.keys()), None)
+def sync_repo(ns, name, last_modified, first_row, end_row):
+    """Stores a completely collected repo's rows for INCREMENTAL runs (and runs resuming this one)."""
+    store_synced(ns, name, last_modified, [
+        (rows.get(i, "branch"), json.dumps(rows.get(i, "branches")), rows.get(i, "author"),
+         rows.get(i, "datetime_utc"), rows.get(i, "added"), rows.get(i, "removed"),
+         rows.get(i, "files_changed"), int(rows.get(i, "diff_truncated")), rows.get(i, "changeset"))
+        for i in range(first_row, end_row)], cutoff_ms)
 
-        if not emb_key:
+pending_sync = []    # (ns, name, lastModified, first row, end row) of repos collected except for failed diffs
+dormant_repos = 0
+try:
+    for opening in openings:
+        messages, job = opening.result()
+        for message in messages:
+            print(message)
+        if job is None:
+            continue
+        repo_jobs.append(job)
+        idx, ns, name, rtype, last_modified, default_branch, branch_jobs, stored = job
+        if stored is not None:
+            dormant_repos += 1
+            for branch, branches_json, author_name, ts_ms, added, removed, files_changed, truncated, cs_id in stored:
+                branches = json.loads(branches_json)
+                if len(branches) > 1:
+                    shared_changesets += 1
+                rows.append(namespace=ns, repo=name, type=rtype, changeset=cs_id, branch=branch, branches=branches,
+                            author=author_name, datetime_utc=ts_ms, added=added, removed=removed,
+                            files_changed=files_changed, diff_truncated=bool(truncated))
             continue
 
-        # iterate changesets
-        seen = 0
-        for cs in paginate_embedded(changesets_link, emb_key):
-            seen += 1
-            if MAX_CHANGESETS_PER_REPO and seen > MAX_CHANGESETS_PER_REPO:
-                break
-
-            # date fields vary; try common names
-            dt = (parse_any_datetime(cs.get("date")) or
-                  parse_any_datetime(cs.get("timestamp")) or
-                  parse_any_datetime(cs.get("creationDate")))
-            if not dt:
-                continue
-            if dt < cutoff:
-                # stop early once we're past cutoff (assumes API returns newest-first; common in practice)
-                # if your server returns oldest-first, comment this out.
-                break
+        # merge the branch listings: first listing of a changeset wins, later ones add their branch
+        merged = {}   # changeset key -> [first listing entry, branches]
+        complete = True
+        first_row = len(rows)
+        for branch_name, listing in branch_jobs:
+            try:
+                warning, listed = listing.result()
+            except Exception as e:   # a later page failed: the repo is left incomplete, not the run
+                warning, listed = f"[WARN] cannot list changesets for {ns}/{name} branch={branch_name}: {e}", []
+            if warning:
+                print(warning)
+                complete = False
+            for entry in listed:
+                seen_on = merged.setdefault(entry[0], [entry, []])[1]
+                if (branch_name or "default") not in seen_on:
+                    seen_on.append(branch_name or "default")
 
-            author = cs.get("author") or {}
-            author_name = author.get("name") or author.get("displayName") or cs.get("authorName") or "unknown"
+        failed_before = len(failed_diffs)
+        for (cs_key, cs_id, author_name, dt, diff_urls, fut), branches in merged.values():
+            added = removed = files_changed = 0
+            truncated = False
+            if fut is not None:
+                try:
+                    added, removed, files_changed, truncated = fut.result()
+                except Exception as e:
+                    # failure ledger: retried after the main pass instead of counting 0 lines
+                    added = removed = files_changed = None
+                    failed_diffs.append((len(rows), cs_key, diff_urls, e))
 
-            cs_links = cs.get("_links") or {}
-            diff_url = None
-            for dk in ["diff", "patch"]:
-                if dk in cs_links:
-                    diff_url = resolve_link(cs_links[dk])
-                    break
-            if not diff_url:
-                # conventional diff endpoint guess
-                # (won't always exist, but gives a shot)
-                cs_id = cs.get("id") or cs.get("revision") or cs.get("changesetId")
-                if cs_id:
-                    diff_url = f"{API}/repositories/{ns}/{name}/changesets/{cs_id}/diff"
+            if len(branches) > 1:
+                shared_changesets += 1
+            rows.append(namespace=ns, repo=name, type=rtype, changeset=cs_id,
+                        branch=default_branch if default_branch in branches else branches[0], branches=branches,
+                        author=author_name, datetime_utc=round(dt.timestamp() * 1000),
+                        added=added, removed=removed, files_changed=files_changed, diff_truncated=truncated)
+        if INCREMENTAL and complete and last_modified and not MAX_CHANGESETS_PER_REPO:
+            # repos done are checkpointed right away; ones with failed diffs after the retry pass
+            if len(failed_diffs) == failed_before:
+                sync_repo(ns, name, last_modified, first_row, len(rows))
+            else:
+                pending_sync.append((ns, name, last_modified, first_row, len(rows)))
 
-            added = removed = files_changed = 0
-            
-            if diff_url:
-                # Try multiple approaches to get diff
-                # First attempt with text/plain often fails with 406, so try */* as fallback
-                diff_text = None
-                attempts = [
-                    ("text/plain", diff_url),
-                    ("*/*", diff_url),
-                ]
-                
-                for accept_header, url in attempts:
-                    try:
-                        diff_bytes = http_get(url, accept=accept_header)
-                        diff_text = diff_bytes.decode("utf-8", errors="replace")
-                        
-                        # Check if we got actual diff content
-                        if diff_text and (
-                            "diff --git" in diff_text or 
-                            "@@" in diff_text or 
-                            "Index:" in diff_text or
-                            "---" in diff_text
-                        ):
-                            added, removed, files_changed = count_diff_stats(diff_text)
-                            break
-                        elif diff_text.startswith("{"):
-                            # Got JSON response, try to parse it
-                            try:
-                                diff_json = json.loads(diff_text)
-                                # SCM-Manager may return diff in JSON format
-                                if "files" in diff_json:
-                                    for file_info in diff_json.get("files", []):
-                                        files_changed += 1
-                                        # Check for hunks or changes
-                                        for hunk in file_info.get("hunks", []):
-                                            for change in hunk.get("changes", []):
-                                                change_type = change.get("type", "")
-                                                if change_type == "insert":
-                                                    added += 1
-                                                elif change_type == "delete":
-                                                    removed += 1
-                                break
-                            except:
-                                pass
-                    except:
-                        # Try next method
-                        continue
-
-            rows.append({
-                "namespace": ns,
-                "repo": name,
-                "type": rtype,
-                "branch": branch_name or "default",
-                "author": author_name,
-                "datetime_utc": dt,
-                "week_start_utc": week_start_utc(dt),
-                "added": added,
-                "removed": removed,
-                "net": added - removed,
-                "files_changed": files_changed,
-                "changesets": 1,
-            })
-
-    if idx % 10 == 0:
-        print(f"  processed {idx}/{len(repos)} repos…")
+        if idx % 10 == 0:
+            print(f"  processed {idx}/{len(repos)} repos…")
+finally:
+    repo_pool.shutdown(wait=False, cancel_futures=True)
+    branch_pool.shutdown(wait=False, cancel_futures=True)
+    diff_pool.shutdown(wait=False, cancel_futures=True)
+    checkpoint()   # an interrupted run keeps everything collected so far
 
 if not rows:
     raise RuntimeError("No changesets found in the selected window (or API endpoints differ on your server).")
 
-print(f"Changesets collected: {len(rows)}")
+# Second chance for the failure ledger, once the main pass no longer loads the server
+if failed_diffs:
+    print(f"Retrying {len(failed_diffs)} diffs that failed…")
+    time.sleep(retry_pause([err for _, _, _, err in failed_diffs]))
+    still_failed = []
+    for row_idx, cs_key, diff_urls, _ in failed_diffs:
+        repo_scope = f"{SERVER_SCOPE}|{rows.get(row_idx, 'namespace')}/{rows.get(row_idx, 'repo')}"
+        try:
+            added, removed, files_changed, truncated = fetch_and_keep(cs_key, diff_urls[0], repo_scope, diff_urls[1])
+        except Exception as e:
+            still_failed.append((row_idx, cs_key, diff_urls, e))
+            continue
+        rows.set(row_idx, added=added, removed=removed, files_changed=files_changed, diff_truncated=truncated)
+    failed_diffs = still_failed
+    if failed_diffs:
+        print(f"[WARN] diff stats still missing for {len(failed_diffs)} changesets; their lines are left "
+              f"empty instead of counted as 0. First error: {failed_diffs[0][3]}")
+
+# Repos whose failed diffs all came through on the retry
+missing = {row_idx for row_idx, _, _, _ in failed_diffs}
+for ns, name, last_modified, first_row, end_row in pending_sync:
+    if not missing.intersection(range(first_row, end_row)):
+        sync_repo(ns, name, last_modified, first_row, end_row)
+checkpoint()
+if dormant_repos:
+    print(f"  {dormant_repos} repos unchanged since the last run: their changesets come from {STATE_DIR}")
+if diff_cache_hits:
+    print(f"  {diff_cache_hits} diffs served from the local stats cache ({STATE_DIR})")
+
+print(f"Changesets collected: {len(rows)} ({shared_changesets} reachable from several branches, counted once)")
+truncated_diffs = sum(rows.column("diff_truncated"))
+if truncated_diffs:
+    print(f"[WARN] {truncated_diffs} diffs were longer than MAX_DIFF_BYTES={MAX_DIFF_BYTES}; "
+          f"their lines are counted up to the cut (diff_truncated in dev_kpi_changesets.csv)")
+print(f"Request rate settled at {rate_limiter.rate:.1f} req/s")
+
+# -----------------------------
+# 3) dashboard database (DASHBOARD_DB)
+# -----------------------------
+if DASHBOARD_DB:
+    started = time.monotonic()
+    now_ms = int(time.time() * 1000)
+    hashes, ts = rows.column("changeset"), rows.column("datetime_utc")
+    authors = rows.values("author")
+    repo_ids = [f"{ns}/{name}" for ns, name in zip(rows.values("namespace"), rows.values("repo"))]
+    default_branches = {f"{job[1]}/{job[2]}": job[5] for job in repo_jobs}   # None for dormant repos
+    repo_stats = {}     # repo id -> [name, namespace, type, changesets, authors, newest ms]
+    branch_stats = {}   # (repo id, branch) -> [changesets, newest ms]
+    for rid, name, ns, rtype, author, t, branches in zip(repo_ids, rows.values("repo"), rows.values("namespace"),
+                                                         rows.values("type"), authors, ts, rows.column("branches")):
+        st = repo_stats.get(rid)
+        if st is None:
+            st = repo_stats[rid] = [name, ns, rtype, 0, set(), t]
+        st[3] += 1
+        st[4].add(author)
+        st[5] = max(st[5], t)
+        for branch in branches:
+            bs = branch_stats.setdefault((rid, branch), [0, t])
+            bs[0] += 1
+            bs[1] = max(bs[1], t)
+    n_changesets = sum(1 for h in hashes if h)
+    write_dashboard_db(
+        [(rid, name, ns, rtype, iso_ms(newest), health_score(n, len(devs), newest, now_ms))
+         for rid, (name, ns, rtype, n, devs, newest) in repo_stats.items()],
+        [dashboard_developer(author) for author in sorted(set(authors))],
+        ((h, iso_ms(t), a, r) for h, t, a, r in zip(hashes, ts, rows.values("added"), rows.values("removed")) if h),
+        ((rid, DEVELOPER_IDS.get(author, author), h) for rid, author, h in zip(repo_ids, authors, hashes) if h),
+        [(rid, branch, None if default_branches.get(rid) is None else int(branch == default_branches[rid]),
+          iso_ms(newest), n) for (rid, branch), (n, newest) in branch_stats.items()],
+        {"repos": len(repo_stats), "developers": len({DEVELOPER_IDS.get(a, a) for a in authors}),
+         "commits": n_changesets})
+    print(f"[OK] Upserted {n_changesets} changesets of {len(repo_stats)} repos into {DASHBOARD_DB} "
+          f"({time.monotonic() - started:.1f}s)")
+    if n_changesets < len(rows):
+        print(f"[WARN] {len(rows) - n_changesets} changesets without an id were left out of {DASHBOARD_DB}")
 
 # -----------------------------
-# 3) aggregate + visualize
+# 4) aggregate + visualize
 # -----------------------------
 if pd is None:
     # minimal fallback
     agg = {}
-    for r in rows:
-        key = (r["week_start_utc"].date().isoformat(), r["author"])
+    for r in rows.iter_rows():
+        key = (week_start_utc(r["datetime_utc"]).date().isoformat(), r["author"])
         a = agg.setdefault(key, {"changesets":0, "added":0, "removed":0, "net":0, "files":0})
         a["changesets"] += 1
-        a["added"] += r["added"]
-        a["removed"] += r["removed"]
-        a["net"] += r["net"]
-        a["files"] += r["files_changed"]
+        a["added"] += r["added"] or 0
+        a["removed"] += r["removed"] or 0
+        a["net"] += (r["added"] or 0) - (r["removed"] or 0)
+        a["files"] += r["files_changed"] or 0
     top = {}
     for (_, author), v in agg.items():
         top[author] = top.get(author, 0) + v["changesets"]
@@ -823,19 +3764,26 @@ if pd is None:
     for a,c in top:
         print(" ", a, c)
 else:
-    df = pd.DataFrame(rows)
-    df["week_start_utc"] = pd.to_datetime(df["week_start_utc"], utc=True)
+    df = rows.to_frame()
+    memory_report(df, "Changeset frame")
+    # Derived columns (week starts Monday 00:00 UTC)
+    day = df["datetime_utc"].dt.floor("D")
+    df["week_start_utc"] = day - pd.to_timedelta(day.dt.weekday, unit="D")
+    df["net"] = df["added"] - df["removed"]
+    df["changesets"] = 1
 
     # Export raw changeset-level detail
     detail_cols = df[[
         "repo",          # project/repository
-        "branch",
+        "branch",        # primary branch
+        "branches",      # all branches the changeset is on
         "author",
         "changesets",
         "net",
         "removed",
         "added",
         "datetime_utc",
+        "diff_truncated",
     ]].copy()
     detail_cols = detail_cols.rename(columns={
         "repo": "project",
@@ -845,22 +3793,27 @@ else:
         "added": "added_rows",
         "net": "net_rows",
     })
-    detail_cols.to_csv("dev_kpi_changesets.csv", index=False)
+    detail_cols.assign(branches=detail_cols["branches"].str.join(";")).to_csv("dev_kpi_changesets.csv", index=False)
     print("[OK] Saved detailed changesets: dev_kpi_changesets.csv")
+    path = write_columnar(detail_cols, "dev_kpi_changesets", partitioned=True)
+    if path:
+        print(f"[OK] Saved detailed changesets ({EXPORT_FORMAT}): {path}")
 
-    weekly = (df.groupby(["week_start_utc","author"], as_index=False)
-                .agg(
-                    changesets=("changesets","sum"),
-                    lines_added=("added","sum"),
-                    lines_removed=("removed","sum"),
-                    lines_net=("net","sum"),
-                    files_changed=("files_changed","sum"),
-                    repos_touched=("repo", pd.Series.nunique),
-                    branches_touched=("branch", pd.Series.nunique),
-                )
+    # Every rollup below comes from this (week, project, branch, developer) cube, not from df
+    cube = build_cube(df)
+    touched = {"repos_touched": "project", "branches_touched": "branch"}
+
+    weekly = (rollup(cube, ["week", "developer"], touched=touched)
+                .rename(columns={"week": "week_start_utc", "developer": "author", "added": "lines_added",
+                                 "removed": "lines_removed", "net": "lines_net"})
+                [["week_start_utc", "author", "changesets", "lines_added", "lines_removed", "lines_net",
+                  "files_changed", "repos_touched", "branches_touched"]]
                 .sort_values(["week_start_utc","changesets"], ascending=[True, False]))
+    # changesets whose diff stats are missing are NaN and skipped by the sums; keep the sums integral
+    line_cols = ["lines_added", "lines_removed", "lines_net", "files_changed"]
+    weekly[line_cols] = weekly[line_cols].astype("int64")
 
-    top_devs = (weekly.groupby("author")["changesets"].sum()
+    top_devs = (weekly.groupby("author", observed=True)["changesets"].sum()
                       .sort_values(ascending=False).head(TOP_N_DEVS).index.tolist())
     weekly_top = weekly[weekly["author"].isin(top_devs)].copy()
 
@@ -884,15 +3837,11 @@ else:
     print("\n" + "="*80)
     print("SUMMARY BY DEVELOPER (Total for period)")
     print("="*80)
-    summary = df.groupby("author").agg(
-        total_changesets=("changesets", "sum"),
-        total_added=("added", "sum"),
-        total_removed=("removed", "sum"),
-        total_net=("net", "sum"),
-        total_files=("files_changed", "sum"),
-        repos_touched=("repo", pd.Series.nunique),
-        branches_touched=("branch", pd.Series.nunique)
-    ).sort_values("total_changesets", ascending=False).head(TOP_N_DEVS)
+    summary = (rollup(cube, ["developer"], touched=touched)
+        .rename(columns={"developer": "author", "changesets": "total_changesets", "added": "total_added",
+                         "removed": "total_removed", "net": "total_net", "files_changed": "total_files"})
+        .set_index("author")
+        .sort_values("total_changesets", ascending=False).head(TOP_N_DEVS))
     
     for author, row in summary.iterrows():
         print(f"\n[Developer] {author}")
@@ -907,6 +3856,11 @@ else:
     weekly.to_csv("dev_kpi_weekly.csv", index=False)
     print("\n" + "="*80)
     print("[OK] Saved: dev_kpi_weekly.csv")
+    path = write_columnar(weekly, "dev_kpi_weekly")
+    if path:
+        print(f"[OK] Saved: {path}")
+    elif pyarrow is None and EXPORT_FORMAT:
+        print("[INFO] pyarrow not installed: CSV exports only")
 
     if go is not None:
         # Create interactive plotly charts
@@ -928,16 +3882,13 @@ else:
         # Project/branch/developer summary for requested logic
         detail_viz = detail_cols.copy()
         detail_viz["datetime_utc"] = pd.to_datetime(detail_viz["datetime_utc"], utc=True)
-        summary_pbd = (detail_viz
-            .groupby(["project","branch","developer"], as_index=False)
-            .agg(
-                commits=("commits","sum"),
-                added_rows=("added_rows","sum"),
-                deleted_rows=("deleted_rows","sum"),
-                net_rows=("net_rows","sum"),
-                first_datetime=("datetime_utc","min"),
-                last_datetime=("datetime_utc","max"),
-            )
+        # Branch views count a changeset on every branch it is on; project/developer totals count it once
+        branch_viz = (detail_viz.drop(columns="branch").explode("branches")
+                                .rename(columns={"branches": "branch"}))
+        summary_pbd = (rollup(cube, ["project","branch","developer"], per_branch=True)
+            .rename(columns=REPORT_COLUMNS)
+            [["project","branch","developer","commits","added_rows","deleted_rows","net_rows",
+              "first_datetime","last_datetime"]]
             .sort_values(["project","branch","developer"]))
 
         # Table view
@@ -982,14 +3933,9 @@ else:
         print("Summary (bars): projects=", summary_pbd["project"].nunique(), "branches=", summary_pbd["branch"].nunique(), "developers=", summary_pbd["developer"].nunique())
 
         # Project-only summary
-        summary_proj = (detail_viz
-            .groupby(["project"], as_index=False)
-            .agg(
-                commits=("commits","sum"),
-                added_rows=("added_rows","sum"),
-                deleted_rows=("deleted_rows","sum"),
-                net_rows=("net_rows","sum"),
-            )
+        summary_proj = (rollup(cube, ["project"])
+            .rename(columns=REPORT_COLUMNS)
+            [["project","commits","added_rows","deleted_rows","net_rows"]]
             .sort_values("commits", ascending=False))
 
         fig_proj = px.bar(
@@ -1008,14 +3954,9 @@ else:
         print("Summary (project): projects=", len(summary_proj), "total commits=", int(summary_proj["commits"].sum()))
 
         # Branch-level summary (project+branch)
-        summary_branch = (detail_viz
-            .groupby(["project","branch"], as_index=False)
-            .agg(
-                commits=("commits","sum"),
-                added_rows=("added_rows","sum"),
-                deleted_rows=("deleted_rows","sum"),
-                net_rows=("net_rows","sum"),
-            )
+        summary_branch = (rollup(cube, ["project","branch"], per_branch=True)
+            .rename(columns=REPORT_COLUMNS)
+            [["project","branch","commits","added_rows","deleted_rows","net_rows"]]
             .sort_values(["project","commits"], ascending=[True, False]))
 
         fig_branch = px.bar(
@@ -1039,7 +3980,7 @@ else:
         print("="*80)
         
         for proj in sorted(detail_viz["project"].unique()):
-            proj_data = detail_viz[detail_viz["project"] == proj]
+            proj_data = branch_viz[branch_viz["project"] == proj]
             branches = sorted(proj_data["branch"].unique())
             
             for branch in branches:
@@ -1096,221 +4037,183 @@ else:
                 print(f"  ✓ {filename}")
                 print(f"    Commits: {int(total_commits)}, +{int(total_added)}/{int(total_deleted)} lines, {int(total_net):+d} net, {dev_count} devs")
         
-        # Special visualization for Billing project across all branches
-        if "Billing" in detail_viz["project"].unique() or "billing" in detail_viz["project"].unique().str.lower():
-            billing_projects = detail_viz[detail_viz["project"].str.lower() == "billing"]["project"].unique()
-            if len(billing_projects) > 0:
-                billing_proj_name = billing_projects[0]
-                billing_data = detail_viz[detail_viz["project"] == billing_proj_name].sort_values("datetime_utc")
+        # Per-project dashboard across all branches (+ master analysis with merge source detection)
+        for proj in sorted(detail_viz["project"].unique()):
+            safe_proj = str(proj).replace("/", "_").replace("\\", "_").replace(" ", "_").lower()
+            proj_data = branch_viz[branch_viz["project"] == proj].sort_values("datetime_utc")
+            
+            print("\n" + "="*80)
+            print(f"CREATING SPECIAL DASHBOARD FOR '{proj}' PROJECT")
+            print("="*80)
+            
+            # Group by branch and week for time-series
+            proj_weekly = (rollup(cube[cube["project"] == proj], ["week", "branch"], per_branch=True)
+                .rename(columns=REPORT_COLUMNS)
+                .assign(week_start=lambda t: t["week"].dt.tz_localize(None))
+                .sort_values("week_start"))
+            
+            # Detect merge commits: look for patterns in commit messages (would need API enhancement)
+            # For now, we infer merges as significant line additions/reductions on master
+            master_data = proj_data[proj_data["branch"] == "master"].sort_values("datetime_utc")
+            
+            # Create multi-branch timeline
+            fig_proj_branches = go.Figure()
+            
+            for branch in sorted(proj_data["branch"].unique()):
+                branch_weekly = proj_weekly[proj_weekly["branch"] == branch]
                 
-                print("\n" + "="*80)
-                print(f"CREATING SPECIAL DASHBOARD FOR '{billing_proj_name}' PROJECT")
-                print("="*80)
+                # Determine line style and width based on branch type
+                if branch.lower() == "master":
+                    line_dash = "solid"
+                    line_width = 3
+                else:
+                    line_dash = "dot" if "dev" in branch.lower() else "dash"
+                    line_width = 2
                 
-                # Group by branch and week for time-series
-                billing_data["week_start"] = pd.to_datetime(billing_data["datetime_utc"]).dt.to_period('W').apply(lambda r: r.start_time)
-                billing_weekly = (billing_data
-                    .groupby(["week_start", "branch"], as_index=False)
-                    .agg(
-                        commits=("commits","sum"),
-                        added_rows=("added_rows","sum"),
-                        deleted_rows=("deleted_rows","sum"),
-                        net_rows=("net_rows","sum"),
-                    )
-                    .sort_values("week_start"))
+                fig_proj_branches.add_trace(go.Scatter(
+                    x=branch_weekly["week_start"],
+                    y=branch_weekly["commits"],
+                    mode='lines+markers',
+                    name=branch,
+                    line=dict(dash=line_dash, width=line_width),
+                    hovertemplate='<b>%{fullData.name}</b><br>Week: %{x|%Y-%m-%d}<br>Commits: %{y}<extra></extra>'
+                ))
+            
+            fig_proj_branches.update_layout(
+                title_text=f"'{proj}' Project: Commits per Week (All Branches)",
+                xaxis_title="Week",
+                yaxis_title="Commits",
+                height=600,
+                hovermode='x unified',
+                template='plotly_white',
+                legend=dict(yanchor="top", y=0.99, xanchor="left", x=0.01)
+            )
+            fig_proj_branches.write_html(f"{safe_proj}_project_commits_timeline.html")
+            print(f"  ✓ {safe_proj}_project_commits_timeline.html (all branches)")
+            
+            # Net lines timeline
+            fig_proj_net = go.Figure()
+            
+            for branch in sorted(proj_data["branch"].unique()):
+                branch_weekly = proj_weekly[proj_weekly["branch"] == branch]
                 
-                # Detect merge commits: look for patterns in commit messages (would need API enhancement)
-                # For now, we infer merges as significant line additions/reductions on master
-                billing_master = billing_data[billing_data["branch"] == "master"].sort_values("datetime_utc")
+                if branch.lower() == "master":
+                    line_dash = "solid"
+                    line_width = 3
+                else:
+                    line_dash = "dot" if "dev" in branch.lower() else "dash"
+                    line_width = 2
                 
-                # Create multi-branch timeline
-                fig_billing = go.Figure()
+                fig_proj_net.add_trace(go.Scatter(
+                    x=branch_weekly["week_start"],
+                    y=branch_weekly["net_rows"],
+                    mode='lines+markers',
+                    name=branch,
+                    line=dict(dash=line_dash, width=line_width),
+                    hovertemplate='<b>%{fullData.name}</b><br>Week: %{x|%Y-%m-%d}<br>Net Lines: %{y}<extra></extra>'
+                ))
+            
+            fig_proj_net.add_hline(y=0, line_dash="dash", line_color="gray", opacity=0.3)
+            fig_proj_net.update_layout(
+                title_text=f"'{proj}' Project: Net Lines per Week (All Branches) - Growth Analysis",
+                xaxis_title="Week",
+                yaxis_title="Net Lines (Added - Deleted)",
+                height=600,
+                hovermode='x unified',
+                template='plotly_white',
+                legend=dict(yanchor="top", y=0.99, xanchor="left", x=0.01)
+            )
+            fig_proj_net.write_html(f"{safe_proj}_project_net_lines_timeline.html")
+            print(f"  ✓ {safe_proj}_project_net_lines_timeline.html (net lines growth)")
+            
+            # Master branch analysis with merge source detection
+            if len(master_data) > 0:
+                master_sorted = master_data.sort_values("datetime_utc").reset_index(drop=True)
+                master_sorted["cumulative_commits"] = master_sorted["commits"].cumsum()
+                master_sorted["cumulative_added"] = master_sorted["added_rows"].cumsum()
+                master_sorted["cumulative_deleted"] = master_sorted["deleted_rows"].cumsum()
+                master_sorted["cumulative_net"] = master_sorted["net_rows"].cumsum()
                 
-                for branch in sorted(billing_data["branch"].unique()):
-                    branch_weekly = billing_weekly[billing_weekly["branch"] == branch]
-                    
-                    # Determine line style and width based on branch type
-                    if branch.lower() == "master":
-                        line_dash = "solid"
-                        line_width = 3
-                    else:
-                        line_dash = "dot" if "dev" in branch.lower() else "dash"
-                        line_width = 2
-                    
-                    fig_billing.add_trace(go.Scatter(
-                        x=branch_weekly["week_start"],
-                        y=branch_weekly["commits"],
-                        mode='lines+markers',
-                        name=branch,
-                        line=dict(dash=line_dash, width=line_width),
-                        hovertemplate='<b>%{fullData.name}</b><br>Week: %{x|%Y-%m-%d}<br>Commits: %{y}<extra></extra>'
-                    ))
+                # Detect potential merge commits (heuristic: commits where added + deleted > avg for this branch)
+                changed = master_sorted["added_rows"].astype("Int64") + master_sorted["deleted_rows"]
+                avg_changes = changed.mean()
+                master_sorted["is_merge_candidate"] = changed > avg_changes * 1.5
                 
-                fig_billing.update_layout(
-                    title_text=f"'{billing_proj_name}' Project: Commits per Week (All Branches)",
-                    xaxis_title="Week",
-                    yaxis_title="Commits",
-                    height=600,
-                    hovermode='x unified',
-                    template='plotly_white',
-                    legend=dict(yanchor="top", y=0.99, xanchor="left", x=0.01)
-                )
-                fig_billing.write_html(f"billing_project_commits_timeline.html")
-                print(f"  ✓ billing_project_commits_timeline.html (all branches)")
+                # Detect merge source branches: look for developers active on non-master branches within time window
+                non_master_data = proj_data[proj_data["branch"] != "master"].sort_values("datetime_utc")
                 
-                # Net lines timeline
-                fig_billing_net = go.Figure()
+                # For each master commit: the branch its developer was most active on in the 3 days before
+                master_sorted["merge_source_branch"] = merge_sources(master_sorted, non_master_data, timedelta(days=3))
                 
-                for branch in sorted(billing_data["branch"].unique()):
-                    branch_weekly = billing_weekly[billing_weekly["branch"] == branch]
-                    
-                    if branch.lower() == "master":
-                        line_dash = "solid"
-                        line_width = 3
-                    else:
-                        line_dash = "dot" if "dev" in branch.lower() else "dash"
-                        line_width = 2
-                    
-                    fig_billing_net.add_trace(go.Scatter(
-                        x=branch_weekly["week_start"],
-                        y=branch_weekly["net_rows"],
-                        mode='lines+markers',
-                        name=branch,
-                        line=dict(dash=line_dash, width=line_width),
-                        hovertemplate='<b>%{fullData.name}</b><br>Week: %{x|%Y-%m-%d}<br>Net Lines: %{y}<extra></extra>'
-                    ))
+                # Assign colors to branches
+                all_source_branches = sorted(master_sorted[master_sorted["merge_source_branch"].notna()]["merge_source_branch"].unique())
+                branch_colors = {}
+                source_palette = px.colors.qualitative.Set2
+                for i, branch in enumerate(all_source_branches):
+                    branch_colors[branch] = source_palette[i % len(source_palette)]
                 
-                fig_billing_net.add_hline(y=0, line_dash="dash", line_color="gray", opacity=0.3)
-                fig_billing_net.update_layout(
-                    title_text=f"'{billing_proj_name}' Project: Net Lines per Week (All Branches) - Growth Analysis",
-                    xaxis_title="Week",
-                    yaxis_title="Net Lines (Added - Deleted)",
-                    height=600,
-                    hovermode='x unified',
-                    template='plotly_white',
-                    legend=dict(yanchor="top", y=0.99, xanchor="left", x=0.01)
+                fig_master = make_subplots(
+                    rows=2, cols=1,
+                    subplot_titles=("Master Branch: Cumulative Commits", "Master Branch: Commits by Type (Merge Source Detection)"),
+                    vertical_spacing=0.15
                 )
-                fig_billing_net.write_html(f"billing_project_net_lines_timeline.html")
-                print(f"  ✓ billing_project_net_lines_timeline.html (net lines growth)")
                 
-                # Master branch analysis with merge source detection
-                if len(billing_master) > 0:
-                    billing_master_sorted = billing_master.sort_values("datetime_utc").reset_index(drop=True)
-                    billing_master_sorted["cumulative_commits"] = billing_master_sorted["commits"].cumsum()
-                    billing_master_sorted["cumulative_added"] = billing_master_sorted["added_rows"].cumsum()
-                    billing_master_sorted["cumulative_deleted"] = billing_master_sorted["deleted_rows"].cumsum()
-                    billing_master_sorted["cumulative_net"] = billing_master_sorted["net_rows"].cumsum()
-                    
-                    # Detect potential merge commits (heuristic: commits where added + deleted > avg for this branch)
-                    avg_changes = (billing_master_sorted["added_rows"] + billing_master_sorted["deleted_rows"]).mean()
-                    billing_master_sorted["is_merge_candidate"] = (billing_master_sorted["added_rows"] + billing_master_sorted["deleted_rows"]) > avg_changes * 1.5
-                    
-                    # Detect merge source branches: look for developers active on non-master branches within time window
-                    non_master_data = billing_data[billing_data["branch"] != "master"].sort_values("datetime_utc")
-                    
-                    # Create mapping: for each master commit, find likely source branch
-                    def detect_merge_source(master_row):
-                        """Try to find which branch a merge came from"""
-                        # Look for developers who were active on non-master branches near this commit time
-                        dev = master_row["developer"]
-                        commit_time = master_row["datetime_utc"]
-                        
-                        # Window: 2 days before and 1 day after
-                        time_window = timedelta(days=3)
-                        
-                        recent_dev_activity = non_master_data[
-                            (non_master_data["developer"] == dev) &
-                            (non_master_data["datetime_utc"] >= commit_time - time_window) &
-                            (non_master_data["datetime_utc"] <= commit_time)
-                        ]
-                        
-                        if len(recent_dev_activity) > 0:
-                            # Find most active branch for this developer near this time
-                            branch_counts = recent_dev_activity["branch"].value_counts()
-                            if len(branch_counts) > 0:
-                                return branch_counts.index[0]
-                        return None
-                    
-                    billing_master_sorted["merge_source_branch"] = billing_master_sorted.apply(detect_merge_source, axis=1)
-                    
-                    # Assign colors to branches
-                    all_source_branches = sorted(billing_master_sorted[billing_master_sorted["merge_source_branch"].notna()]["merge_source_branch"].unique())
-                    branch_colors = {}
-                    source_palette = px.colors.qualitative.Set2
-                    for i, branch in enumerate(all_source_branches):
-                        branch_colors[branch] = source_palette[i % len(source_palette)]
-                    
-                    fig_master = make_subplots(
-                        rows=2, cols=1,
-                        subplot_titles=("Master Branch: Cumulative Commits", "Master Branch: Commits by Type (Merge Source Detection)"),
-                        vertical_spacing=0.15
-                    )
-                    
+                fig_master.add_trace(
+                    go.Scatter(x=master_sorted["datetime_utc"], y=master_sorted["cumulative_commits"],
+                               mode='lines+markers', name='Cumulative Commits', line=dict(color='#1f77b4')),
+                    row=1, col=1
+                )
+                
+                # Direct commits (no merge source detected)
+                direct = master_sorted[master_sorted["merge_source_branch"].isna()]
+                if len(direct) > 0:
                     fig_master.add_trace(
-                        go.Scatter(x=billing_master_sorted["datetime_utc"], y=billing_master_sorted["cumulative_commits"],
-                                   mode='lines+markers', name='Cumulative Commits', line=dict(color='#1f77b4')),
-                        row=1, col=1
+                        go.Scatter(x=direct["datetime_utc"], y=direct["net_rows"],
+                                   mode='markers', name='Direct Pushes', marker=dict(size=8, color='#2ca02c'),
+                                   hovertemplate='<b>Direct Push</b><br>Date: %{x}<br>Net Lines: %{y}<extra></extra>'),
+                        row=2, col=1
                     )
-                    
-                    # Direct commits (no merge source detected)
-                    direct = billing_master_sorted[billing_master_sorted["merge_source_branch"].isna()]
-                    if len(direct) > 0:
+                
+                # Merges by source branch (color-coded)
+                for source_branch in all_source_branches:
+                    merges_from_branch = master_sorted[master_sorted["merge_source_branch"] == source_branch]
+                    if len(merges_from_branch) > 0:
                         fig_master.add_trace(
-                            go.Scatter(x=direct["datetime_utc"], y=direct["net_rows"],
-                                       mode='markers', name='Direct Pushes', marker=dict(size=8, color='#2ca02c'),
-                                       hovertemplate='<b>Direct Push</b><br>Date: %{x}<br>Net Lines: %{y}<extra></extra>'),
+                            go.Scatter(x=merges_from_branch["datetime_utc"], y=merges_from_branch["net_rows"],
+                                       mode='markers', name=f'From: {source_branch}',
+                                       marker=dict(size=12, color=branch_colors[source_branch], symbol='star'),
+                                       hovertemplate=f'<b>Merge from {source_branch}</b><br>Date: %{{x}}<br>Net Lines: %{{y}}<br>Dev: ' + merges_from_branch["developer"].astype(str) + '<extra></extra>'),
                             row=2, col=1
                         )
-                    
-                    # Merges by source branch (color-coded)
-                    for source_branch in all_source_branches:
-                        merges_from_branch = billing_master_sorted[billing_master_sorted["merge_source_branch"] == source_branch]
-                        if len(merges_from_branch) > 0:
-                            fig_master.add_trace(
-                                go.Scatter(x=merges_from_branch["datetime_utc"], y=merges_from_branch["net_rows"],
-                                           mode='markers', name=f'From: {source_branch}',
-                                           marker=dict(size=12, color=branch_colors[source_branch], symbol='star'),
-                                           hovertemplate=f'<b>Merge from {source_branch}</b><br>Date: %{{x}}<br>Net Lines: %{{y}}<br>Dev: ' + merges_from_branch["developer"] + '<extra></extra>'),
-                                row=2, col=1
-                            )
-                    
-                    fig_master.update_xaxes(title_text="Date", row=2, col=1)
-                    fig_master.update_yaxes(title_text="Commits", row=1, col=1)
-                    fig_master.update_yaxes(title_text="Net Lines", row=2, col=1)
-                    
-                    fig_master.update_layout(
-                        title_text=f"'{billing_proj_name}' Master Branch Analysis (Merge Source Detection)",
-                        height=700,
-                        hovermode='x unified',
-                        template='plotly_white'
-                    )
-                    
-                    fig_master.write_html(f"billing_project_master_analysis.html")
-                    print(f"  ✓ billing_project_master_analysis.html (master with merge source)")
-                    
-                    # Calculate statistics
-                    merges_with_source = billing_master_sorted[billing_master_sorted["merge_source_branch"].notna()]
-                    direct_pushes = direct
-                    
-                    print(f"  Summary: Master has {len(billing_master)} commits")
-                    print(f"    - {len(direct_pushes)} direct pushes (green circles)")
-                    for source_branch in all_source_branches:
-                        count = len(billing_master_sorted[billing_master_sorted["merge_source_branch"] == source_branch])
-                        print(f"    - {count} merges from '{source_branch}' (colored stars)")
-        else:
-            print("[INFO] Billing project not found in data")
+                
+                fig_master.update_xaxes(title_text="Date", row=2, col=1)
+                fig_master.update_yaxes(title_text="Commits", row=1, col=1)
+                fig_master.update_yaxes(title_text="Net Lines", row=2, col=1)
+                
+                fig_master.update_layout(
+                    title_text=f"'{proj}' Master Branch Analysis (Merge Source Detection)",
+                    height=700,
+                    hovermode='x unified',
+                    template='plotly_white'
+                )
+                
+                fig_master.write_html(f"{safe_proj}_project_master_analysis.html")
+                print(f"  ✓ {safe_proj}_project_master_analysis.html (master with merge source)")
+                
+                # Calculate statistics
+                merges_with_source = master_sorted[master_sorted["merge_source_branch"].notna()]
+                direct_pushes = direct
+                
+                print(f"  Summary: Master has {len(master_data)} commits")
+                print(f"    - {len(direct_pushes)} direct pushes (green circles)")
+                for source_branch in all_source_branches:
+                    count = len(master_sorted[master_sorted["merge_source_branch"] == source_branch])
+                    print(f"    - {count} merges from '{source_branch}' (colored stars)")
 
         # Project-level time series visualizations
-        detail_viz["week_start"] = pd.to_datetime(detail_viz["datetime_utc"]).dt.to_period('W').apply(lambda r: r.start_time)
-        
-        project_weekly = (detail_viz
-            .groupby(["week_start", "project"], as_index=False)
-            .agg(
-                commits=("commits","sum"),
-                added_rows=("added_rows","sum"),
-                deleted_rows=("deleted_rows","sum"),
-                net_rows=("net_rows","sum"),
-            ))
+        project_weekly = (rollup(cube, ["week", "project"])
+            .rename(columns=REPORT_COLUMNS)
+            .assign(week_start=lambda t: t["week"].dt.tz_localize(None)))
         
         # Project commits over time
         fig_proj_time = px.line(
@@ -1366,14 +4269,9 @@ else:
         print(f"Summary: +{int(proj_total_added)} lines added, -{int(proj_total_deleted)} deleted, {int(proj_total_net):+d} net")
 
         # Branch-level time series visualizations
-        branch_weekly = (detail_viz
-            .groupby(["week_start", "project", "branch"], as_index=False)
-            .agg(
-                commits=("commits","sum"),
-                added_rows=("added_rows","sum"),
-                deleted_rows=("deleted_rows","sum"),
-                net_rows=("net_rows","sum"),
-            ))
+        branch_weekly = (rollup(cube, ["week", "project", "branch"], per_branch=True)
+            .rename(columns=REPORT_COLUMNS)
+            .assign(week_start=lambda t: t["week"].dt.tz_localize(None)))
         
         # Branch commits over time (faceted by project)
         fig_branch_time = px.line(
@@ -1392,7 +4290,7 @@ else:
         print("[OK] Saved chart: branch_commits_timeline.html")
         branch_total_commits = branch_weekly["commits"].sum()
         branch_total_weeks = branch_weekly["week_start"].nunique()
-        branch_count = branch_weekly.groupby(["project","branch"]).ngroups
+        branch_count = len(summary_branch)
         print(f"Summary: {branch_count} branches across {branch_weekly['project'].nunique()} projects, {int(branch_total_commits)} total commits, avg {branch_total_commits/branch_total_weeks:.1f} commits/week")
         
         # Branch net lines over time (faceted by project)
@@ -0,0 +1,159 @@
+"""
+DiffStatsCounter against the count_diff_stats() reference, and benchmarks of both over
+synthetic git/hg/svn diffs (pytest-benchmark; the 100 MB cases need --runslow).
+"""
+import random
+
+import pytest
+
+from diff_stats import DiffStatsCounter, count_diff_stats
+
+LINE_BREAKS = ["\n"] * 20 + ["\r\n"] * 4 + ["\r", "\x0b", "\x0c", "\x1c", "\x85", "\u2028", "\u2029"]
+LINES = ["diff --git a/x.py b/x.py", "Index: trunk/x.c", "+++ b/x.py", "--- a/x.py", "@@ -1,3 +1,4 @@",
+         "+added", "-removed", " context", "+", "-", "", "+++", "---x", "diff -r 1234 x.py", "+üé", "-€"]
+
+
+def stream(data, sizes, max_bytes=None):
+    counter = DiffStatsCounter(max_bytes, long_line_bytes=64)
+    pos = 0
+    for size in sizes:
+        if not counter.feed(data[pos:pos + size]):
+            break
+        pos += size
+    else:
+        counter.feed(data[pos:])
+    return counter.close().result()
+
+
+def reference(data):
+    return count_diff_stats(data.decode("utf-8", errors="replace"))
+
+
+def random_diff(rng, n_lines, breaks=LINE_BREAKS):
+    parts = []
+    for _ in range(n_lines):
+        parts.append(rng.choice(LINES).encode())
+        if rng.random() < 0.05:
+            parts.append(rng.choice([b"\xff", b"\xc3", b"\xe2\x80", b"\x80\x80"]))   # invalid UTF-8
+        parts.append(rng.choice(breaks).encode())
+    return b"".join(parts)
+
+
+def random_sizes(rng, total):
+    sizes = []
+    while sum(sizes) < total:
+        sizes.append(rng.choice([1, 2, 3, 7, 64, 100, 1000]))
+    return sizes
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_reference_with_mixed_line_breaks(seed):
+    rng = random.Random(seed)
+    data = random_diff(rng, rng.randrange(1, 300))
+    assert stream(data, random_sizes(rng, len(data))) == reference(data)
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_matches_reference_with_plain_newlines(seed):
+    rng = random.Random(seed)
+    data = random_diff(rng, rng.randrange(1, 300), breaks=["\n", "\r\n"])
+    assert stream(data, random_sizes(rng, len(data))) == reference(data)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_truncated_counts_cover_the_part_read(seed):
+    rng = random.Random(seed)
+    data = random_diff(rng, 200, breaks=["\n"])
+    max_bytes = rng.randrange(1, len(data))
+    counter = DiffStatsCounter(max_bytes)
+    pos = 0
+    for size in random_sizes(rng, len(data)):
+        if not counter.feed(data[pos:pos + size]):
+            break
+        pos += size
+    assert counter.truncated
+    assert counter.nbytes == max_bytes
+
+
+def test_only_old_mac_line_breaks_stream():
+    data = b"diff --git a/x b/x\r--- a/x\r+++ b/x\r" + b"+line\r-line\r" * 1000
+    assert stream(data, [100] * (len(data) // 100)) == reference(data) == (1000, 1000, 1)
+
+
+def test_json_body_is_kept_whole():
+    counter = DiffStatsCounter()
+    counter.feed(b'{"files": [')
+    counter.feed(b"]}")
+    counter.close()
+    assert counter.json_text == '{"files": []}'
+    assert not counter.is_diff
+
+
+# -----------------------------
+# Benchmarks
+# -----------------------------
+KB, MB = 1024, 1024 * 1024
+
+
+def hunk(rng, path):
+    lines = [f"@@ -1,{rng.randrange(1, 40)} +1,{rng.randrange(1, 40)} @@"]
+    for _ in range(rng.randrange(5, 60)):
+        kind = rng.random()
+        text = "x" * rng.randrange(0, 100)
+        lines.append(("+" if kind < 0.4 else "-" if kind < 0.7 else " ") + text)
+    return lines
+
+
+def file_diff(fmt, rng, k):
+    path = f"src/module_{k}.py"
+    if fmt == "git":
+        head = [f"diff --git a/{path} b/{path}", "index 1234567..89abcde 100644", f"--- a/{path}", f"+++ b/{path}"]
+    elif fmt == "hg":
+        head = [f"diff -r 0123456789ab -r ba9876543210 {path}", f"--- a/{path}", f"+++ b/{path}"]
+    else:
+        head = [f"Index: {path}", "=" * 67, f"--- {path}\t(revision 100)", f"+++ {path}\t(working copy)"]
+    return "\n".join(head + hunk(rng, path) + hunk(rng, path)) + "\n"
+
+
+_diffs = {}
+
+
+def synthetic_diff(fmt, size):
+    """A fmt diff of exactly size bytes; a 256 KB block of files repeated for the large ones."""
+    if (fmt, size) not in _diffs:
+        rng = random.Random(size)
+        parts, total, k = [], 0, 0
+        while total < min(size, 256 * KB):
+            parts.append(file_diff(fmt, rng, k).encode())
+            total += len(parts[-1])
+            k += 1
+        block = b"".join(parts)
+        _diffs[fmt, size] = (block * -(-size // len(block)))[:size]
+    return _diffs[fmt, size]
+
+
+def count_streamed(data, chunk=64 * KB):
+    counter = DiffStatsCounter()
+    for pos in range(0, len(data), chunk):
+        counter.feed(data[pos:pos + chunk])
+    return counter.close().result()
+
+
+SIZES = [pytest.param(KB, id="1KB"), pytest.param(MB, id="1MB"),
+         pytest.param(100 * MB, id="100MB", marks=pytest.mark.slow)]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("fmt", ["git", "hg", "svn"])
+def test_benchmark_streaming_counter(benchmark, fmt, size):
+    data = synthetic_diff(fmt, size)
+    benchmark.group = f"{fmt}-{size // KB}KB"
+    assert benchmark(count_streamed, data) == reference(data)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("fmt", ["git", "hg", "svn"])
+def test_benchmark_reference(benchmark, fmt, size):
+    data = synthetic_diff(fmt, size)
+    benchmark.group = f"{fmt}-{size // KB}KB"
+    benchmark(reference, data)